@@ -0,0 +1,115 @@
+## Functions for age and year of birth bands
+## Band edges are defined once here and used both in dataset definitions (a single
+## case() with one comparison per band, from band_expression) and offline.
+##
+## Offline, dates of birth in TPP are only recorded to the month, so the age band
+## of everyone born in a given month is the same on a given date. age_band_lookup
+## precomputes a birth month x reference date matrix of band indexes once, and
+## banding any number of patients on any of the dates is then a gather:
+##     lookup = age_band_lookup(interval_starts)
+##     bands = age_bands(lookup, date_of_birth, date_index)
+## Author: Yamina Boukari
+####
+
+import numpy as np
+
+# age at the reference date (as in utilities.build_common_vars and the census cohorts)
+age_band_edges = [16, 25, 35, 50, 65, 75, 85]
+
+# year of birth (as in the full study and date of entry cohorts)
+year_of_birth_band_edges = [1926, 1946, 1966, 1986, 2006]
+
+missing_label = "missing"
+
+
+def band_labels(edges, lower=0, upper=None):
+    """
+    Labels for the bands between edges: "lower-(edge - 1)", ..., and
+    "last edge-upper" (or "last edge plus" if there's no upper bound).
+    """
+    starts = [lower] + list(edges)
+    ends = [edge - 1 for edge in edges] + [upper]
+    return [
+        f"{start} plus" if end is None else f"{start}-{end}"
+        for start, end in zip(starts, ends)
+    ]
+
+
+def band_expression(value, edges, lower=None, upper=None, labels=None, otherwise=None):
+    """
+    An ehrQL case() assigning an integer series (e.g. age or year of birth) to
+    bands. Values below `lower` or above `upper` (when given) and nulls get
+    `otherwise`.
+    """
+    from ehrql import case, when
+
+    if labels is None:
+        labels = band_labels(edges, 0 if lower is None else lower, upper)
+    # bands are tested in order, so each only needs its upper edge
+    conditions = [value < edge for edge in edges]
+    conditions.append(value >= edges[-1] if upper is None else value <= upper)
+    if lower is not None:
+        above_lower = value >= lower
+        conditions = [above_lower & condition for condition in conditions]
+    return case(
+        *[when(condition).then(label) for condition, label in zip(conditions, labels)],
+        otherwise=otherwise,
+    )
+
+
+def band_index(values, edges):
+    """
+    Band index (0 to len(edges)) of each value.
+    """
+    return np.searchsorted(edges, values, side="right")
+
+
+def age_band_lookup(reference_dates, edges=age_band_edges, first_birth_month="1890-01"):
+    """
+    Band index of the age on each reference date for every birth month from
+    first_birth_month to the last reference date, as a (birth months x dates)
+    int8 matrix. Ages are as patients.age_on(), from the first of the birth month.
+    """
+    reference_dates = np.asarray(reference_dates, dtype="datetime64[D]")
+    first_month = np.datetime64(first_birth_month, "M")
+    birth_months = np.arange(first_month, reference_dates.max().astype("datetime64[M]") + 1)
+
+    reference_month = reference_dates.astype("datetime64[M]").astype("int64")
+    birth_month = birth_months.astype("int64")
+    # whole years from the 1st of the birth month (the birthday is the 1st, so
+    # has been reached in any day of the birth month)
+    age = (reference_month[None, :] - birth_month[:, None]) // 12
+
+    return {
+        "first_birth_month": first_month,
+        "matrix": band_index(age, edges).astype("int8"),
+        "labels": band_labels(edges),
+    }
+
+
+def age_band_index(lookup, date_of_birth, date_index):
+    """
+    Band index of each date of birth (datetime64, NaT if unknown) on the
+    reference date at date_index, gathered from the lookup. Unknown dates of
+    birth get len(lookup["labels"]) (missing). As in band_expression, dates of
+    birth before first_birth_month are in the last band and ones after the last
+    reference date (a negative age) in the first.
+    """
+    date_of_birth = np.asarray(date_of_birth, dtype="datetime64[D]")
+    month = (date_of_birth.astype("datetime64[M]") - lookup["first_birth_month"]).astype("int64")
+    known = ~np.isnat(date_of_birth)
+    # everyone born in the first row's month is in the last band on every
+    # reference date, and everyone born in the last row's month in the first
+    month = np.clip(month, 0, len(lookup["matrix"]) - 1)
+    band = np.full(len(month), len(lookup["labels"]), dtype="int64")
+    band[known] = lookup["matrix"][month[known], np.asarray(date_index)[known]]
+    return band
+
+
+def age_bands(lookup, date_of_birth, date_index):
+    """
+    Age band labels (missing_label if unknown) for each date of birth on the
+    reference date at date_index.
+    """
+    labels = np.asarray(lookup["labels"] + [missing_label], dtype=object)
+    return labels[age_band_index(lookup, date_of_birth, date_index)]
@@ -0,0 +1,229 @@
+# #############################################################################
+# Benchmark the ehrql actions in project.yaml against synthetic data
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# This is a script to run every generate-dataset and generate-measures action in
+# project.yaml against the synthetic tables from generate_synthetic_tables.py at
+# one or more sizes, and to record the wall time, peak memory (RSS) and patients
+# processed per second of each run in benchmarks/history.json.
+#
+# Each new run is compared with the median of the previous runs of the same
+# action at the same size, so that a definition change (e.g. a new migrant_flags
+# entry) that makes an action noticeably slower or hungrier is flagged. An
+# action that fails is recorded as failed and the others still run; the script
+# exits non-zero at the end if any failed.
+#
+# ehrql is run directly (by default `python -m ehrql`, as in the devcontainer)
+# rather than through `opensafely exec`, because the memory used inside a docker
+# container isn't visible from here.
+
+import json
+import os
+import shlex
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from hashlib import sha1
+from pathlib import Path
+
+import pyarrow as pa
+import yaml
+
+from generate_synthetic_tables import generate_tables, tiers
+
+history_path = Path("benchmarks/history.json")
+scratch_dir = Path("benchmarks/scratch")
+
+# a run is a regression if it is this much worse than the previous median
+# (and by more than a minimum amount, to ignore noise on small tiers)
+regression_threshold = 0.2
+minimum_difference = {"wall_time_seconds": 1.0, "peak_rss_mb": 50.0}
+history_window = 5
+
+
+def ehrql_actions(project_file="project.yaml"):
+    """
+    {action name: (command, definition file, extra arguments after --, output)}
+    for every ehrql generate-dataset/generate-measures action, where output is
+    the action's own --output (a file, or a directory such as dir/:arrow).
+    """
+    project = yaml.safe_load(Path(project_file).read_text())
+    actions = {}
+    for name, action in project["actions"].items():
+        run = shlex.split(action["run"])
+        if not run[0].startswith("ehrql:") or run[1] not in ("generate-dataset", "generate-measures"):
+            continue
+        args, extra = (run[:run.index("--")], run[run.index("--") + 1:]) if "--" in run else (run, [])
+        actions[name] = (run[1], run[2], extra, args[args.index("--output") + 1])
+    return actions
+
+
+def ensure_tables(tier, file_format="arrow"):
+    tables_dir = Path("synthetic_tables") / tier
+    if not (tables_dir / f"patients.{file_format}").exists():
+        generate_tables(tables_dir, tiers[tier], file_format=file_format)
+    return tables_dir
+
+
+def scratch_output(name, output):
+    """
+    Where to write an action's output when benchmarking, in the same shape as
+    its own --output: a directory for directory outputs (event-level datasets
+    need one), otherwise a file with the same extension.
+    """
+    output = Path(output)
+    if output.name.startswith(":"):
+        return scratch_dir / name / output.name
+    return scratch_dir / f"{name}{output.suffix}"
+
+
+def count_output_rows(path):
+    if path.name.startswith(":"):
+        # a directory output: one file per table
+        suffix = "." + path.name[1:]
+        return sum(count_output_rows(table) for table in sorted(path.parent.glob(f"*{suffix}")))
+    if path.suffix == ".arrow":
+        with pa.memory_map(str(path)) as source:
+            reader = pa.ipc.open_file(source)
+            return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    with open(path) as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+
+def run_action(name, command, definition, extra, output, tables_dir, ehrql_command):
+    output = scratch_output(name, output)
+    if output.name.startswith(":"):
+        # clear out tables from a previous run so they aren't counted again
+        shutil.rmtree(output.parent, ignore_errors=True)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    args = shlex.split(ehrql_command) + [
+        command, definition,
+        "--dummy-tables", str(tables_dir),
+        "--output", str(output),
+    ]
+    if extra:
+        args += ["--"] + extra
+
+    with tempfile.TemporaryFile() as stderr_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        # wait4 gives the resource usage of this child only (ru_maxrss is in KiB on Linux)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode(errors="replace")
+
+    result = {
+        "wall_time_seconds": round(wall_time, 3),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+    }
+    if process.returncode != 0:
+        # recorded (with the end of the error) rather than raised, so the other
+        # actions still run and this run's timings are kept
+        return {**result, "status": "failed", "error": stderr[-2000:], "output_rows": None}
+    return {**result, "status": "ok", "output_rows": count_output_rows(output)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history():
+    if history_path.exists():
+        return json.loads(history_path.read_text())
+    return []
+
+
+def find_regressions(history, record):
+    """
+    Metrics of `record` that are worse than the median of the previous runs of
+    the same action at the same tier by more than regression_threshold.
+    """
+    if record["status"] != "ok":
+        return []
+    previous = [
+        run for run in history
+        if run["action"] == record["action"] and run["tier"] == record["tier"]
+        and run.get("status", "ok") == "ok"
+    ][-history_window:]
+    if not previous:
+        return []
+
+    regressions = []
+    for metric in ("wall_time_seconds", "peak_rss_mb"):
+        baseline = statistics.median(run[metric] for run in previous)
+        if (
+            record[metric] > baseline * (1 + regression_threshold)
+            and record[metric] - baseline > minimum_difference[metric]
+        ):
+            regressions.append(f"{metric}: {record[metric]} vs median {baseline}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--tiers", nargs="+", choices=tiers, default=["10k"])
+    parser.add_argument("--actions", nargs="+", help="defaults to every ehrql action")
+    parser.add_argument("--ehrql-command", default="python -m ehrql")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    actions = ehrql_actions()
+    if args.actions:
+        actions = {name: actions[name] for name in args.actions}
+
+    history = load_history()
+    commit = git_commit()
+    all_regressions = []
+    failures = []
+
+    for tier in args.tiers:
+        tables_dir = ensure_tables(tier)
+        for name, (command, definition, extra, output) in actions.items():
+            record = {
+                "action": name,
+                "tier": tier,
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "commit": commit,
+                "definition_sha": sha1(Path(definition).read_bytes()).hexdigest(),
+                **run_action(name, command, definition, extra, output, tables_dir, args.ehrql_command),
+            }
+            regressions = find_regressions(history, record)
+            history.append(record)
+            all_regressions += [(name, tier, regression) for regression in regressions]
+
+            if record["status"] != "ok":
+                failures.append((name, tier))
+                print(f"{name} [{tier}]: FAILED after {record['wall_time_seconds']}s\n{record['error']}")
+                continue
+            record["rows_per_second"] = round(tiers[tier] / record["wall_time_seconds"], 1)
+            print(
+                f"{name} [{tier}]: {record['wall_time_seconds']}s, "
+                f"{record['peak_rss_mb']} MB, {record['rows_per_second']} patients/s"
+                + (" REGRESSION" if regressions else "")
+            )
+
+    history_path.parent.mkdir(parents=True, exist_ok=True)
+    history_path.write_text(json.dumps(history, indent=2))
+
+    for name, tier, regression in all_regressions:
+        print(f"Regression in {name} [{tier}]: {regression}")
+    for name, tier in failures:
+        print(f"Failed: {name} [{tier}]")
+    if failures or (all_regressions and args.fail_on_regression):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+# #############################################################################
+# Calendar year buckets for per-year counts in offline (python) actions
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+import numpy as np
+import pyarrow.compute as pc
+
+# years outside this range are put into the first/last bucket
+min_year = 1900
+max_year = 2030
+
+# one label per bucket, with nulls last
+year_labels = [str(year) for year in range(min_year, max_year + 1)] + ["Unknown"]
+
+
+def year_index(values):
+    """
+    Index into the per-year count arrays; nulls go into the last slot.
+    """
+    n_years = max_year - min_year + 1
+    years = pc.year(values).to_numpy(zero_copy_only=False)
+    index = np.clip(np.nan_to_num(years, nan=min_year), min_year, max_year) - min_year
+    index = index.astype("int64")
+    index[pc.is_null(values).to_numpy(zero_copy_only=False)] = n_years
+    return index
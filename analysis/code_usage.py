@@ -0,0 +1,107 @@
+## Script to describe migration code usage from the event-level export
+## (a row per patient per migration-related code, see
+## scrapyard/generate_migration_event_level_dataset.py), reading it one record batch
+## at a time. Codes are dictionary-encoded against the codes in the codelist index
+## and counted into a preallocated year x code array, so memory depends on the
+## number of codes and years, not the number of events. Year x category counts
+## (one column per migrant flag codelist, so a code in two codelists counts in
+## both) are derived from the code counts with the codelist membership matrix.
+##
+## Outputs (counts rounded with disclosure.round_counts):
+##   - code_usage_by_year_and_code.csv: events per year (and All) per code
+##   - code_usage_by_year_and_category.csv: events per year (and All) per codelist
+## Author: Yamina Boukari
+####
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from calendar_years import year_index, year_labels
+from codelist_index import build_codelist_index, membership_matrix
+from cohort_reader import iter_batches
+from disclosure import round_counts
+
+default_input = "output/cohorts/migration_event_level_dataset/migration_related_codes.arrow"
+
+
+def count_codes(path, index, code_column="snomedct_code", date_column="date"):
+    """
+    Stream the events in `path` into a (years + unknown) x (codes + other) array
+    of event counts; the last code column counts codes that aren't in the index.
+    """
+    codes = pa.array(index["codes"], type=pa.string())
+    n_codes = len(codes)
+    n_years = len(year_labels)
+    counts = np.zeros(n_years * (n_codes + 1), dtype="int64")
+
+    for batch in iter_batches(path, [code_column, date_column]):
+        code_values = batch.column(code_column)
+        if pa.types.is_dictionary(code_values.type):
+            code_values = code_values.cast(pa.string())
+        code_index = pc.index_in(code_values, value_set=codes)
+        code_index = pc.fill_null(code_index, n_codes).to_numpy(zero_copy_only=False)
+        flat = year_index(batch.column(date_column)) * (n_codes + 1) + code_index
+        counts += np.bincount(flat, minlength=counts.size)
+
+    return counts.reshape(n_years, n_codes + 1)
+
+
+def with_total(counts):
+    """
+    Add an All row (summed over years).
+    """
+    return np.vstack([counts, counts.sum(axis=0, keepdims=True)])
+
+
+def code_table(counts, index):
+    counts = with_total(counts)
+    codes = list(index["codes"]) + ["Other"]
+    table = pd.DataFrame({
+        "year": np.repeat(year_labels + ["All"], len(codes)),
+        "code": np.tile(codes, len(year_labels) + 1),
+        "n_events": counts.ravel(),
+    })
+    # only codes used in that year (a zero count isn't disclosive, but there are
+    # many codes x years with no events)
+    table = table[table["n_events"] > 0].reset_index(drop=True)
+    table["n_events"] = round_counts(table["n_events"])
+    return table
+
+
+def category_table(counts, index):
+    membership = membership_matrix(index).astype("int64")
+    category_counts = with_total(counts[:, :-1] @ membership)
+    table = pd.DataFrame({
+        "year": np.repeat(year_labels + ["All"], len(index["categories"])),
+        "category": np.tile(index["categories"], len(year_labels) + 1),
+        "n_events": category_counts.ravel(),
+    })
+    # keep years with any events
+    used_years = table.groupby("year", sort=False)["n_events"].transform("sum") > 0
+    table = table[used_years].reset_index(drop=True)
+    table["n_events"] = round_counts(table["n_events"])
+    return table
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default=default_input)
+    parser.add_argument("--output-dir", default="output/tables/code_usage")
+    args = parser.parse_args()
+
+    index = build_codelist_index()
+    counts = count_codes(args.input, index)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    code_table(counts, index).to_csv(output_dir / "code_usage_by_year_and_code.csv", index=False)
+    category_table(counts, index).to_csv(output_dir / "code_usage_by_year_and_category.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+## Script to compile the codelist CSVs into a single JSON artefact
+## so that actions don't re-parse ~6,000 rows of CSV every time codelists.py
+## is imported. The artefact is committed alongside the CSVs, so every checkout
+## (including the backend's) starts with it, and is keyed on the sha of every
+## codelist in codelists/codelists.json (and the set of codelists requested).
+## If it is stale, actions compile the CSVs in memory and leave it untouched:
+## only this script writes it.
+## After updating a codelist, rebuild it with:
+##     python analysis/codelist_compiler.py
+## and check it is up to date (as CI does) with:
+##     python analysis/codelist_compiler.py --check
+## Author: Yamina Boukari
+####
+
+import csv
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+codelists_dir = Path("codelists")
+manifest_path = codelists_dir / "codelists.json"
+artefact_path = codelists_dir / "compiled_codelists.json"
+
+_loaded = None
+
+
+def read_codelist_csv(filename, column, category_column=None):
+    """
+    Read a codelist CSV in the same way as ehrql's codelist_from_csv:
+      - returns a tuple of codes, or
+      - a dict of code -> category if category_column is given, or
+      - a dict of code -> (category, category, ...) if category_column is a
+        tuple of columns, so several categorisations need only one read
+    """
+    with open(codelists_dir / filename, newline="") as f:
+        rows = [
+            row for row in csv.DictReader(f)
+            if row[column].strip()
+        ]
+    if category_column is None:
+        return tuple(row[column].strip() for row in rows)
+    if isinstance(category_column, tuple):
+        return {
+            row[column].strip(): tuple(row[level] for level in category_column)
+            for row in rows
+        }
+    return {row[column].strip(): row[category_column] for row in rows}
+
+
+def category_level(codelist, level):
+    """
+    Single-level code -> category dict from a multi-level codelist.
+    """
+    return {code: categories[level] for code, categories in codelist.items()}
+
+
+def file_sha(filename, manifest):
+    """
+    The sha recorded by opencodelists in codelists.json, falling back to a
+    hash of the file for codelists that aren't in the manifest.
+    """
+    if filename in manifest:
+        return manifest[filename]["sha"]
+    return hashlib.sha1((codelists_dir / filename).read_bytes()).hexdigest()
+
+
+def as_json(value):
+    # tuples become lists, so compiled codelists are the same whether they
+    # were just compiled or read back from the artefact
+    return json.loads(json.dumps(value))
+
+
+def fingerprint(specs):
+    manifest = json.loads(manifest_path.read_text())["files"]
+    return as_json({
+        name: (filename, column, category_column, file_sha(filename, manifest))
+        for name, (filename, column, category_column) in specs.items()
+    })
+
+
+def compile_codelists(specs):
+    return as_json({
+        "fingerprint": fingerprint(specs),
+        "codelists": {
+            name: read_codelist_csv(filename, column, category_column)
+            for name, (filename, column, category_column) in specs.items()
+        },
+    })
+
+
+def write_artefact(compiled, path=artefact_path):
+    # write to a temporary file first so a half-written artefact is never read
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            # one codelist entry per line, so updates diff cleanly
+            json.dump(compiled, f, indent=1, sort_keys=True)
+            f.write("\n")
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_artefact(path=artefact_path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load(specs):
+    """
+    Return {name: codelist} for the given specs, from the artefact if it is
+    up to date and otherwise by compiling the CSVs in memory. Loading never
+    writes the artefact (actions mustn't write into codelists/); it's only
+    written by running this script.
+    """
+    global _loaded
+    current = fingerprint(specs)
+    if _loaded is not None and _loaded["fingerprint"] == current:
+        return _loaded["codelists"]
+
+    compiled = read_artefact()
+    if compiled is None or compiled["fingerprint"] != current:
+        compiled = compile_codelists(specs)
+
+    _loaded = compiled
+    return compiled["codelists"]
+
+
+def is_up_to_date(specs, path=artefact_path):
+    compiled = read_artefact(path)
+    return compiled is not None and compiled == compile_codelists(specs)
+
+
+if __name__ == "__main__":
+    import codelists
+
+    if "--check" in sys.argv[1:]:
+        if not is_up_to_date(codelists.codelist_specs):
+            sys.exit(f"{artefact_path} is out of date: run python analysis/codelist_compiler.py")
+    else:
+        write_artefact(compile_codelists(codelists.codelist_specs))
@@ -0,0 +1,155 @@
+## Script to build a code x category membership index over the migrant flag codelists
+## Each SNOMED code gets a single integer (a bitmask with one bit per migrant flag)
+## so events can be classified into every flag with one lookup, and the index is
+## used to check that all_migrant_codes covers the migrant sub-codelists.
+## Author: Yamina Boukari
+####
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import codelists
+
+# flag whose codelist should contain every migrant sub-codelist
+superset_flag = "any_migrant"
+
+# flags that are not meant to be covered by all_migrant_codes
+# (non-migrant codelists, and the date of UK entry code that was found later)
+uncovered_flags = ("born_in_uk", "british_ethnicities", "date_of_uk_entry")
+
+
+def build_codelist_index(flag_codelists=None):
+    """
+    Build the membership index for {flag name: codes}, by default the codelists
+    behind migration_status_variables.migrant_flags. Returns a dict with:
+      - categories: flag names, in bit order
+      - codes: sorted array of every code in any codelist
+      - rows, cols: the non-zero entries of the sparse code x category matrix
+      - masks: per-code bitmask (bit i set if the code is in categories[i])
+    """
+    if flag_codelists is None:
+        flag_codelists = {
+            name: getattr(codelists, codelist_name)
+            for name, codelist_name in codelists.migrant_flag_codelists.items()
+        }
+
+    categories = list(flag_codelists)
+    codes = np.array(sorted(set().union(*map(set, flag_codelists.values()))), dtype=object)
+
+    rows = []
+    cols = []
+    for category_id, name in enumerate(categories):
+        members = np.searchsorted(codes, np.array(sorted(set(flag_codelists[name])), dtype=object))
+        rows.append(members)
+        cols.append(np.full(len(members), category_id))
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+
+    masks = np.zeros(len(codes), dtype="int64")
+    np.bitwise_or.at(masks, rows, np.left_shift(1, cols))
+
+    return {
+        "categories": categories,
+        "codes": codes,
+        "rows": rows,
+        "cols": cols,
+        "masks": masks,
+    }
+
+
+def category_bit(index, name):
+    return 1 << index["categories"].index(name)
+
+
+def code_masks(index):
+    """
+    Dict of code -> bitmask, for classifying single codes with one lookup.
+    """
+    return dict(zip(index["codes"], index["masks"].tolist()))
+
+
+def lookup_masks(index, codes):
+    """
+    Vectorised lookup of the bitmask for an array of codes (0 if not in any codelist).
+    """
+    codes = np.asarray(codes, dtype=object)
+    position = np.searchsorted(index["codes"], codes)
+    position = np.clip(position, 0, len(index["codes"]) - 1)
+    found = index["codes"][position] == codes
+    return np.where(found, index["masks"][position], 0)
+
+
+def membership_matrix(index):
+    """
+    Dense boolean code x category matrix (only used for reporting).
+    """
+    matrix = np.zeros((len(index["codes"]), len(index["categories"])), dtype=bool)
+    matrix[index["rows"], index["cols"]] = True
+    return matrix
+
+
+def overlap_report(index):
+    """
+    Category x category table of the number of codes in both codelists
+    (the diagonal is the size of each codelist).
+    """
+    matrix = membership_matrix(index).astype("int64")
+    return pd.DataFrame(
+        matrix.T @ matrix,
+        index=index["categories"],
+        columns=index["categories"],
+    )
+
+
+def gap_report(index):
+    """
+    Codes in a migrant sub-codelist that are missing from all_migrant_codes,
+    and codes in all_migrant_codes that aren't in any sub-codelist.
+    """
+    superset_bit = category_bit(index, superset_flag)
+    sub_bits = 0
+    gaps = []
+    for name in index["categories"]:
+        if name == superset_flag or name in uncovered_flags:
+            continue
+        bit = category_bit(index, name)
+        sub_bits |= bit
+        missing = (index["masks"] & bit != 0) & (index["masks"] & superset_bit == 0)
+        gaps.append(pd.DataFrame({
+            "category": name,
+            "gap": f"not in {superset_flag}",
+            "code": index["codes"][missing],
+        }))
+
+    unassigned = (index["masks"] & superset_bit != 0) & (index["masks"] & sub_bits == 0)
+    gaps.append(pd.DataFrame({
+        "category": superset_flag,
+        "gap": "not in any sub-codelist",
+        "code": index["codes"][unassigned],
+    }))
+    return pd.concat(gaps, ignore_index=True)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--output-dir", default="output/codelist_index")
+    args = parser.parse_args()
+
+    index = build_codelist_index()
+    overlaps = overlap_report(index)
+    gaps = gap_report(index)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    overlaps.to_csv(output_dir / "codelist_overlaps.csv")
+    gaps.to_csv(output_dir / "codelist_gaps.csv", index=False)
+
+    print(overlaps.to_string())
+    print(gaps.groupby(["category", "gap"]).size().to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -3,34 +3,75 @@
 ## Author: Yamina Boukari
 ####
 
-from ehrql import codelist_from_csv
+# Codelists are loaded lazily from the compiled artefact (see codelist_compiler.py)
+# the first time any of them is used, rather than parsing every CSV on import.
+# Each entry is (filename, code column, category column); plain codelists are
+# lists of codes and categorised codelists are dicts of code -> category, as
+# returned by ehrql's codelist_from_csv.
 
-all_migrant_codes = codelist_from_csv("codelists/opensafely-migration-status.csv", column="code")
+import codelist_compiler
 
-uk_cob_codes = codelist_from_csv("codelists/opensafely-born-in-the-uk.csv", column="code")
+codelist_specs = {
+    "all_migrant_codes": ("opensafely-migration-status.csv", "code", None),
+    "uk_cob_codes": ("opensafely-born-in-the-uk.csv", "code", None),
+    "cob_migrant_codes": ("opensafely-born-outside-the-uk.csv", "code", None),
+    "immigra_status_excl_ref_and_asylum_codes": ("opensafely-immigration-status-excl-refugee-asylum.csv", "code", None),
+    "asylum_refugee_migrant_codes": ("opensafely-asylum-or-refugee-status.csv", "code", None),
+    "english_not_main_language_excl_interpreter_migrant_codes": ("opensafely-english-not-main-language.csv", "code", None),
+    "interpreter_migrant_codes": ("opensafely-interpreter-required.csv", "code", None),
+    "trafficking_codes": ("opensafely-trafficking-and-modern-slavery.csv", "code", None),
+    "british_ethnicities_codes": ("opensafely-british-ethnicities.csv", "code", None),
+    # code -> (6-level group, 16-level group), read from the CSV once
+    "ethnicity_codelist": ("opensafely-ethnicity-snomed-0removed.csv", "code", ("Label_6", "Label_16")),
+}
 
-cob_migrant_codes = codelist_from_csv("codelists/opensafely-born-outside-the-uk.csv", column="code")
+# single-level views of multi-level codelists, for ehrql's to_category
+codelist_levels = {
+    "ethnicity_6_level_codelist": ("ethnicity_codelist", 0),
+    "ethnicity_16_level_codelist": ("ethnicity_codelist", 1),
+}
 
-immigra_status_excl_ref_and_asylum_codes = codelist_from_csv("codelists/opensafely-immigration-status-excl-refugee-asylum.csv", column="code")
+# date of entry to the UK is a single code that is not in the BJGPO migration codelist
+date_of_uk_entry_codes = ["860021000000109"]
 
-asylum_refugee_migrant_codes = codelist_from_csv("codelists/opensafely-asylum-or-refugee-status.csv", column="code")
+# codelist behind each migrant flag in migration_status_variables.migrant_flags
+migrant_flag_codelists = {
+    "any_migrant": "all_migrant_codes",
+    "born_in_uk": "uk_cob_codes",
+    "not_born_in_uk": "cob_migrant_codes",
+    "immig_status_excl_refugee_asylum": "immigra_status_excl_ref_and_asylum_codes",
+    "refugee_asylum_status": "asylum_refugee_migrant_codes",
+    "english_not_main_language": "english_not_main_language_excl_interpreter_migrant_codes",
+    "interpreter_required": "interpreter_migrant_codes",
+    "trafficking": "trafficking_codes",
+    "british_ethnicities": "british_ethnicities_codes",
+    "date_of_uk_entry": "date_of_uk_entry_codes",
+}
 
-english_not_main_language_excl_interpreter_migrant_codes = codelist_from_csv("codelists/opensafely-english-not-main-language.csv", column="code")
+# migrant flags whose codes make up any_migrant
+migrant_component_flags = [
+    "not_born_in_uk",
+    "immig_status_excl_refugee_asylum",
+    "refugee_asylum_status",
+    "english_not_main_language",
+    "interpreter_required",
+    "trafficking",
+]
 
-interpreter_migrant_codes = codelist_from_csv("codelists/opensafely-interpreter-required.csv", column="code")
+__all__ = (
+    list(codelist_specs)
+    + list(codelist_levels)
+    + ["date_of_uk_entry_codes", "migrant_flag_codelists", "migrant_component_flags"]
+)
 
-trafficking_codes = codelist_from_csv("codelists/opensafely-trafficking-and-modern-slavery.csv", column="code")
 
-british_ethnicities_codes = codelist_from_csv("codelists/opensafely-british-ethnicities.csv", column="code")
-
-ethnicity_16_level_codelist =  codelist_from_csv(
-            "codelists/opensafely-ethnicity-snomed-0removed.csv",
-            column="code",
-            category_column="Label_16",
-        )
-
-ethnicity_6_level_codelist =  codelist_from_csv(
-            "codelists/opensafely-ethnicity-snomed-0removed.csv",
-            column="code",
-            category_column="Label_6",
-        )
\ No newline at end of file
+def __getattr__(name):
+    if name not in codelist_specs and name not in codelist_levels:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    loaded = codelist_compiler.load(codelist_specs)
+    for loaded_name, codelist in loaded.items():
+        # hand out copies so callers can't mutate the shared compiled codelists
+        globals()[loaded_name] = dict(codelist) if isinstance(codelist, dict) else list(codelist)
+    for level_name, (codelist_name, level) in codelist_levels.items():
+        globals()[level_name] = codelist_compiler.category_level(loaded[codelist_name], level)
+    return globals()[name]
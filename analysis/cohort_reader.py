@@ -0,0 +1,59 @@
+## Functions for reading cohort arrow files in bounded memory
+## The file is memory-mapped and read one record batch at a time, keeping only the
+## requested columns and the rows matching an optional filter, so summary scripts
+## never hold the whole cohort in memory. Filters are pyarrow expressions, e.g.
+##     import pyarrow.compute as pc
+##     for batch in iter_batches(cohort_file, ["sex", "region"], filter=pc.field("any_migrant")):
+##         ...
+## The R equivalents are in analysis/lib/cohort_reader.R.
+## Author: Yamina Boukari
+####
+
+from pathlib import Path
+
+import pyarrow.dataset as ds
+import pyarrow.fs as pa_fs
+
+# rows per batch, and how many batches the scanner reads ahead
+batch_size = 128 * 1024
+batch_readahead = 2
+
+
+def open_cohort(path):
+    """
+    A pyarrow dataset over a cohort arrow file, backed by a memory map.
+    """
+    return ds.dataset(
+        str(Path(path).resolve()),
+        format="ipc",
+        filesystem=pa_fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def iter_batches(path, columns=None, filter=None, batch_size=batch_size):
+    """
+    Yield record batches of `columns` (all columns if None) for the rows
+    matching `filter`. The filter can use columns that aren't selected.
+    """
+    scanner = open_cohort(path).scanner(
+        columns=columns,
+        filter=filter,
+        batch_size=batch_size,
+        batch_readahead=batch_readahead,
+        fragment_readahead=1,
+    )
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch
+
+
+def read_columns(path, columns=None, filter=None):
+    """
+    The selected columns and rows as one table (for when the projection is
+    small enough to hold in memory).
+    """
+    return open_cohort(path).to_table(columns=columns, filter=filter)
+
+
+def count_rows(path, filter=None):
+    return open_cohort(path).count_rows(filter=filter)
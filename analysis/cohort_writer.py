@@ -0,0 +1,176 @@
+## Functions for writing cohort outputs in bounded memory
+## CohortWriter takes record batches (or tables) of any size as they are produced
+## and writes them to an arrow or parquet file as fixed-size record batches (parquet
+## row groups), so only one output batch is ever held in memory. The batch size is
+## given directly or derived from a memory budget and the schema:
+##     with CohortWriter(path, schema, memory_budget=256 * 2**20) as writer:
+##         for batch in batches:
+##             writer.write(batch)
+## Categorical (dictionary-encoded) columns can come with a different dictionary in
+## each input batch (e.g. one per shard in sharded_extract.py). They're re-encoded
+## against one dictionary per column that only grows, so later batches only add
+## dictionary deltas. The output is written to <path>.partial and moved into place
+## when the writer is closed, so a failed run never leaves a truncated cohort.
+##
+## Run on its own, it rewrites an existing cohort arrow file (e.g. to parquet):
+##     python analysis/cohort_writer.py --input output/cohorts/x.arrow --output output/cohorts/x.parquet
+## Author: Yamina Boukari
+####
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from cohort_reader import iter_batches
+
+default_memory_budget = 256 * 2**20
+
+# assumed bytes per value of variable-width columns (codes, labels)
+string_bytes = 32
+
+
+def row_bytes(schema):
+    """
+    Estimated in-memory bytes per row of a schema.
+    """
+    total = 0
+    for field in schema:
+        value_type = field.type.index_type if pa.types.is_dictionary(field.type) else field.type
+        try:
+            total += max(value_type.bit_width // 8, 1)
+        except ValueError:
+            total += string_bytes
+    return total
+
+
+def rows_for_budget(schema, memory_budget=default_memory_budget):
+    """
+    Rows per batch so that a batch being filled and the batch being written fit
+    in the budget.
+    """
+    return max(memory_budget // (2 * row_bytes(schema)), 1024)
+
+
+class CohortWriter:
+    """
+    Writes record batches to an arrow or parquet file (by suffix) as batches of
+    batch_size rows.
+    """
+
+    def __init__(self, path, schema, batch_size=None, memory_budget=default_memory_budget):
+        self.path = Path(path)
+        self.schema = schema
+        self.batch_size = batch_size or rows_for_budget(schema, memory_budget)
+        self.dictionaries = {
+            field.name: pa.array([], type=field.type.value_type)
+            for field in schema if pa.types.is_dictionary(field.type)
+        }
+        self.pending = []
+        self.pending_rows = 0
+        self.rows = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp = self.path.with_name(self.path.name + ".partial")
+        if self.path.suffix == ".parquet":
+            self.writer = pq.ParquetWriter(str(self.tmp), schema)
+        else:
+            options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            self.writer = pa.ipc.new_file(str(self.tmp), schema, options=options)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.writer.close()
+            self.tmp.unlink(missing_ok=True)
+
+    def encode(self, name, values):
+        """
+        Indices of a dictionary column's values in the writer's dictionary,
+        adding any values it hasn't seen.
+        """
+        dictionary = self.dictionaries[name]
+        new_values = values.dictionary.filter(pc.invert(pc.is_in(values.dictionary, value_set=dictionary)))
+        if len(new_values):
+            dictionary = pa.concat_arrays([dictionary, new_values])
+            self.dictionaries[name] = dictionary
+        positions = pc.index_in(values.dictionary, value_set=dictionary).cast(values.type.index_type)
+        return positions.take(values.indices)
+
+    def write(self, batch):
+        if isinstance(batch, pa.Table):
+            for table_batch in batch.to_batches(max_chunksize=self.batch_size):
+                self.write(table_batch)
+            return
+        # dictionary columns are held as indices until the batch is written
+        columns = [
+            self.encode(field.name, column) if field.name in self.dictionaries else column
+            for field, column in zip(self.schema, batch.select(self.schema.names).columns)
+        ]
+        offset = 0
+        while offset < batch.num_rows:
+            length = min(self.batch_size - self.pending_rows, batch.num_rows - offset)
+            self.pending.append([column.slice(offset, length) for column in columns])
+            self.pending_rows += length
+            offset += length
+            if self.pending_rows == self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self.pending_rows:
+            return
+        columns = []
+        for i, field in enumerate(self.schema):
+            column = pa.concat_arrays([chunk[i] for chunk in self.pending])
+            if field.name in self.dictionaries:
+                column = pa.DictionaryArray.from_arrays(column, self.dictionaries[field.name])
+            columns.append(column)
+        batch = pa.RecordBatch.from_arrays(columns, schema=self.schema)
+        if isinstance(self.writer, pq.ParquetWriter):
+            self.writer.write_batch(batch, row_group_size=self.batch_size)
+        else:
+            self.writer.write_batch(batch)
+        self.rows += batch.num_rows
+        self.pending = []
+        self.pending_rows = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.tmp.replace(self.path)
+        return self.rows
+
+
+def rewrite_cohort(input_path, output_path, batch_size=None, memory_budget=default_memory_budget):
+    """
+    Copy a cohort arrow file to `output_path` (arrow or parquet) in fixed-size
+    batches. Returns the number of rows written.
+    """
+    batches = iter_batches(input_path)
+    schema = pa.ipc.open_file(pa.memory_map(str(input_path))).schema
+    with CohortWriter(output_path, schema, batch_size, memory_budget) as writer:
+        for batch in batches:
+            writer.write(batch)
+    return writer.rows
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output", required=True, help="an .arrow or .parquet file")
+    parser.add_argument("--batch-size", type=int, default=None, help="rows per batch (default: from the memory budget)")
+    parser.add_argument("--memory-budget-mb", type=int, default=default_memory_budget // 2**20)
+    args = parser.parse_args()
+
+    rows = rewrite_cohort(args.input, args.output, args.batch_size, args.memory_budget_mb * 2**20)
+    print(f"{rows} rows written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+## Script for monthly cumulative migration coding curves
+## For each month from January 2009 and each build_migrant_indicators category:
+## the number of patients registered at the end of the month, how many of them had
+## a code in that category on or before the end of the month, and the proportion.
+##
+## The input (dataset_definition_cumulative_coding.py) has each patient's first
+## code date per category and their registration spells. Every date is mapped to
+## a month index, overlapping registrations for a patient are merged, and each
+## (clipped) spell adds +1 to the month it starts and -1 to the month after it
+## ends; a prefix sum over months then gives every curve, so the work is
+## O(spells x categories + months) however many months there are.
+##
+## Outputs (counts rounded with disclosure.round_counts):
+##   - cumulative_coding_by_month.csv: month, category, n_registered, n_coded, proportion_coded
+## Author: Yamina Boukari
+####
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from codelists import migrant_flag_codelists
+from cohort_reader import read_columns
+from disclosure import round_counts
+
+default_input_dir = "output/cohorts/cumulative_coding"
+start_month = "2009-01"
+end_month = "2025-12"
+
+categories = list(migrant_flag_codelists)
+
+
+def month_ends(start=start_month, end=end_month):
+    """
+    Day numbers (since 1970-01-01) of the last day of each month.
+    """
+    months = np.arange(np.datetime64(start, "M"), np.datetime64(end, "M") + 1)
+    return (months + 1).astype("datetime64[D]").astype("int64") - 1
+
+
+def days(column):
+    """
+    Dates as float day numbers, with nulls as NaN.
+    """
+    return pc.cast(pc.cast(column, pa.int32()), pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def first_month_on_or_after(dates, snapshots):
+    """
+    Index of the first month end on or after each date (len(snapshots) for null
+    dates, i.e. never).
+    """
+    index = np.searchsorted(snapshots, dates, side="left")
+    return np.where(np.isnan(dates), len(snapshots), index)
+
+
+def first_month_after(dates, snapshots):
+    """
+    Index of the first month end after each date (len(snapshots) for null dates,
+    i.e. ongoing).
+    """
+    index = np.searchsorted(snapshots, dates, side="right")
+    return np.where(np.isnan(dates), len(snapshots), index)
+
+
+def merge_spells(patient, start, stop):
+    """
+    Merge each patient's overlapping or adjacent [start, stop) month spells.
+    Returns (patient, start, stop) of the merged spells.
+    """
+    keep = start < stop
+    patient, start, stop = patient[keep], start[keep], stop[keep]
+    order = np.lexsort((start, patient))
+    patient, start, stop = patient[order], start[order], stop[order]
+
+    # running maximum of stop within each patient (patients are sorted, so
+    # offsetting by patient keeps the running maximum from crossing patients)
+    offset = patient.astype("int64") * (stop.max(initial=0) + 1)
+    covered_to = np.maximum.accumulate(stop + offset) - offset
+    previous_covered_to = np.concatenate([[-1], covered_to[:-1]])
+    new_patient = np.concatenate([[True], patient[1:] != patient[:-1]])
+    block_start = new_patient | (start > previous_covered_to)
+
+    block = np.cumsum(block_start) - 1
+    merged_stop = np.zeros(block[-1] + 1 if len(block) else 0, dtype="int64")
+    np.maximum.at(merged_stop, block, covered_to)
+    return patient[block_start], start[block_start], merged_stop
+
+
+def month_counts(start, stop, n_months):
+    """
+    Number of spells covering each month, from +1/-1 at the spell boundaries.
+    """
+    keep = start < stop
+    changes = np.bincount(start[keep], minlength=n_months + 1)
+    changes -= np.bincount(stop[keep], minlength=n_months + 1)
+    return np.cumsum(changes)[:n_months]
+
+
+def cumulative_coding(input_dir=default_input_dir, start=start_month, end=end_month):
+    input_dir = Path(input_dir)
+    snapshots = month_ends(start, end)
+    n_months = len(snapshots)
+
+    patients = read_columns(
+        input_dir / "dataset.arrow",
+        ["patient_id", "date_of_death", "ons_date_of_death"] + [f"first_{name}_date" for name in categories],
+    )
+    registrations = read_columns(input_dir / "practice_registrations.arrow", ["patient_id", "start_date", "end_date"])
+
+    # registration spells as month ranges, ended by death (TPP or ONS)
+    patient_index = pc.index_in(registrations.column("patient_id"), value_set=patients.column("patient_id"))
+    in_population = pc.is_valid(patient_index).to_numpy(zero_copy_only=False)
+    patient = pc.fill_null(patient_index, 0).to_numpy(zero_copy_only=False)[in_population]
+
+    death = np.fmin(days(patients.column("date_of_death")), days(patients.column("ons_date_of_death")))
+    spell_start = first_month_on_or_after(days(registrations.column("start_date"))[in_population], snapshots)
+    spell_stop = np.minimum(
+        first_month_after(days(registrations.column("end_date"))[in_population], snapshots),
+        first_month_after(death, snapshots)[patient],
+    )
+    patient, spell_start, spell_stop = merge_spells(patient, spell_start, spell_stop)
+
+    n_registered = month_counts(spell_start, spell_stop, n_months)
+
+    results = []
+    for name in categories:
+        first_code = first_month_on_or_after(days(patients.column(f"first_{name}_date")), snapshots)
+        n_coded = month_counts(np.maximum(spell_start, first_code[patient]), spell_stop, n_months)
+        results.append(pd.DataFrame({
+            "month": snapshots.astype("datetime64[D]").astype("datetime64[M]").astype(str),
+            "category": name,
+            "n_registered": n_registered,
+            "n_coded": n_coded,
+        }))
+    return pd.concat(results, ignore_index=True)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input-dir", default=default_input_dir)
+    parser.add_argument("--output", default="output/tables/cumulative_coding_by_month.csv")
+    parser.add_argument("--start-month", default=start_month)
+    parser.add_argument("--end-month", default=end_month)
+    args = parser.parse_args()
+
+    curves = cumulative_coding(args.input_dir, args.start_month, args.end_month)
+    curves["n_registered"] = round_counts(curves["n_registered"])
+    curves["n_coded"] = round_counts(curves["n_coded"])
+    curves["proportion_coded"] = curves["n_coded"] / curves["n_registered"]
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    curves.to_csv(args.output, index=False)
+    print(f"{len(curves)} rows written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
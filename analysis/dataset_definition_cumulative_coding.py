@@ -0,0 +1,65 @@
+# #############################################################################
+# Cumulative migration coding cohort
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# Inputs for analysis/cumulative_coding.py: for everyone in the full study
+# cohort population, the date of their first code in each of the
+# build_migrant_indicators categories and their date of death, plus an event
+# table with each of their practice registrations, so the monthly curves can be
+# computed offline instead of with ~200 monthly measures intervals.
+#
+# The first code dates are also the base state for analysis/sensitivity_sweep.py
+# (flags on any end date are first date <= end date).
+
+from ehrql import create_dataset
+from ehrql.tables.tpp import patients, practice_registrations
+import age_bands
+import migration_status_variables
+import population
+
+# Dates
+
+study_start_date = "2009-01-01"
+study_end_date = "2025-12-31"
+
+dataset = create_dataset()
+dataset.define_population(population.study_population(study_start_date, study_end_date))
+
+# date of first code in each category
+
+first_code_dates = migration_status_variables.build_first_migrant_code_dates(study_end_date)
+
+for name, first_code_date in first_code_dates.items():
+    setattr(dataset, f"first_{name}_date", first_code_date)
+
+# date of first any_migrant code outside each of its components (for
+# sensitivity_sweep.py, which drops codelists)
+
+first_code_dates_excluding = migration_status_variables.build_first_any_migrant_code_dates_excluding(study_end_date)
+
+for name, first_code_date in first_code_dates_excluding.items():
+    setattr(dataset, f"first_any_migrant_excl_{name}_date", first_code_date)
+
+# sex and year of birth band
+
+dataset.sex = patients.sex
+dataset.year_of_birth_band = age_bands.band_expression(
+    patients.date_of_birth.year, age_bands.year_of_birth_band_edges, lower=1898, upper=2025
+)
+
+# death (TPP or ONS, whichever is first)
+
+dataset.date_of_death = population.date_of_death
+dataset.ons_date_of_death = population.ons_date_of_death
+
+# registration spells
+
+dataset.add_event_table(
+    "practice_registrations",
+    start_date=practice_registrations.start_date,
+    end_date=practice_registrations.end_date,
+)
+
+dataset.configure_dummy_data(population_size=1000)
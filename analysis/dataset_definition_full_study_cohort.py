@@ -11,76 +11,23 @@
 #         4) did not die before or on 1st Jan 2009 (study start) AND 
 #         4) had a plausible age at the beginning of the study period  (i.e. not >110 years old in 2009)
 
-from pathlib import Path
-
-from ehrql import create_dataset, codelist_from_csv, show, case, when, days
-from ehrql.tables.tpp import addresses, patients, practice_registrations, clinical_events, ons_deaths
+from ehrql import create_dataset, show, case, when
+from ehrql.tables.tpp import addresses, patients, practice_registrations, clinical_events
+import age_bands
 import codelists
 import migration_status_variables
+import population
+import utilities
 
 # Dates
 
 study_start_date = "2009-01-01"
 study_end_date = "2025-12-31" 
 
-date_of_first_practice_registration = (
-    practice_registrations.sort_by(practice_registrations.start_date)
-    .first_for_patient().start_date
-)
-
-end_date_of_latest_practice_registration = (
-    practice_registrations.sort_by(practice_registrations.end_date)
-    .last_for_patient().end_date
-)
-
-is_registered_at_any_time_during_study = (
-    # starts during period
-    date_of_first_practice_registration.is_on_or_between(
-        study_start_date,
-        study_end_date,
-    )
-    # ending during period
-    | end_date_of_latest_practice_registration.is_on_or_between(
-        study_start_date,
-        study_end_date,
-    )
-    # starting before and ending after (or ongoing)
-    | (
-        date_of_first_practice_registration.is_on_or_before(study_start_date)
-        & (
-            end_date_of_latest_practice_registration.is_on_or_after(study_end_date)
-            | end_date_of_latest_practice_registration.is_null()
-        )
-    )
-)
-
-has_first_registration_between_birth_and_death = (
-    # between dob and date of death
-    (date_of_first_practice_registration.is_on_or_between(patients.date_of_birth, patients.date_of_death)) | 
-    # after dob and date of death is null (still alive)
-    (date_of_first_practice_registration.is_on_or_after(patients.date_of_birth) & patients.date_of_death.is_null())
-)
-   
-
-has_non_disclosive_sex = (
-    (patients.sex == "male") | (patients.sex == "female")
-)
-
-did_not_die_before_study_start = (
-    ((patients.date_of_death > study_start_date) | (patients.date_of_death.is_null())) &
-    ((ons_deaths.date > study_start_date) | (ons_deaths.date.is_null()))
-)
-
-was_not_over_110_at_study_start_or_less_than_0_at_end_date = (
-    (patients.age_on(study_start_date) <= 110) & (patients.age_on(study_end_date) >= 0)
-)
+date_of_first_practice_registration = population.date_of_first_practice_registration
 
 dataset = create_dataset()
-dataset.define_population(is_registered_at_any_time_during_study & 
-                          has_first_registration_between_birth_and_death &
-                          has_non_disclosive_sex & 
-                          did_not_die_before_study_start & 
-                          was_not_over_110_at_study_start_or_less_than_0_at_end_date)
+dataset.define_population(population.study_population(study_start_date, study_end_date))
 
 # add variables 
 
@@ -88,13 +35,8 @@ dataset.define_population(is_registered_at_any_time_during_study &
 year_of_birth = (patients.date_of_birth).year
 dataset.year_of_birth = year_of_birth
 
-dataset.year_of_birth_band = case(
-    when((year_of_birth >= 1898) & (year_of_birth <= 1925)).then("1898-1925"),
-    when((year_of_birth > 1925) & (year_of_birth <= 1945)).then("1926-1945"),
-    when((year_of_birth > 1945) & (year_of_birth <= 1965)).then("1946-1965"),
-    when((year_of_birth > 1965) & (year_of_birth <= 1985)).then("1966-1985"),
-    when((year_of_birth > 1985) & (year_of_birth <= 2005)).then("1986-2005"),
-    when((year_of_birth > 2005) & (year_of_birth <= 2025)).then("2006-2025") 
+dataset.year_of_birth_band = age_bands.band_expression(
+    year_of_birth, age_bands.year_of_birth_band_edges, lower=1898, upper=2025
 )
 
 dataset.date_of_birth = patients.date_of_birth
@@ -105,21 +47,11 @@ dataset.sex = patients.sex
 
 ## ethnicity
 
-latest_ethnicity_code = (
-    clinical_events.where(clinical_events.snomedct_code.is_in(codelists.ethnicity_16_level_codelist))
-    .where(clinical_events.date.is_on_or_before(study_end_date)) 
-    .sort_by(clinical_events.date)
-    .last_for_patient()
-    .snomedct_code)
-dataset.latest_ethnicity_code = latest_ethnicity_code
-
-latest_ethnicity_16_level_group = latest_ethnicity_code.to_category(
-    codelists.ethnicity_16_level_codelist)
-dataset.latest_ethnicity_16_level_group = latest_ethnicity_16_level_group
+ethnicity_vars = utilities.build_ethnicity_vars(study_end_date)
 
-latest_ethnicity_6_level_group = latest_ethnicity_code.to_category(
-    codelists.ethnicity_6_level_codelist)
-dataset.latest_ethnicity_6_level_group = latest_ethnicity_6_level_group
+dataset.latest_ethnicity_code = ethnicity_vars["latest_ethnicity_code"]
+dataset.latest_ethnicity_16_level_group = ethnicity_vars["latest_ethnicity_16_level_group"]
+dataset.latest_ethnicity_6_level_group = ethnicity_vars["latest_ethnicity_6_level_group"]
 
 ## practice region (latest during the study period)
 
@@ -0,0 +1,52 @@
+# #############################################################################
+# Registered person-time cohort
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# Inputs for analysis/person_time.py: for everyone in the full study cohort
+# population, their date of birth, sex and death dates, plus event tables with
+# each of their practice registrations (and the practice region) and addresses,
+# so registered person-time per interval and subgroup can be computed offline in
+# one pass rather than with a backend query per interval.
+
+from ehrql import create_dataset
+from ehrql.tables.tpp import addresses, patients, practice_registrations
+import population
+
+# Dates
+
+study_start_date = "2009-01-01"
+study_end_date = "2025-12-31"
+
+dataset = create_dataset()
+dataset.define_population(population.study_population(study_start_date, study_end_date))
+
+# add variables
+
+dataset.date_of_birth = patients.date_of_birth
+dataset.sex = patients.sex
+dataset.date_of_death = population.date_of_death
+dataset.ons_date_of_death = population.ons_date_of_death
+
+# registration spells
+
+dataset.add_event_table(
+    "practice_registrations",
+    start_date=practice_registrations.start_date,
+    end_date=practice_registrations.end_date,
+    region=practice_registrations.practice_nuts1_region_name,
+)
+
+# address history (IMD on any date is resolved offline with snapshots.py)
+
+dataset.add_event_table(
+    "addresses",
+    start_date=addresses.start_date,
+    end_date=addresses.end_date,
+    has_postcode=addresses.has_postcode,
+    address_id=addresses.address_id,
+    imd_quintile=addresses.imd_quintile,
+)
+
+dataset.configure_dummy_data(population_size=1000)
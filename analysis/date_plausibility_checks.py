@@ -0,0 +1,192 @@
+# #############################################################################
+# Date plausibility checks on the full study cohort
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# This is a columnar version of date_variable_checks.R. Every check is a set of
+# inequalities between two date/duration columns (or a column and a constant)
+# that are ANDed together. All checks are evaluated in a single pass over the
+# record batches of the cohort arrow file, so the whole cohort is never loaded
+# into memory at once. Counts are reported per check, per migrant status and
+# per calendar year.
+
+from argparse import ArgumentParser
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from calendar_years import year_index, year_labels
+from cohort_reader import iter_batches
+from disclosure import round_counts
+
+study_end_date = date(2025, 12, 31)
+
+operators = {
+    "<": pc.less,
+    "<=": pc.less_equal,
+    ">": pc.greater,
+    ">=": pc.greater_equal,
+    "==": pc.equal,
+}
+
+
+def check(*clauses, year_of=None):
+    """
+    A check is one or more (column, operator, other) clauses which must all be
+    true for the row to be counted. `other` is either a column name or a
+    constant. Counts are split by the year of `year_of` (by default the first
+    column of the first clause).
+    """
+    return {"clauses": clauses, "year_of": year_of or clauses[0][0]}
+
+
+date_checks = {
+    "mig_code_before_birth": check(("date_of_first_migration_code", "<", "date_of_birth")),
+    "mig_code_after_death": check(("date_of_first_migration_code", ">", "date_of_death")),
+    "mig_code_before_first_pract_reg": check(("date_of_first_migration_code", "<", "date_of_first_practice_registration")),
+    "mig_code_after_study_end_date": check(("date_of_first_migration_code", ">", study_end_date)),
+    "uk_entry_code_before_birth": check(("date_of_earliest_date_of_uk_entry_code", "<", "date_of_birth")),
+    "uk_entry_code_after_death": check(("date_of_earliest_date_of_uk_entry_code", ">", "date_of_death")),
+    "uk_entry_code_before_first_pract_reg": check(("date_of_earliest_date_of_uk_entry_code", "<", "date_of_first_practice_registration")),
+    "uk_entry_code_on_date_of_first_pract_reg": check(("date_of_earliest_date_of_uk_entry_code", "==", "date_of_first_practice_registration")),
+    "uk_entry_code_after_first_pract_reg": check(("date_of_earliest_date_of_uk_entry_code", ">", "date_of_first_practice_registration")),
+    "uk_entry_code_after_study_end_date": check(("date_of_earliest_date_of_uk_entry_code", ">", study_end_date)),
+    "uk_entry_code_after_birth_and_before_or_on_first_reg": check(
+        ("date_of_earliest_date_of_uk_entry_code", ">", "date_of_birth"),
+        ("date_of_earliest_date_of_uk_entry_code", "<=", "date_of_first_practice_registration"),
+    ),
+    "mig_code_after_date_of_uk_entry_code": check(("date_of_first_migration_code", ">", "date_of_earliest_date_of_uk_entry_code")),
+    "mig_code_before_date_of_uk_entry_code": check(("date_of_first_migration_code", "<", "date_of_earliest_date_of_uk_entry_code")),
+    "mig_code_on_date_of_uk_entry_code": check(("date_of_first_migration_code", "==", "date_of_earliest_date_of_uk_entry_code")),
+    "date_of_birth_after_date_of_death": check(("date_of_birth", ">", "date_of_death")),
+    "date_of_first_prac_reg_before_birth": check(("date_of_first_practice_registration", "<", "date_of_birth")),
+    "date_of_first_prac_reg_after_death": check(("date_of_first_practice_registration", ">", "date_of_death")),
+}
+
+# negative time_from_* durations, counted by year of the start of the duration
+
+duration_starts = {
+    "time_from_1st_pracreg_first_migration_code_days": "date_of_first_practice_registration",
+    "time_from_1st_pracreg_first_migration_code_days_withdoe": "date_of_first_practice_registration",
+    "time_from_birth_first_migration_code_days": "date_of_birth",
+    "time_from_birth_first_migration_code_days_withdoe": "date_of_birth",
+    "time_from_1st_pracreg_first_cob_code_days": "date_of_first_practice_registration",
+    "time_from_1st_pracreg_first_immig_status_excl_refugee_code_days": "date_of_first_practice_registration",
+    "time_from_1st_pracreg_first_refugee_code_days": "date_of_first_practice_registration",
+    "time_from_1st_pracreg_first_language_code_days": "date_of_first_practice_registration",
+    "time_from_1st_pracreg_first_interpreter_code_days": "date_of_first_practice_registration",
+    "time_from_1st_pracreg_first_trafficking_code_days": "date_of_first_practice_registration",
+    "time_from_1st_pracreg_first_uk_cob_code_days": "date_of_first_practice_registration",
+}
+
+for column, start in duration_starts.items():
+    date_checks[f"negative_{column}"] = check((column, "<", 0), year_of=start)
+
+
+def required_columns(checks, group_by):
+    columns = {group_by}
+    for spec in checks.values():
+        columns.add(spec["year_of"])
+        for left, _, right in spec["clauses"]:
+            columns.add(left)
+            if isinstance(right, str):
+                columns.add(right)
+    return sorted(columns)
+
+
+def evaluate_check(batch, spec):
+    """
+    Return (evaluated, failed) boolean numpy arrays: rows where every operand
+    is non-null, and rows where every clause is true.
+    """
+    evaluated = np.ones(batch.num_rows, dtype=bool)
+    failed = np.ones(batch.num_rows, dtype=bool)
+    for left, op, right in spec["clauses"]:
+        left_values = batch.column(left)
+        if isinstance(right, str):
+            right_values = batch.column(right)
+            valid = pc.and_(pc.is_valid(left_values), pc.is_valid(right_values))
+        else:
+            right_values = pa.scalar(right, type=left_values.type)
+            valid = pc.is_valid(left_values)
+        result = pc.fill_null(operators[op](left_values, right_values), False)
+        evaluated &= valid.to_numpy(zero_copy_only=False)
+        failed &= result.to_numpy(zero_copy_only=False)
+    return evaluated, failed
+
+
+def run_checks(path, checks=date_checks, group_by="any_migrant"):
+    """
+    Scan the cohort once and return a long table with one row per
+    check x group x year, holding the number of rows evaluated (non-null
+    operands) and the number that failed the check.
+    """
+    n_years = len(year_labels)
+    n_cells = 2 * n_years
+    evaluated_counts = {name: np.zeros(n_cells, dtype="int64") for name in checks}
+    failed_counts = {name: np.zeros(n_cells, dtype="int64") for name in checks}
+
+    for batch in iter_batches(path, required_columns(checks, group_by)):
+        group = pc.fill_null(batch.column(group_by), False).to_numpy(zero_copy_only=False).astype("int64")
+        year_indexes = {}
+        for name, spec in checks.items():
+            if spec["year_of"] not in year_indexes:
+                year_indexes[spec["year_of"]] = year_index(batch.column(spec["year_of"]))
+            cell = group * n_years + year_indexes[spec["year_of"]]
+            evaluated, failed = evaluate_check(batch, spec)
+            evaluated_counts[name] += np.bincount(cell[evaluated], minlength=n_cells)
+            failed_counts[name] += np.bincount(cell[failed], minlength=n_cells)
+
+    frames = []
+    for name in checks:
+        evaluated = evaluated_counts[name].reshape(2, n_years)
+        failed = failed_counts[name].reshape(2, n_years)
+        for group_label, group_evaluated, group_failed in [
+            ("False", evaluated[0], failed[0]),
+            ("True", evaluated[1], failed[1]),
+            ("All", evaluated.sum(axis=0), failed.sum(axis=0)),
+        ]:
+            keep = group_evaluated > 0
+            frames.append(
+                pd.DataFrame({
+                    "check": name,
+                    group_by: group_label,
+                    "year": np.array(year_labels)[keep],
+                    "n_evaluated": group_evaluated[keep],
+                    "n_failed": group_failed[keep],
+                })
+            )
+            frames.append(
+                pd.DataFrame({
+                    "check": [name],
+                    group_by: [group_label],
+                    "year": ["All"],
+                    "n_evaluated": [group_evaluated.sum()],
+                    "n_failed": [group_failed.sum()],
+                })
+            )
+    return pd.concat(frames, ignore_index=True)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default="output/cohorts/full_study_cohort.arrow")
+    parser.add_argument("--output", default="output/tables/date_plausibility_checks.csv")
+    args = parser.parse_args()
+
+    results = run_checks(args.input)
+    results["n_evaluated"] = round_counts(results["n_evaluated"])
+    results["n_failed"] = round_counts(results["n_failed"])
+
+    output_file = Path(args.output)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    results.to_csv(output_file, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# #############################################################################
+# Disclosure control helpers for offline (python) actions
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+import numpy as np
+
+
+def round_counts(counts):
+    """
+    Python equivalent of the `rounding` function used in the R scripts:
+      - 0 stays 0
+      - counts of 1-7 are redacted (returned as NaN)
+      - counts above 7 are rounded to the nearest 5
+    """
+    counts = np.asarray(counts, dtype="float64")
+    rounded = np.round(counts / 5) * 5
+    return np.where(counts == 0, 0, np.where(counts > 7, rounded, np.nan))
+
+
+def roundmid_any(counts, to=6):
+    """
+    Python equivalent of roundmid_any (commented out in lib/utility.R): round up
+    to a multiple of `to`, then move to the (integer) midpoint of the rounding
+    interval, so non-zero counts never round to 0. Used for cumulative counts
+    (e.g. behind survival curves), where small values can't be redacted.
+    """
+    counts = np.asarray(counts)
+    return np.ceil(counts / to) * to - (to // 2) * (counts != 0)
@@ -0,0 +1,178 @@
+# #############################################################################
+# Content-addressed cache of ehrql extraction outputs
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# This is a script to run an ehrql generate-dataset/generate-measures command
+# through a cache, so that the census, full cohort and measures extractions are
+# only re-run locally when something they depend on has changed. The cache key
+# is a hash of:
+#   - the ehrql image (the action's `ehrql:v1` tag) and the installed ehrql
+#     version, so an ehrql upgrade doesn't serve extracts from the old one
+#   - the ehrql command and its arguments (including --census-date etc.)
+#   - the definition source and every module in analysis/ it imports, recursively
+#     (utilities, migration_status_variables, codelists, ...)
+#   - the contents of the codelist CSV files
+#   - the dummy tables, if given
+# Outputs are stored under extraction_cache/<key>/; on a hit, a stored arrow file
+# is memory-mapped and its record batches written straight to the output path
+# (other outputs are copied). Directory outputs (`--output some/dir/:csv`, one
+# file per measure or table) are stored and served as a whole directory. The
+# cache can be deleted at any time. If two runs fill the same entry at once,
+# the second finds it already there and keeps the first.
+#
+#     python analysis/extraction_cache.py generate-dataset analysis/dataset_definition_census_cohorts.py \
+#         --output output/cohorts/census_2021_study_cohort.arrow -- --census-date 2021-03-21
+#
+# run_project.py runs its ehrql actions through this script.
+
+import hashlib
+import importlib.metadata
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+from argparse import REMAINDER, ArgumentParser
+from pathlib import Path
+
+import pyarrow as pa
+
+from run_project import codelist_files, hash_file, hash_tables, local_imports
+
+cache_dir = Path("extraction_cache")
+
+
+def option_value(args, option):
+    if option in args:
+        return args[args.index(option) + 1]
+    return None
+
+
+def output_location(output):
+    """
+    The path of an --output and its format. A directory output is written as
+    `some/dir/:csv` (or `:arrow`), giving (Path("some/dir"), ":csv").
+    """
+    path = Path(output)
+    if path.name.startswith(":"):
+        return path.parent, path.name
+    return path, path.suffix
+
+
+def ehrql_version():
+    try:
+        return importlib.metadata.version("ehrql")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def extraction_key(ehrql_command, ehrql_args, image="ehrql:v1"):
+    """
+    Hash of everything that determines the output of an ehrql command (see the
+    top of this file).
+    """
+    definition = Path(ehrql_args[1])
+    output = option_value(ehrql_args, "--output")
+    # the output path doesn't change the results, so the same extraction written
+    # to a different file is still a hit (but its format does)
+    key_args = [output_location(arg)[1] if arg == output else arg for arg in ehrql_args]
+
+    digest = hashlib.sha256(json.dumps([image, ehrql_version(), ehrql_command, key_args]).encode())
+    imports = local_imports(definition)
+    for path in [definition] + imports:
+        hash_file(path, digest)
+    if any(path.name == "codelists.py" for path in imports):
+        for path in codelist_files():
+            hash_file(path, digest)
+    dummy_tables = option_value(ehrql_args, "--dummy-tables")
+    if dummy_tables:
+        hash_tables(dummy_tables, digest)
+    return digest.hexdigest()
+
+
+def cached_path(key, output_format):
+    # a file for single-file outputs, a directory for directory outputs
+    name = "output" if output_format.startswith(":") else f"output{output_format}"
+    return cache_dir / key / name
+
+
+def store(key, output, output_format):
+    """
+    Add an output (a file or directory) to the cache, via a temporary copy so a
+    partly-written entry is never seen.
+    """
+    entry = cache_dir / key
+    entry.mkdir(parents=True, exist_ok=True)
+    if output.is_dir():
+        tmp = Path(tempfile.mkdtemp(dir=entry)) / "output"
+        shutil.copytree(output, tmp)
+        try:
+            os.replace(tmp, cached_path(key, output_format))
+        except OSError:
+            # another run stored the same entry first (a directory can't be
+            # replaced once it has files in it), so keep that one
+            if not cached_path(key, output_format).is_dir():
+                raise
+        shutil.rmtree(tmp.parent)
+        return
+    handle, tmp = tempfile.mkstemp(dir=entry)
+    os.close(handle)
+    shutil.copyfile(output, tmp)
+    os.replace(tmp, cached_path(key, output_format))
+
+
+def serve(cached, output):
+    """
+    Write a cached output (a file, or each file in a directory) to `output`.
+    Arrow files are memory-mapped, so the batches are written from the mapped
+    pages without reading the whole file into memory.
+    """
+    if cached.is_dir():
+        for path in cached.iterdir():
+            serve(path, output / path.name)
+        return
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if cached.suffix != ".arrow":
+        shutil.copyfile(cached, output)
+        return
+    with pa.memory_map(str(cached)) as source:
+        reader = pa.ipc.open_file(source)
+        with pa.OSFile(str(output), "wb") as sink:
+            with pa.ipc.new_file(sink, reader.schema) as writer:
+                for i in range(reader.num_record_batches):
+                    writer.write_batch(reader.get_batch(i))
+
+
+def cached_extract(ehrql_command, ehrql_args, image="ehrql:v1"):
+    """
+    Serve the output of an ehrql command from the cache, or run it and cache
+    the output. Returns the key and whether it was a hit.
+    """
+    output, output_format = output_location(option_value(ehrql_args, "--output"))
+    key = extraction_key(ehrql_command, ehrql_args, image)
+    cached = cached_path(key, output_format)
+    if cached.exists():
+        serve(cached, output)
+        return key, True
+
+    subprocess.run(shlex.split(ehrql_command) + ehrql_args, check=True)
+    store(key, output, output_format)
+    return key, False
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--ehrql-command", default="python -m ehrql")
+    parser.add_argument("--image", default="ehrql:v1", help="the ehrql image of the action (from project.yaml)")
+    parser.add_argument("ehrql_args", nargs=REMAINDER, help="generate-dataset/generate-measures and its arguments")
+    args = parser.parse_args()
+
+    key, hit = cached_extract(args.ehrql_command, args.ehrql_args, args.image)
+    print(f"{'served from' if hit else 'stored in'} cache: {key}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+from ehrql import create_measures, INTERVAL
+from ehrql.tables.tpp import patients
+import migration_status_variables
+from analysis import utilities
+
+# Finest-grain annual counts for analysis/subgroup_cube.py: one measure per
+# categorisation, grouped by status and every subgroup variable at once, so every
+# marginal (the per-subgroup measures we publish, and combinations such as
+# age x sex) can be derived offline by summing. Disclosure control is applied by
+# subgroup_cube.py after summing, so it is disabled here and the output is
+# highly sensitive.
+
+measures = create_measures()
+measures.configure_dummy_data(population_size=1000)
+measures.configure_disclosure_control(enabled=False)
+
+# build shared variables and defaults
+common = utilities.build_common_vars(INTERVAL)
+measures.define_defaults(denominator=common["denominator"], intervals=common["intervals"])
+
+group_by = {
+    "age_band": common["age_band"],
+    "sex": patients.sex,
+    "ethnicity": common["ethnicity"],
+    "imd_quintile": common["imd_quintile"],
+    "region": common["region"],
+}
+
+# build base indicators and aggregated expressions
+numerators_separate = migration_status_variables.build_migrant_indicators(INTERVAL.end_date)
+
+categorisations = {
+    "mig_status_2_cat": migration_status_variables.build_mig_status_2_cat(numerators_separate),
+    "mig_status_3_cat": migration_status_variables.build_mig_status_3_cat(numerators_separate),
+    "mig_status_6_cat": migration_status_variables.build_mig_status_6_cat(numerators_separate),
+    "mig_status_2_cat_withdoe": migration_status_variables.build_mig_status_2_cat_withdoe(numerators_separate),
+    "mig_status_3_cat_withdoe": migration_status_variables.build_mig_status_3_cat_withdoe(numerators_separate),
+    "mig_status_6_cat_withdoe": migration_status_variables.build_mig_status_6_cat_withdoe(numerators_separate),
+}
+
+# one measure per categorisation: everyone in the denominator, by status x subgroups
+for var_name, status in categorisations.items():
+    measures.define_measure(
+        name=f"{var_name}_cube",
+        numerator=common["denominator"],
+        group_by={"status": status, **group_by},
+    )
@@ -0,0 +1,399 @@
+# #############################################################################
+# Synthetic TPP-shaped tables for local runs at production-like volumes
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# This is a script to generate patients, practice_registrations, clinical_events,
+# addresses, ons_deaths and appointments tables in the same shape as the files in
+# dummy_tables/, but at 10k, 1m or 10m patients. Everything is generated with
+# vectorised numpy draws in chunks of patients (so memory depends on the chunk
+# size, not the number of patients) from a fixed seed, and written as arrow or
+# csv files that can be passed to ehrql with --dummy-tables.
+#
+# Migration-related clinical events are drawn from our codelists, with a skewed
+# (Zipf-like) frequency within each codelist so that a few codes dominate, as
+# they do in practice.
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as pa_ipc
+
+import codelists
+
+tiers = {
+    "10k": 10_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+
+extract_date = np.datetime64("2026-03-31")
+registration_start = np.datetime64("1990-01-01")
+
+regions = [
+    "North East", "North West", "Yorkshire and The Humber", "East Midlands",
+    "West Midlands", "East", "London", "South East", "South West",
+]
+region_weights = [0.04, 0.10, 0.16, 0.14, 0.08, 0.19, 0.06, 0.08, 0.15]
+
+# share of migrants and, for patients who are migrants, the chance of having
+# at least one code from each migration codelist
+migrant_share = 0.15
+migrant_category_weights = {
+    "not_born_in_uk": 0.30,
+    "immig_status_excl_refugee_asylum": 0.04,
+    "refugee_asylum_status": 0.04,
+    "english_not_main_language": 0.40,
+    "interpreter_required": 0.20,
+    "trafficking": 0.02,
+}
+born_in_uk_share = 0.05
+date_of_uk_entry_share = {"migrant": 0.05, "non_migrant": 0.005}
+
+# events that fall outside birth/death, to exercise the date checks
+implausible_event_share = 0.01
+
+schemas = {
+    "patients": pa.schema([
+        ("patient_id", pa.int64()),
+        ("date_of_birth", pa.date32()),
+        ("sex", pa.string()),
+        ("date_of_death", pa.date32()),
+    ]),
+    "ons_deaths": pa.schema([
+        ("patient_id", pa.int64()),
+        ("date", pa.date32()),
+    ]),
+    "practice_registrations": pa.schema([
+        ("patient_id", pa.int64()),
+        ("start_date", pa.date32()),
+        ("end_date", pa.date32()),
+        ("practice_pseudo_id", pa.int64()),
+        ("practice_nuts1_region_name", pa.string()),
+    ]),
+    "addresses": pa.schema([
+        ("patient_id", pa.int64()),
+        ("address_id", pa.int64()),
+        ("start_date", pa.date32()),
+        ("end_date", pa.date32()),
+        ("imd_rounded", pa.int64()),
+        ("msoa_code", pa.string()),
+    ]),
+    "clinical_events": pa.schema([
+        ("patient_id", pa.int64()),
+        ("date", pa.date32()),
+        ("snomedct_code", pa.string()),
+    ]),
+    "appointments": pa.schema([
+        ("patient_id", pa.int64()),
+        ("booked_date", pa.date32()),
+        ("start_date", pa.date32()),
+        ("seen_date", pa.date32()),
+        ("status", pa.string()),
+    ]),
+}
+
+
+def zipf_weights(n, exponent=1.1):
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def code_pools():
+    """
+    Codes to draw events from, with their within-codelist weights.
+    """
+    pools = {}
+    for name, codelist_name in codelists.migrant_flag_codelists.items():
+        codes = np.array(sorted(getattr(codelists, codelist_name)), dtype=object)
+        pools[name] = (codes, zipf_weights(len(codes)))
+    ethnicity_codes = np.array(sorted(codelists.ethnicity_codelist), dtype=object)
+    pools["ethnicity"] = (ethnicity_codes, zipf_weights(len(ethnicity_codes), exponent=0.8))
+    # everything else people get coded with
+    other_codes = np.array([f"{100000 + i}{i % 7}00" for i in range(5000)], dtype=object)
+    pools["other"] = (other_codes, zipf_weights(len(other_codes)))
+    return pools
+
+
+def random_dates(rng, start, end):
+    """
+    One uniformly distributed date between each start and end (inclusive).
+    """
+    days = (end - start).astype("int64")
+    offset = np.floor(rng.random(len(days)) * (np.maximum(days, 0) + 1)).astype("int64")
+    return start + offset.astype("timedelta64[D]")
+
+
+def repeat_rows(rng, patient_ids, mean, minimum=0):
+    counts = rng.poisson(mean, len(patient_ids)) + minimum
+    return counts, np.repeat(patient_ids, counts)
+
+
+def generate_patients(rng, patient_ids):
+    n = len(patient_ids)
+    birth_year = rng.integers(1915, 2026, n)
+    birth_month = rng.integers(1, 13, n)
+    date_of_birth = (
+        (birth_year - 1970).astype("datetime64[Y]")
+        + (birth_month - 1).astype("timedelta64[M]")
+    ).astype("datetime64[D]")
+
+    sex = rng.choice(["male", "female", "intersex", "unknown"], size=n, p=[0.49, 0.49, 0.01, 0.01])
+
+    # older people are more likely to have died
+    age_at_extract = (extract_date - date_of_birth).astype("int64") / 365.25
+    died = rng.random(n) < np.clip(age_at_extract / 200, 0.01, 0.6)
+    date_of_death = random_dates(rng, np.maximum(date_of_birth, registration_start), extract_date)
+
+    return {
+        "patient_id": patient_ids,
+        "date_of_birth": date_of_birth,
+        "sex": sex,
+        "died": died,
+        "date_of_death": date_of_death,
+        "migrant": rng.random(n) < migrant_share,
+    }
+
+
+def patients_table(patients):
+    return pa.table({
+        "patient_id": patients["patient_id"],
+        "date_of_birth": patients["date_of_birth"],
+        "sex": patients["sex"],
+        "date_of_death": pa.array(patients["date_of_death"], mask=~patients["died"]),
+    }, schema=schemas["patients"])
+
+
+def ons_deaths_table(rng, patients):
+    # most, but not all, TPP deaths are in ONS, and a few dates disagree
+    in_ons = patients["died"] & (rng.random(len(patients["died"])) < 0.9)
+    shift = np.where(rng.random(in_ons.sum()) < 0.05, rng.integers(-30, 30, in_ons.sum()), 0)
+    return pa.table({
+        "patient_id": patients["patient_id"][in_ons],
+        "date": patients["date_of_death"][in_ons] + shift.astype("timedelta64[D]"),
+    }, schema=schemas["ons_deaths"])
+
+
+def practice_registrations_table(rng, patients):
+    """
+    One or more consecutive registration spells per patient; the last one is
+    ongoing unless the patient has died or left.
+    """
+    counts, patient_id = repeat_rows(rng, patients["patient_id"], 0.6, minimum=1)
+    first_row = np.repeat(np.cumsum(counts) - counts, counts)
+    spell = np.arange(len(patient_id)) - first_row
+    last_spell = spell == np.repeat(counts, counts) - 1
+
+    date_of_birth = np.repeat(patients["date_of_birth"], counts)
+    end_of_record = np.repeat(
+        np.where(patients["died"], patients["date_of_death"], extract_date), counts
+    )
+    first_start = np.maximum(date_of_birth, registration_start)
+
+    # split each patient's registered time into consecutive spells
+    n_spells = np.repeat(counts, counts)
+    boundaries = (spell + rng.random(len(patient_id))) / n_spells
+    boundaries = np.where(last_spell, 1.0, boundaries)
+    total_days = (end_of_record - first_start).astype("int64")
+    end_offset = (boundaries * total_days).astype("int64")
+    start_offset = np.concatenate([[0], end_offset[:-1] + 1])
+    start_offset[spell == 0] = 0
+    start_date = first_start + start_offset.astype("timedelta64[D]")
+    end_date = first_start + end_offset.astype("timedelta64[D]")
+
+    died = np.repeat(patients["died"], counts)
+    left = rng.random(len(patient_id)) < 0.05
+    ongoing = last_spell & ~died & ~left
+
+    region = rng.choice(regions, size=len(patient_id), p=region_weights)
+    return pa.table({
+        "patient_id": patient_id,
+        "start_date": start_date,
+        "end_date": pa.array(end_date, mask=ongoing),
+        "practice_pseudo_id": rng.integers(1, 2500, len(patient_id)),
+        "practice_nuts1_region_name": region,
+    }, schema=schemas["practice_registrations"])
+
+
+def addresses_table(rng, patients):
+    """
+    Addresses overlap and some have an end date before their start date, as in
+    dummy_tables/addresses.csv.
+    """
+    counts, patient_id = repeat_rows(rng, patients["patient_id"], 1.0, minimum=1)
+    date_of_birth = np.repeat(patients["date_of_birth"], counts)
+    start_date = random_dates(rng, date_of_birth, np.full(len(patient_id), extract_date))
+    end_date = random_dates(rng, start_date, np.full(len(patient_id), extract_date))
+    inverted = rng.random(len(patient_id)) < 0.02
+    end_date = np.where(inverted, start_date - rng.integers(1, 365, len(patient_id)).astype("timedelta64[D]"), end_date)
+    ongoing = rng.random(len(patient_id)) < 0.5
+
+    has_imd = rng.random(len(patient_id)) < 0.95
+    msoa = np.char.add("E0200", rng.integers(1000, 7999, len(patient_id)).astype(str))
+    return pa.table({
+        "patient_id": patient_id,
+        "address_id": address_ids(counts, patient_id),
+        "start_date": start_date,
+        "end_date": pa.array(end_date, mask=ongoing & ~inverted),
+        "imd_rounded": pa.array(rng.integers(0, 329, len(patient_id)) * 100, mask=~has_imd),
+        "msoa_code": pa.array(msoa, mask=~has_imd),
+    }, schema=schemas["addresses"])
+
+
+def address_ids(counts, patient_id):
+    """
+    Unique address ids across chunks: patient_id then the address's position
+    among the patient's addresses (addresses.for_patient_on sorts on address_id
+    last, so ties between a patient's addresses are broken by it).
+    """
+    position = np.arange(len(patient_id)) - np.repeat(np.cumsum(counts) - counts, counts)
+    # a patient has a handful of addresses (1 + Poisson(1)), far below 1000
+    return patient_id * 1000 + position
+
+
+def draw_events(rng, patient_index, patients, pool):
+    codes, weights = pool
+    date_of_birth = patients["date_of_birth"][patient_index]
+    end = np.where(patients["died"], patients["date_of_death"], extract_date)[patient_index]
+    date = random_dates(rng, date_of_birth, end)
+    implausible = rng.random(len(patient_index)) < implausible_event_share
+    date = np.where(implausible, date_of_birth - rng.integers(1, 3650, len(patient_index)).astype("timedelta64[D]"), date)
+    return patients["patient_id"][patient_index], date, rng.choice(codes, size=len(patient_index), p=weights)
+
+
+def clinical_events_table(rng, patients, pools, other_events_per_patient):
+    n = len(patients["patient_id"])
+    migrant = patients["migrant"]
+    indexes = {}
+
+    # every migrant has at least one code from one of the migration codelists
+    migrant_index = np.flatnonzero(migrant)
+    names = list(migrant_category_weights)
+    weights = np.array(list(migrant_category_weights.values()))
+    main_category = rng.choice(len(names), size=len(migrant_index), p=weights / weights.sum())
+    for i, name in enumerate(names):
+        has_category = (main_category == i) | (rng.random(len(migrant_index)) < weights[i] / 4)
+        patient_index = migrant_index[has_category]
+        indexes[name] = np.repeat(patient_index, rng.poisson(0.8, len(patient_index)) + 1)
+
+    non_migrant_index = np.flatnonzero(~migrant)
+    indexes["born_in_uk"] = non_migrant_index[rng.random(len(non_migrant_index)) < born_in_uk_share]
+    entry_share = np.where(migrant, date_of_uk_entry_share["migrant"], date_of_uk_entry_share["non_migrant"])
+    indexes["date_of_uk_entry"] = np.flatnonzero(rng.random(n) < entry_share)
+
+    # most people have one or more ethnicity codes; non-migrants mostly British
+    ethnicity_index = np.repeat(np.arange(n), rng.poisson(0.9, n))
+    british = ~migrant[ethnicity_index] & (rng.random(len(ethnicity_index)) < 0.7)
+    indexes["british_ethnicities"] = ethnicity_index[british]
+    indexes["ethnicity"] = ethnicity_index[~british]
+
+    indexes["other"] = np.repeat(np.arange(n), rng.poisson(other_events_per_patient, n))
+
+    patient_id, date, code = zip(*(
+        draw_events(rng, patient_index, patients, pools[name])
+        for name, patient_index in indexes.items()
+    ))
+    return pa.table({
+        "patient_id": np.concatenate(patient_id),
+        "date": np.concatenate(date),
+        "snomedct_code": np.concatenate(code).astype(str),
+    }, schema=schemas["clinical_events"])
+
+
+def appointments_table(rng, patients):
+    counts, patient_id = repeat_rows(rng, patients["patient_id"], 4.0)
+    first = np.repeat(np.maximum(patients["date_of_birth"], np.datetime64("2009-01-01")), counts)
+    end = np.repeat(np.where(patients["died"], patients["date_of_death"], extract_date), counts)
+    # no appointments for people who died before 2009
+    alive = first <= end
+    patient_id, first, end = patient_id[alive], first[alive], end[alive]
+    start_date = random_dates(rng, first, end)
+    booked_date = start_date - rng.integers(0, 28, len(patient_id)).astype("timedelta64[D]")
+    seen = rng.random(len(patient_id)) < 0.85
+    return pa.table({
+        "patient_id": patient_id,
+        "booked_date": booked_date,
+        "start_date": start_date,
+        "seen_date": pa.array(start_date, mask=~seen),
+        "status": np.where(seen, "Finished", "Did Not Attend"),
+    }, schema=schemas["appointments"])
+
+
+def generate_chunk(rng, patient_ids, pools, other_events_per_patient):
+    patients = generate_patients(rng, patient_ids)
+    return {
+        "patients": patients_table(patients),
+        "ons_deaths": ons_deaths_table(rng, patients),
+        "practice_registrations": practice_registrations_table(rng, patients),
+        "addresses": addresses_table(rng, patients),
+        "clinical_events": clinical_events_table(rng, patients, pools, other_events_per_patient),
+        "appointments": appointments_table(rng, patients),
+    }
+
+
+class TableWriters:
+    """
+    One open arrow or csv writer per table, so chunks are appended as they are generated.
+    """
+
+    def __init__(self, output_dir, file_format):
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self.writers = {}
+        for name, schema in schemas.items():
+            path = output_dir / f"{name}.{file_format}"
+            if file_format == "arrow":
+                self.writers[name] = pa_ipc.new_file(str(path), schema)
+            else:
+                self.writers[name] = pa_csv.CSVWriter(str(path), schema)
+
+    def write(self, tables):
+        for name, table in tables.items():
+            self.writers[name].write_table(table)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+def generate_tables(output_dir, n_patients, file_format="arrow", seed=2026,
+                    chunk_size=250_000, other_events_per_patient=10):
+    pools = code_pools()
+    writers = TableWriters(Path(output_dir), file_format)
+    try:
+        for chunk, first_id in enumerate(range(1, n_patients + 1, chunk_size)):
+            rng = np.random.default_rng([seed, chunk])
+            patient_ids = np.arange(first_id, min(first_id + chunk_size, n_patients + 1))
+            writers.write(generate_chunk(rng, patient_ids, pools, other_events_per_patient))
+    finally:
+        writers.close()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--tier", choices=tiers, default="10k")
+    parser.add_argument("--patients", type=int, help="overrides the number of patients in --tier")
+    parser.add_argument("--format", choices=["arrow", "csv"], default="arrow")
+    parser.add_argument("--output-dir", help="defaults to synthetic_tables/<tier>")
+    parser.add_argument("--seed", type=int, default=2026)
+    parser.add_argument("--chunk-size", type=int, default=250_000)
+    parser.add_argument("--other-events-per-patient", type=float, default=10)
+    args = parser.parse_args()
+
+    n_patients = args.patients or tiers[args.tier]
+    output_dir = args.output_dir or f"synthetic_tables/{args.tier}"
+    generate_tables(
+        output_dir,
+        n_patients,
+        file_format=args.format,
+        seed=args.seed,
+        chunk_size=args.chunk_size,
+        other_events_per_patient=args.other_events_per_patient,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+## Script to consolidate the measures outputs into one long-format Parquet dataset
+## Every generate-measures output under output/tables/annual_counts/ (a directory
+## of one CSV per measure, or a single CSV) is read once and written to
+## output/tables/measures_store/, partitioned by categorisation (2cat, 3cat, ...,
+## primary_care_comparison), with one row per measure x subgroup value x interval.
+##
+## Within each partition rows are sorted by measure, subgroup and interval_start and
+## written in small row groups, so the row group statistics act as an index: a
+## query for one measure/subgroup only reads the row groups that can contain it.
+## Plotting scripts should use read_measures() rather than globbing the CSVs, e.g.
+##     read_measures(categorisation="6cat", measure="mig_status_6_cat_definite_migrant_age",
+##                   columns=["subgroup_value", "interval_start", "ratio"])
+## Author: Yamina Boukari
+####
+
+import shutil
+from argparse import ArgumentParser
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+measures_dir = Path("output/tables/annual_counts")
+store_dir = Path("output/tables/measures_store")
+
+measure_columns = ["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator"]
+sort_columns = ["measure", "subgroup", "interval_start"]
+row_group_size = 10_000
+
+# group_by columns of the measures named with each suffix (the subgroups in
+# utilities.build_common_vars); measures without one of these suffixes aren't grouped
+group_by_suffixes = {
+    "age": ["age_band"],
+    "sex": ["sex"],
+    "ethnicity": ["ethnicity"],
+    "imd": ["imd_quintile"],
+    "region": ["region"],
+}
+
+schema = pa.schema([
+    ("measure", pa.dictionary(pa.int32(), pa.string())),
+    ("subgroup", pa.dictionary(pa.int32(), pa.string())),
+    ("subgroup_value", pa.string()),
+    ("interval_start", pa.date32()),
+    ("interval_end", pa.date32()),
+    ("numerator", pa.float64()),
+    ("denominator", pa.float64()),
+    ("ratio", pa.float64()),
+])
+
+
+def measures_outputs(input_dir=measures_dir):
+    """
+    {categorisation: [csv files]}: one entry per subdirectory of per-measure
+    CSVs, and one per CSV directly in input_dir.
+    """
+    outputs = {}
+    for path in sorted(Path(input_dir).iterdir()):
+        if path.is_dir():
+            files = sorted(path.glob("*.csv"))
+            if files:
+                outputs[path.name] = files
+        elif path.suffix == ".csv":
+            outputs[path.stem] = [path]
+    return outputs
+
+
+def declared_group_by(measure):
+    """
+    The group_by columns a measure was defined with, from its name.
+    """
+    for suffix, columns in group_by_suffixes.items():
+        if measure.endswith(f"_{suffix}"):
+            return columns
+    return []
+
+
+def to_long(frame):
+    """
+    Long format for one measures CSV: the group_by column(s) of each measure
+    become subgroup (their names, "all" if ungrouped) and subgroup_value.
+    """
+    group_columns = [column for column in frame.columns if column not in measure_columns]
+    frame = frame.astype({column: "string" for column in group_columns})
+    parts = []
+    for measure, rows in frame.groupby("measure", sort=False):
+        # from the definition rather than the values, as every value of a group
+        # column can be null (e.g. IMD quintile where no address is known)
+        grouped_by = declared_group_by(measure)
+        missing = [column for column in grouped_by if column not in group_columns]
+        if missing:
+            raise ValueError(f"{measure} is grouped by {missing}, which aren't in its output")
+        if len(grouped_by) == 1:
+            # keeps nulls in the group (e.g. unknown IMD quintile)
+            subgroup_value = rows[grouped_by[0]]
+        elif grouped_by:
+            subgroup_value = rows[grouped_by].fillna("").agg(",".join, axis=1).astype("string")
+        else:
+            # a string column of nulls rather than None, so every part has the
+            # same dtypes and concatenating them doesn't depend on how pandas
+            # treats all-NA columns
+            subgroup_value = pd.Series(pd.NA, index=rows.index, dtype="string")
+        rows = rows[measure_columns].assign(
+            subgroup=",".join(grouped_by) or "all",
+            subgroup_value=subgroup_value,
+        )
+        parts.append(rows)
+    return pd.concat(parts, ignore_index=True)
+
+
+def read_output(files):
+    frames = [pd.read_csv(path, dtype=str) for path in files]
+    # measures with no rows (nothing in any interval) add nothing to the store
+    long = pd.concat([to_long(frame) for frame in frames if len(frame)], ignore_index=True)
+    for column in ("interval_start", "interval_end"):
+        long[column] = pd.to_datetime(long[column]).dt.date
+    for column in ("numerator", "denominator", "ratio"):
+        long[column] = pd.to_numeric(long[column])
+    return long.sort_values(sort_columns, ignore_index=True)
+
+
+def consolidate(input_dir=measures_dir, output_dir=store_dir):
+    """
+    Rewrite the store from every measures output in input_dir. Returns the
+    number of rows per categorisation.
+    """
+    output_dir = Path(output_dir)
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+
+    counts = {}
+    for categorisation, files in measures_outputs(input_dir).items():
+        long = read_output(files)
+        partition = output_dir / f"categorisation={categorisation}"
+        partition.mkdir(parents=True)
+        table = pa.Table.from_pandas(long[schema.names], schema=schema, preserve_index=False)
+        pq.write_table(table, partition / "measures.parquet", row_group_size=row_group_size)
+        counts[categorisation] = len(long)
+    return counts
+
+
+def read_measures(categorisation=None, measure=None, subgroup=None, interval_start=None,
+                  columns=None, store=store_dir):
+    """
+    Rows of the store matching every given filter (each can be a single value
+    or a list), as a DataFrame. Only the partitions and row groups that can
+    match are read.
+    """
+    dataset = ds.dataset(store, format="parquet", partitioning="hive")
+
+    condition = None
+    for column, value in [
+        ("categorisation", categorisation),
+        ("measure", measure),
+        ("subgroup", subgroup),
+        ("interval_start", interval_start),
+    ]:
+        if value is None:
+            continue
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        if column == "interval_start":
+            values = [pd.Timestamp(v).date() for v in values]
+        clause = ds.field(column).isin(values)
+        condition = clause if condition is None else condition & clause
+
+    table = dataset.to_table(columns=columns, filter=condition)
+    return table.to_pandas()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input-dir", default=str(measures_dir))
+    parser.add_argument("--output-dir", default=str(store_dir))
+    args = parser.parse_args()
+
+    counts = consolidate(args.input_dir, args.output_dir)
+    for categorisation, n_rows in counts.items():
+        print(f"{categorisation}: {n_rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,32 +3,57 @@ from ehrql import create_dataset, codelist_from_csv, show, case, when
 from ehrql.tables.tpp import clinical_events, patients
 import codelists
 
-migrant_flags = {
-    "any_migrant": codelists.all_migrant_codes,
-    "born_in_uk": codelists.uk_cob_codes,
-    "not_born_in_uk": codelists.cob_migrant_codes,
-    "immig_status_excl_refugee_asylum": codelists.immigra_status_excl_ref_and_asylum_codes,
-    "refugee_asylum_status": codelists.asylum_refugee_migrant_codes,
-    "english_not_main_language": codelists.english_not_main_language_excl_interpreter_migrant_codes,
-    "interpreter_required": codelists.interpreter_migrant_codes,
-    "trafficking": codelists.trafficking_codes,
-    "british_ethnicities": codelists.british_ethnicities_codes,
-    "date_of_uk_entry": ["860021000000109"]
-}
+def migrant_flags():
+    """
+    The codes behind each migrant flag. Resolved when a variable is built
+    rather than on import, so the codelists are only loaded if they're used.
+    """
+    return {
+        name: getattr(codelists, codelist_name)
+        for name, codelist_name in codelists.migrant_flag_codelists.items()
+    }
+
+def migrant_flag_events(codes, date):
+    """
+    Events with one of the codes, recorded between birth and date (and not after death).
+    """
+    return (
+        clinical_events
+        .where(clinical_events.snomedct_code.is_in(codes))
+        .where(clinical_events.date.is_on_or_between(patients.date_of_birth, date))
+        .where((clinical_events.date.is_on_or_before(patients.date_of_death)) | (patients.date_of_death.is_null()))
+    )
 
 def build_migrant_indicators(date):
 
     return {
-        name: (
-            clinical_events
-            .where(clinical_events.snomedct_code.is_in(codes))
-            .where(clinical_events.date.is_on_or_between(patients.date_of_birth, date))
-            .where((clinical_events.date.is_on_or_before(patients.date_of_death)) | (patients.date_of_death.is_null()))
-            .exists_for_patient()
-        )
-        for name, codes in migrant_flags.items()
+        name: migrant_flag_events(codes, date).exists_for_patient()
+        for name, codes in migrant_flags().items()
     }
 
+def build_first_migrant_code_dates(date):
+    """
+    Date of the first code for each of the build_migrant_indicators categories
+    (null if the indicator is False).
+    """
+    return {
+        name: migrant_flag_events(codes, date).sort_by(clinical_events.date).first_for_patient().date
+        for name, codes in migrant_flags().items()
+    }
+
+def build_first_any_migrant_code_dates_excluding(date):
+    """
+    For each component of any_migrant, the date of the first any_migrant code
+    that isn't in that component's codelist (for sensitivity analyses dropping it).
+    """
+    flags = migrant_flags()
+    dates = {}
+    for name in codelists.migrant_component_flags:
+        excluded = set(flags[name])
+        codes = [code for code in flags["any_migrant"] if code not in excluded]
+        dates[name] = migrant_flag_events(codes, date).sort_by(clinical_events.date).first_for_patient().date
+    return dates
+
 def build_mig_status_2_cat(migrant_indicators):
     """
     2-category migrant status:
@@ -0,0 +1,246 @@
+## Script for registered person-time denominators per year and subgroup
+## The measures denominator (population.interval_denominator) counts everyone
+## registered at any point in the interval, which overstates exposure for people
+## registered for only part of it. This sums the days each patient was actually
+## registered (and alive) in each year instead.
+##
+## The input (dataset_definition_person_time.py) has each patient's registration
+## spells. Overlapping spells are trimmed so no day is counted twice, every spell
+## is split into its pieces in each year (clipped to the year and to death), and
+## the days are summed per year x age band x sex x region x IMD quintile with one
+## bincount. Age band (age at the start of the year) and IMD quintile (at the start
+## of the year, resolved from the address history with snapshots.py) are as in
+## utilities.build_common_vars; region is that of the practice the days were
+## registered with. As for the measures denominator, years
+## where a patient's age at the start isn't plausible (0 < age < 110) are left out.
+##
+## Outputs (patient counts rounded with disclosure.round_counts, and person-time
+## redacted where the patient count is):
+##   - person_time_by_year_and_subgroup.csv: interval_start, subgroup,
+##     subgroup_value, n_patients, person_years, with subgroups named as the
+##     measures group_by columns ("all", "age_band", "sex", "region", "imd_quintile")
+## Author: Yamina Boukari
+####
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from age_bands import age_band_index, age_band_lookup, missing_label
+from cohort_reader import read_columns
+from disclosure import round_counts
+from snapshots import address_history, as_of, days, take
+
+default_input_dir = "output/cohorts/person_time"
+first_year = 2009
+last_year = 2025
+
+# as population.has_plausible_age_on: 0 < age < 110 (band 1)
+plausible_age_edges = [1, 110]
+
+subgroups = ["age_band", "sex", "region", "imd_quintile"]
+
+
+def year_starts(first=first_year, last=last_year):
+    """
+    Day numbers of 1st January of each year, and of the year after the last.
+    """
+    years = np.arange(first, last + 2) - 1970
+    return years.astype("datetime64[Y]").astype("datetime64[D]").astype("int64")
+
+
+def non_overlapping(patient, start, end):
+    """
+    Sort spells by patient and start and move each start to after the end of the
+    patient's earlier spells, so no day is counted twice. Spells that are then
+    empty are dropped. Returns the sort order and the new starts.
+    """
+    order = np.lexsort((start, patient))
+    patient, start, end = patient[order], start[order], end[order]
+    # running maximum of end within each patient (patients are sorted, so
+    # offsetting by patient keeps the running maximum from crossing patients)
+    offset = (patient - patient.min(initial=0)) * (end.max(initial=0) - start.min(initial=0) + 2)
+    covered_to = np.maximum.accumulate(end + offset) - offset
+    previous_covered_to = np.concatenate([[-np.inf], covered_to[:-1]])
+    new_patient = np.concatenate([[True], patient[1:] != patient[:-1]])
+    start = np.where(new_patient, start, np.maximum(start, previous_covered_to + 1))
+    keep = start <= end
+    return order[keep], start[keep]
+
+
+def split_by_year(start, end, boundaries):
+    """
+    Split each [start, end] spell (inclusive day numbers) at year boundaries.
+    Returns (spell index, year index, days registered) for each piece.
+    """
+    first = np.searchsorted(boundaries, start, side="right") - 1
+    last = np.searchsorted(boundaries, end, side="right") - 1
+    n_pieces = last - first + 1
+    spell = np.repeat(np.arange(len(start)), n_pieces)
+    year = np.repeat(first, n_pieces) + (np.arange(n_pieces.sum()) - np.repeat(np.cumsum(n_pieces) - n_pieces, n_pieces))
+    piece_start = np.maximum(start[spell], boundaries[year])
+    piece_end = np.minimum(end[spell], boundaries[year + 1] - 1)
+    return spell, year, (piece_end - piece_start + 1).astype("int64")
+
+
+def encode(values, missing="unknown"):
+    """
+    Integer codes and labels for a column of values (nulls as `missing`).
+    """
+    codes, labels = pd.factorize(pd.Series(values, dtype=object).fillna(missing), sort=True)
+    return codes.astype("int64"), list(labels)
+
+
+def registered_days(input_dir=default_input_dir, first=first_year, last=last_year):
+    """
+    A DataFrame with a row per patient x year x registration piece: the patient,
+    year index, days registered and the (integer-coded) subgroups, plus the
+    labels for each subgroup code.
+    """
+    input_dir = Path(input_dir)
+    years = list(range(first, last + 1))
+    boundaries = year_starts(first, last)
+
+    patients = read_columns(
+        input_dir / "dataset.arrow",
+        ["patient_id", "date_of_birth", "sex", "date_of_death", "ons_date_of_death"],
+    )
+    registrations = read_columns(
+        input_dir / "practice_registrations.arrow", ["patient_id", "start_date", "end_date", "region"]
+    )
+    addresses = read_columns(
+        input_dir / "addresses.arrow",
+        ["patient_id", "start_date", "end_date", "has_postcode", "address_id", "imd_quintile"],
+    )
+
+    patient_index = pc.index_in(registrations.column("patient_id"), value_set=patients.column("patient_id"))
+    keep = pc.is_valid(patient_index).to_numpy(zero_copy_only=False)
+    start = days(registrations.column("start_date"))
+    keep &= ~np.isnan(start)
+    patient = pc.fill_null(patient_index, 0).to_numpy(zero_copy_only=False)[keep].astype("int64")
+    start = start[keep]
+
+    # spells end at deregistration, death or the end of the last year
+    death = np.fmin(days(patients.column("date_of_death")), days(patients.column("ons_date_of_death")))
+    end = np.fmin(days(registrations.column("end_date"))[keep], death[patient])
+    end = np.where(np.isnan(end), boundaries[-1] - 1, np.minimum(end, boundaries[-1] - 1))
+    spell_ids = np.flatnonzero(keep)
+
+    # (spells are ordered by their actual start, so are clipped to the study after)
+    order, start = non_overlapping(patient, start, end)
+    patient, end, spell_ids = patient[order], end[order], spell_ids[order]
+    start = np.maximum(start, boundaries[0])
+    in_study = start <= end
+    patient, start, end, spell_ids = patient[in_study], start[in_study], end[in_study], spell_ids[in_study]
+    spell, year, n_days = split_by_year(start.astype("int64"), end.astype("int64"), boundaries)
+    patient = patient[spell]
+
+    # age bands and plausible ages at the start of each year, gathered from
+    # birth month x year lookups
+    date_of_birth = patients.column("date_of_birth").to_numpy(zero_copy_only=False)[patient]
+    year_days = boundaries[:-1].astype("datetime64[D]")
+    bands = age_band_lookup(year_days)
+    plausible = age_band_index(age_band_lookup(year_days, plausible_age_edges), date_of_birth, year) == 1
+    spell, year, n_days, patient = spell[plausible], year[plausible], n_days[plausible], patient[plausible]
+    age_band = age_band_index(bands, date_of_birth[plausible], year)
+
+    sex_codes, sex_labels = encode(patients.column("sex").to_pandas())
+    region_codes, region_labels = encode(registrations.column("region").to_pandas())
+    # IMD quintile at the start of each year, from the address history, for
+    # every patient x year (patient-major)
+    patient_ids = np.repeat(patients.column("patient_id").to_numpy(), len(years))
+    address = as_of(address_history(addresses), patient_ids, np.tile(year_days, len(patients)))
+    imd = take(pc.cast(addresses.column("imd_quintile"), pa.string()), address)
+    imd_codes, imd_labels = encode(imd)
+
+    pieces = pd.DataFrame({
+        "patient": patient,
+        "year": year,
+        "days": n_days,
+        "age_band": age_band,
+        "sex": sex_codes[patient],
+        "region": region_codes[spell_ids[spell]],
+        "imd_quintile": imd_codes.reshape(len(patients), len(years))[patient, year],
+    })
+    labels = {
+        "year": [f"{year}-01-01" for year in years],
+        "age_band": bands["labels"] + [missing_label],
+        "sex": sex_labels,
+        "region": region_labels,
+        "imd_quintile": imd_labels,
+    }
+    return pieces, labels
+
+
+def cross_table(pieces, labels):
+    """
+    Registered days per year x age band x sex x region x IMD quintile, as an
+    array with one axis per dimension (summed with a single bincount).
+    """
+    dimensions = ["year"] + subgroups
+    shape = tuple(len(labels[dimension]) for dimension in dimensions)
+    cell = np.ravel_multi_index(tuple(pieces[dimension].to_numpy() for dimension in dimensions), shape)
+    return np.bincount(cell, weights=pieces["days"], minlength=int(np.prod(shape))).reshape(shape)
+
+
+def subgroup_table(pieces, labels):
+    """
+    Person-years and the number of patients contributing, per year for everyone
+    and for each subgroup on its own (the measures subgroups).
+    """
+    person_days = cross_table(pieces, labels)
+    n_years = len(labels["year"])
+
+    tables = []
+    for position, subgroup in enumerate(["all"] + subgroups):
+        if subgroup == "all":
+            days_by_value = person_days.reshape(n_years, -1).sum(axis=1, keepdims=True)
+            value = np.zeros(len(pieces), dtype="int64")
+            value_labels = [None]
+        else:
+            other_axes = tuple(axis for axis in range(1, person_days.ndim) if axis != position)
+            days_by_value = person_days.sum(axis=other_axes)
+            value = pieces[subgroup].to_numpy()
+            value_labels = labels[subgroup]
+
+        # distinct patients per year x value (a patient can move practice or
+        # address within a year)
+        n_values = len(value_labels)
+        key = np.unique((pieces["patient"].to_numpy() * n_years + pieces["year"].to_numpy()) * n_values + value)
+        n_patients = np.bincount(key % (n_years * n_values), minlength=n_years * n_values)
+
+        year, value_index = np.divmod(np.arange(n_years * n_values), n_values)
+        tables.append(pd.DataFrame({
+            "interval_start": np.asarray(labels["year"])[year],
+            "subgroup": subgroup,
+            "subgroup_value": np.asarray(value_labels, dtype=object)[value_index],
+            "n_patients": n_patients,
+            "person_years": days_by_value.ravel() / 365.25,
+        }))
+
+    table = pd.concat(tables, ignore_index=True)
+    return table[table["n_patients"] > 0].reset_index(drop=True)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input-dir", default=default_input_dir)
+    parser.add_argument("--output", default="output/tables/person_time_by_year_and_subgroup.csv")
+    args = parser.parse_args()
+
+    pieces, labels = registered_days(args.input_dir)
+    table = subgroup_table(pieces, labels)
+    table["n_patients"] = round_counts(table["n_patients"])
+    table.loc[table["n_patients"].isna(), "person_years"] = np.nan
+    table["person_years"] = table["person_years"].round(1)
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
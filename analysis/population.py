@@ -0,0 +1,166 @@
+# #############################################################################
+# Population
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# The per-patient components of the inclusion criteria (first registration,
+# latest deregistration, death dates from TPP and ONS, sex and plausible age),
+# defined once here and used by the cohort populations and the measures
+# denominators, so that every definition builds the same ehrQL expressions and
+# the backend only has to evaluate them once.
+
+from ehrql.tables.tpp import patients, practice_registrations, ons_deaths
+
+# -------------------
+# Components
+# -------------------
+date_of_first_practice_registration = (
+    practice_registrations.sort_by(practice_registrations.start_date)
+    .first_for_patient().start_date
+)
+
+end_date_of_latest_practice_registration = (
+    practice_registrations.sort_by(practice_registrations.end_date)
+    .last_for_patient().end_date
+)
+
+date_of_death = patients.date_of_death
+ons_date_of_death = ons_deaths.date
+
+has_non_disclosive_sex = patients.sex.is_in(["male", "female"])
+
+has_first_registration_between_birth_and_death = (
+    # between dob and date of death
+    (date_of_first_practice_registration.is_on_or_between(patients.date_of_birth, date_of_death)) |
+    # after dob and date of death is null (still alive)
+    (date_of_first_practice_registration.is_on_or_after(patients.date_of_birth) & date_of_death.is_null())
+)
+
+
+# -------------------
+# Criteria
+# -------------------
+def is_registered_at_any_time_between(start_date, end_date):
+    """
+    Registered at any time between two dates, from the first registration and
+    the latest deregistration.
+    """
+    return (
+        # starts during period
+        date_of_first_practice_registration.is_on_or_between(start_date, end_date)
+        # ending during period
+        | end_date_of_latest_practice_registration.is_on_or_between(start_date, end_date)
+        # starting before and ending after (or ongoing)
+        | (
+            date_of_first_practice_registration.is_on_or_before(start_date)
+            & (
+                end_date_of_latest_practice_registration.is_on_or_after(end_date)
+                | end_date_of_latest_practice_registration.is_null()
+            )
+        )
+    )
+
+
+def was_registered_during(interval):
+    """
+    Had a registration that overlaps the interval.
+    """
+    return practice_registrations.where(
+        # registered for the entire interval
+        ((practice_registrations.start_date.is_on_or_before(interval.start_date))
+        & (practice_registrations.end_date.is_on_or_after(interval.end_date))) |
+
+        # registered during the interval and end date is after the interval end date
+        ((practice_registrations.start_date.is_after(interval.start_date))
+         & (practice_registrations.end_date.is_on_or_after(interval.end_date))) |
+
+         # registered before the interval and registration is ongoing
+         ((practice_registrations.start_date.is_on_or_before(interval.start_date)) &
+          (practice_registrations.end_date.is_null())) |
+
+          # registered after interval start date and registration is ongoing
+          ((practice_registrations.start_date.is_after(interval.start_date)) &
+           (practice_registrations.end_date.is_null())) |
+
+           # registered before the interval start date and end date is before the end date, but after the start date
+           ((practice_registrations.start_date.is_before(interval.start_date)) &
+           (practice_registrations.end_date.is_between_but_not_on(interval.start_date, interval.end_date))) |
+
+           # registered for part of the interval only
+           ((practice_registrations.start_date.is_between_but_not_on(interval.start_date, interval.end_date)) &
+            (practice_registrations.end_date.is_between_but_not_on(interval.start_date, interval.end_date)))
+    ).exists_for_patient()
+
+
+def is_registered_on(date):
+    return practice_registrations.exists_for_patient_on(date)
+
+
+def did_not_die_before(date):
+    """
+    Not recorded as dead on or before the date in either TPP or ONS.
+    """
+    return (
+        ((date_of_death > date) | date_of_death.is_null()) &
+        ((ons_date_of_death > date) | ons_date_of_death.is_null())
+    )
+
+
+def is_alive_on(date):
+    return patients.is_alive_on(date)
+
+
+def has_plausible_age_between(start_date, end_date):
+    """
+    Not over 110 at the start date, and born by the end date.
+    """
+    return (patients.age_on(start_date) <= 110) & (patients.age_on(end_date) >= 0)
+
+
+def has_plausible_age_on(date):
+    return (patients.age_on(date) < 110) & (patients.age_on(date) > 0)
+
+
+# -------------------
+# Populations
+# -------------------
+def study_population(start_date, end_date):
+    """
+    Registered at any time during the study, with a first registration between
+    birth and death, a non-disclosive sex, alive at the start of the study and a
+    plausible age (the full study cohort).
+    """
+    return (
+        is_registered_at_any_time_between(start_date, end_date)
+        & has_first_registration_between_birth_and_death
+        & has_non_disclosive_sex
+        & did_not_die_before(start_date)
+        & has_plausible_age_between(start_date, end_date)
+    )
+
+
+def census_population(census_date):
+    """
+    Registered and alive on the census date, with a non-disclosive sex and a
+    plausible age.
+    """
+    return (
+        is_registered_on(census_date)
+        & has_non_disclosive_sex
+        & has_plausible_age_on(census_date)
+        & is_alive_on(census_date)
+    )
+
+
+def interval_denominator(interval):
+    """
+    Alive at the start of the interval, registered at some point during it, with
+    a recorded sex and a plausible age (the measures denominator).
+    """
+    return (
+        is_alive_on(interval.start_date)
+        & was_registered_during(interval)
+        & has_non_disclosive_sex
+        & has_plausible_age_on(interval.start_date)
+    )
@@ -4,7 +4,6 @@
 # - Bennett Institute for Applied Data Science, University of Oxford, 2026
 #############################################################################
 
-from ehrql.tables.core import patients
 from ehrql import (
     years,
     INTERVAL,
@@ -12,11 +11,9 @@ from ehrql import (
     claim_permissions
 )
 
-from ehrql.tables.tpp import (
-    practice_registrations,
-    appointments
-)
+from ehrql.tables.tpp import appointments
 import migration_status_variables
+import population
 
 claim_permissions("appointments")
 
@@ -26,40 +23,7 @@ measures.configure_disclosure_control(enabled=True)
 
 # common denominator conditions
 
-was_alive_on_1Jan = patients.is_alive_on(INTERVAL.start_date)
-
-was_registered_at_any_point_during_interval = practice_registrations.where(
-        # registered for the entire interval
-        ((practice_registrations.start_date.is_on_or_before(INTERVAL.start_date)) 
-        & (practice_registrations.end_date.is_on_or_after(INTERVAL.end_date))) |
-        
-        # registered during the interval and end date is after the interval end date
-        ((practice_registrations.start_date.is_after(INTERVAL.start_date))
-         & (practice_registrations.end_date.is_on_or_after(INTERVAL.end_date))) |
-         
-         # registered before the interval and registration is ongoing
-         ((practice_registrations.start_date.is_on_or_before(INTERVAL.start_date)) &
-          (practice_registrations.end_date.is_null())) |
-          
-          # registered after interval start date and registration is ongoing
-          ((practice_registrations.start_date.is_after(INTERVAL.start_date)) &
-           (practice_registrations.end_date.is_null())) |
-           
-           # registered before the interval start date and end date is before the end date, but after the start date 
-           ((practice_registrations.start_date.is_before(INTERVAL.start_date)) &
-           (practice_registrations.end_date.is_between_but_not_on(INTERVAL.start_date, INTERVAL.end_date))) |
-           
-           # registered for part of the interval only
-           ((practice_registrations.start_date.is_between_but_not_on(INTERVAL.start_date, INTERVAL.end_date)) &
-            (practice_registrations.end_date.is_between_but_not_on(INTERVAL.start_date, INTERVAL.end_date)))
-    ).exists_for_patient()
-
-has_recorded_sex = patients.sex.is_in(["male", "female"])
-
-has_possible_age = (
-        (patients.age_on(INTERVAL.start_date) < 110)
-        & (patients.age_on(INTERVAL.start_date) > 0)
-    )
+denominator = population.interval_denominator(INTERVAL)
 
 # migrant  = clinical_events.where(
 #         clinical_events.snomedct_code.is_in(codelists.all_migrant_codes)).where(
@@ -71,13 +35,7 @@ mig3_expr = migration_status_variables.build_mig_status_3_cat_withdoe(denominato
 
 migrant_denominator = (mig3_expr == "Migrant")
 
-migrant_denominator = (
-        was_alive_on_1Jan
-        & was_registered_at_any_point_during_interval
-        & has_recorded_sex
-        & has_possible_age
-        & migrant_denominator 
-    )
+migrant_denominator = denominator & migrant_denominator
 
 # any planned primary care contacts during the interval 
 # code reference: https://github.com/opensafely/winter-pressures-phase-II/blob/main/analysis/appointments/app_measures.py (Accessed 18/06/26)
@@ -90,7 +48,7 @@ planned_encounters_only = appointments.where(
 
 labels = ["Migrant", "Non-migrant", "Unknown"]
 for label in labels:
-    migrant_denom = was_alive_on_1Jan & was_registered_at_any_point_during_interval & has_recorded_sex & has_possible_age & (mig3_expr == label)
+    migrant_denom = denominator & (mig3_expr == label)
     safe_label = label.lower().replace("-", "_")
     name = f"planned_and_actual_primary_care_activity_{safe_label}"
     measures.define_measure(
@@ -101,7 +59,7 @@ for label in labels:
         )
 
 for label in labels:
-    migrant_denom = was_alive_on_1Jan & was_registered_at_any_point_during_interval & has_recorded_sex & has_possible_age & (mig3_expr == label)
+    migrant_denom = denominator & (mig3_expr == label)
     safe_label = label.lower().replace("-", "_")
     name = f"planned_primary_care_activity_{safe_label}"
     measures.define_measure(
@@ -0,0 +1,162 @@
+# #############################################################################
+# Profile a dataset or measures definition variable by variable
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# This is a script to find which variables of a dataset definition (each
+# `dataset.<name>` assignment) or which measures (each `measures.define_measure`
+# name) are responsible for a definition being slow or memory hungry.
+#
+# The definition is loaded as ehrql loads it, then each variable is evaluated on
+# its own (with the population) by ehrql's local file query engine against the
+# synthetic tables from generate_synthetic_tables.py. Each is evaluated twice:
+# once for the wall time, and once under tracemalloc for the peak memory
+# allocated by Python (tracemalloc slows every allocation down, so it isn't
+# running while the time is taken). The population on its own is evaluated
+# first, so its cost can be taken off each variable.
+#
+#     python analysis/profile_definition.py analysis/dataset_definition_full_study_cohort.py
+#     python analysis/profile_definition.py analysis/dataset_definition_census_cohorts.py -- --census-date 2021-03-21
+#
+# The local engine is much slower than the production database, so the absolute
+# numbers only matter relative to each other.
+
+import dataclasses
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from pathlib import Path
+
+import pandas as pd
+
+from benchmark_actions import ensure_tables
+from generate_synthetic_tables import tiers
+from scan_cost_report import load_definition
+
+
+def find_definition(namespace):
+    """
+    The dataset or measures object created by a definition.
+    """
+    from ehrql.measures import Measures
+    from ehrql.query_language import Dataset
+
+    for value in namespace.values():
+        if isinstance(value, (Dataset, Measures)):
+            return value
+    raise ValueError("definition doesn't create a dataset or measures")
+
+
+def dataset_queries(definition_file, user_args):
+    """
+    {variable name: query model dataset with only that variable}, plus the
+    population on its own.
+    """
+    from ehrql.loaders import load_dataset_definition
+
+    compiled, _ = load_dataset_definition(Path(definition_file), user_args, environ={})
+    queries = {"<population>": dataclasses.replace(compiled, variables={})}
+    for name, node in compiled.variables.items():
+        queries[name] = dataclasses.replace(compiled, variables={name: node})
+    return queries
+
+
+def measure_queries(measures):
+    """
+    {measure name: measures collection with only that measure}.
+    """
+    from ehrql import create_measures
+
+    queries = {}
+    for measure in measures:
+        single = create_measures()
+        single.define_measure(
+            name=measure.name,
+            numerator=measure.numerator,
+            denominator=measure.denominator,
+            group_by=measure.group_by,
+            intervals=measure.intervals,
+        )
+        queries[measure.name] = single
+    return queries
+
+
+def profile(queries, evaluate):
+    """
+    Wall time and peak memory of evaluate(query) for each query, one at a time.
+    """
+    results = []
+    for name, query in queries.items():
+        start = time.perf_counter()
+        n_rows = sum(1 for _ in evaluate(query))
+        wall_time = time.perf_counter() - start
+
+        tracemalloc.start()
+        for _ in evaluate(query):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append({
+            "name": name,
+            "wall_time_seconds": round(wall_time, 3),
+            "peak_memory_mb": round(peak / 1024**2, 1),
+            "rows": n_rows,
+        })
+    return pd.DataFrame(results)
+
+
+def hot_spots(results):
+    """
+    Results ranked by wall time, with the cost of the population on its own
+    taken off each variable (dataset definitions only).
+    """
+    results = results.copy()
+    population = results[results["name"] == "<population>"]
+    if len(population):
+        results = results[results["name"] != "<population>"]
+        for column in ("wall_time_seconds", "peak_memory_mb"):
+            results[f"{column}_over_population"] = (results[column] - population[column].iloc[0]).round(3)
+    results = results.sort_values("wall_time_seconds", ascending=False, ignore_index=True)
+    results["share_of_time"] = (results["wall_time_seconds"] / results["wall_time_seconds"].sum()).round(3)
+    return results
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("definition")
+    parser.add_argument("--tier", choices=tiers, default="10k")
+    parser.add_argument("--variables", nargs="+", help="only profile these variables/measures")
+    parser.add_argument("--top", type=int, default=20, help="number of hot spots to print")
+    parser.add_argument("--output", help="CSV file to write the full ranked table to")
+    parser.add_argument("user_args", nargs="*", help="arguments passed to the definition (after --)")
+    args = parser.parse_args()
+
+    from ehrql.measures.calculate import get_measure_results
+    from ehrql.measures import Measures
+    from ehrql.query_engines.local_file import LocalFileQueryEngine
+
+    definition = find_definition(load_definition(args.definition, args.user_args))
+    query_engine = LocalFileQueryEngine(str(ensure_tables(args.tier)))
+
+    if isinstance(definition, Measures):
+        queries = measure_queries(definition)
+        evaluate = lambda measures: get_measure_results(query_engine, measures)  # noqa: E731
+    else:
+        queries = dataset_queries(args.definition, args.user_args)
+        evaluate = query_engine.get_results
+    if args.variables:
+        queries = {name: queries[name] for name in ["<population>", *args.variables] if name in queries}
+
+    results = hot_spots(profile(queries, evaluate))
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        results.to_csv(args.output, index=False)
+
+    print(f"{args.definition} [{args.tier}]: {len(results)} variables/measures")
+    print(results.head(args.top).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
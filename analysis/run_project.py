@@ -0,0 +1,347 @@
+# #############################################################################
+# Run the actions in project.yaml locally, in parallel and only when needed
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# This is a script to run project.yaml locally without re-running actions whose
+# inputs haven't changed. Each action gets a key that is a hash of:
+#   - its run command
+#   - the contents of its script, and for python scripts (including dataset and
+#     measures definitions) every module in analysis/ it imports, recursively, and
+#     for R scripts every file it source()s, recursively
+#   - the contents of the codelist files, if it (indirectly) imports codelists
+#   - the dummy tables, if given
+#   - the keys of the actions it needs
+# An action is skipped if its key matches the last successful run and all of its
+# outputs exist (each output pattern, which may be a glob, matches a file), so a
+# change to process_census_cohort_data.R only re-runs that action (and anything
+# that needs it), not the extractions.
+#
+# Actions whose needs have finished are run concurrently in a process pool.
+#
+#     python analysis/run_project.py                      # everything
+#     python analysis/run_project.py generate_demographics_census_2021_study_table_2cat --jobs 4
+#     python analysis/run_project.py --dry-run            # what would run
+#
+# ehrql actions are run with `python -m ehrql` (as in the devcontainer), through
+# extraction_cache.py unless --no-cache is given, r actions with Rscript and python
+# actions with python.
+
+import ast
+import glob
+import hashlib
+import json
+import re
+import shlex
+import subprocess
+import time
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import yaml
+
+import codelists
+from codelist_compiler import codelists_dir
+
+analysis_dir = Path("analysis")
+local_run_dir = Path("logs/local_run")
+state_path = local_run_dir / "state.json"
+
+
+def load_actions(project_file="project.yaml"):
+    """
+    {action name: {"run": [...], "needs": [...], "outputs": [paths]}}
+    """
+    project = yaml.safe_load(Path(project_file).read_text())
+    actions = {}
+    for name, action in project["actions"].items():
+        actions[name] = {
+            "run": shlex.split(action["run"]),
+            "needs": action.get("needs", []),
+            "outputs": [
+                path
+                for outputs in action.get("outputs", {}).values()
+                for path in outputs.values()
+            ],
+        }
+    return actions
+
+
+def local_command(run, ehrql_command="python -m ehrql", dummy_tables=None, use_cache=True):
+    """
+    The command to run an action locally, from its project.yaml run line.
+    """
+    image, args = run[0], run[1:]
+    if image.startswith("ehrql:"):
+        if dummy_tables:
+            extra = []
+            if "--" in args:
+                position = args.index("--")
+                args, extra = args[:position], args[position:]
+            args = args + ["--dummy-tables", str(dummy_tables)] + extra
+        if use_cache:
+            return ["python", "analysis/extraction_cache.py", "--ehrql-command", ehrql_command, "--image", image] + args
+        return shlex.split(ehrql_command) + args
+    if image.startswith("r:"):
+        return ["Rscript"] + args
+    if image.startswith("python:"):
+        return ["python"] + args
+    raise ValueError(f"don't know how to run {image} actions locally")
+
+
+def local_imports(script):
+    """
+    Modules in analysis/ imported by a python script, recursively (both the flat
+    `import utilities` form and `from analysis import utilities`).
+    """
+    found = set()
+    pending = [Path(script)]
+    while pending:
+        path = pending.pop()
+        for node in ast.walk(ast.parse(path.read_text())):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module == "analysis":
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = analysis_dir / f"{name.removeprefix('analysis.')}.py"
+                if module.exists() and module not in found:
+                    found.add(module)
+                    pending.append(module)
+    return sorted(found)
+
+
+source_call = re.compile(r"""source\(\s*((?:here::)?here\((?P<here>[^)]*)\)|["'](?P<path>[^"']+)["'])""")
+
+
+def sourced_files(script):
+    """
+    Files source()d by an R script, recursively, as either
+    `source(here("analysis", "lib", "utility.R"))` or `source("analysis/lib/utility.R")`.
+    """
+    found = set()
+    pending = [Path(script)]
+    while pending:
+        path = pending.pop()
+        for line in path.read_text().splitlines():
+            code = line.split("#", 1)[0]
+            for match in source_call.finditer(code):
+                if match["here"] is not None:
+                    sourced = Path(*re.findall(r"""["']([^"']+)["']""", match["here"]))
+                else:
+                    sourced = Path(match["path"])
+                if sourced.exists() and sourced not in found:
+                    found.add(sourced)
+                    pending.append(sourced)
+    return sorted(found)
+
+
+def codelist_files():
+    filenames = {filename for filename, _, _ in codelists.codelist_specs.values()}
+    return [codelists_dir / filename for filename in sorted(filenames)]
+
+
+def input_files(run):
+    """
+    Files whose contents an action depends on: its script, any analysis modules
+    the script imports (or R files it sources), and the codelists if those are
+    imported.
+    """
+    scripts = [Path(arg) for arg in run[1:] if arg.endswith((".py", ".R")) and Path(arg).exists()]
+    files = list(scripts)
+    for script in scripts:
+        if script.suffix == ".py":
+            imports = local_imports(script)
+            files += imports
+            if analysis_dir / "codelists.py" in imports:
+                files += codelist_files()
+        else:
+            files += sourced_files(script)
+    return sorted(set(files))
+
+
+def hash_file(path, digest):
+    digest.update(str(path).encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+
+def hash_tables(dummy_tables, digest):
+    # the tables can be large, so use their names, sizes and modification times
+    for path in sorted(Path(dummy_tables).iterdir()):
+        stat = path.stat()
+        digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+
+def action_keys(actions, dummy_tables=None):
+    """
+    {action name: content hash} (see the top of this file), in dependency order.
+    """
+    keys = {}
+
+    def key(name):
+        if name not in keys:
+            action = actions[name]
+            digest = hashlib.sha256(json.dumps(action["run"]).encode())
+            for path in input_files(action["run"]):
+                hash_file(path, digest)
+            if dummy_tables and action["run"][0].startswith("ehrql:"):
+                hash_tables(dummy_tables, digest)
+            for need in action["needs"]:
+                digest.update(f"{need}:{key(need)}".encode())
+            keys[name] = digest.hexdigest()
+        return keys[name]
+
+    for name in actions:
+        key(name)
+    return keys
+
+
+def with_needs(actions, targets):
+    """
+    The target actions and everything they (indirectly) need.
+    """
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending += actions[name]["needs"]
+    return selected
+
+
+def load_state():
+    if state_path.exists():
+        return json.loads(state_path.read_text())
+    return {}
+
+
+def save_state(state):
+    local_run_dir.mkdir(parents=True, exist_ok=True)
+    state_path.write_text(json.dumps(state, indent=2, sort_keys=True))
+
+
+def is_up_to_date(action, key, state):
+    # outputs are glob patterns (e.g. output/tables/annual_counts/2cat/*.csv), and
+    # each has to match at least one file
+    return state.get(action["name"]) == key and all(glob.glob(pattern) for pattern in action["outputs"])
+
+
+def run_command(name, command):
+    """
+    Run one action in a worker, logging its output to logs/local_run/<name>.log.
+    """
+    log_path = local_run_dir / f"{name}.log"
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        returncode = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode
+    return returncode, round(time.perf_counter() - start, 1), str(log_path)
+
+
+def run_actions(actions, keys, targets, jobs, force=False, dry_run=False):
+    """
+    Run the targets (and what they need) in dependency order, up to `jobs` at a
+    time. Returns {action: "skipped"/"ran"/"failed"/"not run"}.
+    """
+    state = load_state()
+    selected = with_needs(actions, targets)
+    status = {}
+    to_run = {}
+    for name in selected:
+        action = {"name": name, **actions[name]}
+        if not force and is_up_to_date(action, keys[name], state):
+            status[name] = "skipped"
+        else:
+            to_run[name] = action
+
+    # an action has to run if anything it needs runs (its key will have changed
+    # if the needed action's inputs changed, but not if only its outputs are missing)
+    changed = True
+    while changed:
+        changed = False
+        for name in selected - set(to_run):
+            if any(need in to_run for need in actions[name]["needs"]):
+                to_run[name] = {"name": name, **actions[name]}
+                status.pop(name)
+                changed = True
+
+    if dry_run:
+        for name in to_run:
+            status[name] = "would run"
+        return status
+
+    local_run_dir.mkdir(parents=True, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        while to_run or running:
+            for name, action in list(to_run.items()):
+                needs = action["needs"]
+                if any(status.get(need) in ("failed", "not run") for need in needs):
+                    status[name] = "not run"
+                    del to_run[name]
+                elif all(status.get(need) in ("skipped", "ran") for need in needs):
+                    future = pool.submit(run_command, name, action["command"])
+                    running[future] = name
+                    del to_run[name]
+
+            if not running:
+                if to_run:
+                    raise ValueError(f"circular needs between {sorted(to_run)}")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                returncode, seconds, log_path = future.result()
+                if returncode == 0:
+                    status[name] = "ran"
+                    state[name] = keys[name]
+                    save_state(state)
+                    print(f"{name}: ran in {seconds}s")
+                else:
+                    status[name] = "failed"
+                    state.pop(name, None)
+                    save_state(state)
+                    print(f"{name}: FAILED (exit {returncode}), see {log_path}")
+    return status
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("actions", nargs="*", help="actions to run (with what they need); defaults to all")
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--force", action="store_true", help="run even if nothing has changed")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--dummy-tables", help="directory of dummy tables for the ehrql actions")
+    parser.add_argument("--ehrql-command", default="python -m ehrql")
+    parser.add_argument("--no-cache", action="store_true", help="don't use the extraction cache")
+    parser.add_argument("--project", default="project.yaml")
+    args = parser.parse_args()
+
+    actions = load_actions(args.project)
+    for action in actions.values():
+        action["command"] = local_command(
+            action["run"], args.ehrql_command, args.dummy_tables, use_cache=not args.no_cache
+        )
+    keys = action_keys(actions, args.dummy_tables)
+
+    status = run_actions(
+        actions, keys, args.actions or list(actions), args.jobs,
+        force=args.force, dry_run=args.dry_run,
+    )
+    for name in actions:
+        if name in status and status[name] != "ran":
+            print(f"{name}: {status[name]}")
+    if "failed" in status.values():
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
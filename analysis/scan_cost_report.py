@@ -0,0 +1,236 @@
+## Script to report the static scan cost of a dataset or measures definition
+## Loads a definition (e.g. dataset_definition_full_study_cohort.py or
+## generate_annual_migrant_counts_6cat.py) the way ehrql does, walks the ehrQL
+## query graph behind every variable/measure and counts, per table, the distinct
+## filtered frames, row picks (first/last_for_patient, for_patient_on) and
+## aggregations (exists/count/minimum_for_patient etc.).
+##
+## Measures are evaluated once per interval, so anything that depends on INTERVAL
+## is multiplied by the number of intervals; estimated_scans is the number of
+## aggregations and row picks ehrql has to evaluate, after that multiplication.
+##
+##     python analysis/scan_cost_report.py analysis/generate_annual_migrant_counts_6cat.py
+##     python analysis/scan_cost_report.py analysis/dataset_definition_census_cohorts.py -- --census-date 2021-03-21
+##
+## Pass --baseline with the CSV written for the previous version of a definition to
+## see what a change adds.
+## Author: Yamina Boukari
+####
+
+import dataclasses
+import runpy
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from pathlib import Path
+
+import pandas as pd
+
+# ehrQL query model node types (ehrql.query_model.nodes), by class name
+table_nodes = ("SelectTable", "SelectPatientTable")
+filter_node = "Filter"
+sort_node = "Sort"
+pick_node = "PickOneRowPerPatient"
+parameter_node = "Parameter"
+aggregation_prefix = "AggregateByPatient."
+
+report_columns = [
+    "table",
+    "filtered_frames",
+    "sorted_frames",
+    "row_picks",
+    "aggregations",
+    "interval_dependent",
+    "intervals",
+    "estimated_scans",
+]
+
+
+def load_definition(definition_file, user_args=()):
+    """
+    Run a definition file with analysis/ and the repository root importable and
+    `user_args` as its command line (as ehrql does), returning its globals.
+    """
+    definition_file = Path(definition_file).resolve()
+    saved_path, saved_argv = sys.path[:], sys.argv[:]
+    sys.path[:0] = [str(definition_file.parent), str(definition_file.parent.parent)]
+    sys.argv = [str(definition_file), *user_args]
+    try:
+        return runpy.run_path(str(definition_file), run_name="__main__")
+    finally:
+        sys.path[:], sys.argv[:] = saved_path, saved_argv
+
+
+def query_roots(namespace):
+    """
+    {name: (query model nodes, number of intervals)} for the dataset variables
+    (and population) or the measures in a definition's globals.
+    """
+    from ehrql.measures import Measures
+    from ehrql.query_language import Dataset
+
+    dataset = next((value for value in namespace.values() if isinstance(value, Dataset)), None)
+    measures = next((value for value in namespace.values() if isinstance(value, Measures)), None)
+
+    if measures is not None:
+        return {
+            measure.name: (
+                [qm_node(measure.numerator), qm_node(measure.denominator)]
+                + [qm_node(series) for series in measure.group_by.values()],
+                len(measure.intervals),
+            )
+            for measure in measures
+        }
+    if dataset is not None:
+        compiled = dataset._compile()
+        roots = {"population": ([compiled.population], 1)}
+        roots.update({name: ([node], 1) for name, node in compiled.variables.items()})
+        return roots
+    raise ValueError("definition doesn't create a dataset or measures")
+
+
+def qm_node(series):
+    return getattr(series, "_qm_node", series)
+
+
+def node_type(node):
+    return type(node).__qualname__
+
+
+def child_nodes(node):
+    """
+    Query model nodes are frozen dataclasses; their inputs are the fields that
+    are nodes, or tuples/dicts of nodes (e.g. Case).
+    """
+    values = [getattr(node, field.name) for field in dataclasses.fields(node)]
+    while values:
+        value = values.pop()
+        if isinstance(value, dict):
+            values += [*value.keys(), *value.values()]
+        elif isinstance(value, (tuple, list)):
+            values += value
+        elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+            yield value
+
+
+def source_table(node):
+    """
+    Name of the table a frame/aggregation is built on (following .source).
+    """
+    while node_type(node) not in table_nodes:
+        if not hasattr(node, "source"):
+            return node_type(node)
+        node = node.source
+    return node.name
+
+
+def walk(roots):
+    """
+    Every distinct node reachable from `roots` (equal nodes are counted once, as
+    ehrql builds one query for them), and the subset that depend on an interval
+    parameter.
+    """
+    nodes = {}
+    interval_dependent = {}
+
+    def visit(node):
+        key = id(node)
+        if key in nodes:
+            return interval_dependent[key]
+        nodes[key] = node
+        interval_dependent[key] = False
+        depends = node_type(node) == parameter_node
+        for child in child_nodes(node):
+            depends |= visit(child)
+        interval_dependent[key] = depends
+        return depends
+
+    for root in roots:
+        visit(root)
+
+    distinct = {}
+    for key, node in nodes.items():
+        try:
+            distinct.setdefault(node, interval_dependent[key])
+        except TypeError:
+            # not hashable (shouldn't happen for query model nodes): count by identity
+            distinct[key] = interval_dependent[key]
+    return distinct
+
+
+def scan_costs(roots):
+    """
+    Per-table counts for {name: (root nodes, intervals)} from query_roots.
+    """
+    counts = defaultdict(lambda: dict.fromkeys(report_columns[1:], 0))
+    per_interval = defaultdict(set)
+
+    by_intervals = defaultdict(list)
+    for nodes, intervals in roots.values():
+        by_intervals[intervals].extend(nodes)
+
+    for intervals, nodes in by_intervals.items():
+        for node, depends_on_interval in walk(nodes).items():
+            kind = node_type(node)
+            if kind == filter_node:
+                column = "filtered_frames"
+            elif kind == sort_node:
+                column = "sorted_frames"
+            elif kind == pick_node:
+                column = "row_picks"
+            elif kind.startswith(aggregation_prefix):
+                column = "aggregations"
+            else:
+                continue
+
+            table = source_table(node)
+            counts[table][column] += 1
+            if depends_on_interval:
+                counts[table]["interval_dependent"] += 1
+                per_interval[table].add(intervals)
+            if column in ("row_picks", "aggregations"):
+                counts[table]["estimated_scans"] += intervals if depends_on_interval else 1
+
+    for table in counts:
+        counts[table]["intervals"] = max(per_interval[table], default=1)
+
+    return pd.DataFrame(
+        [{"table": table, **table_counts} for table, table_counts in sorted(counts.items())],
+        columns=report_columns,
+    )
+
+
+def compare_with_baseline(report, baseline):
+    """
+    Report with the change in each count since `baseline`.
+    """
+    merged = report.merge(baseline, on="table", how="outer", suffixes=("", "_baseline")).fillna(0)
+    for column in report_columns[1:]:
+        merged[column] = merged[column].astype("int64")
+        merged[f"{column}_change"] = merged[column] - merged[f"{column}_baseline"].astype("int64")
+    return merged[["table"] + [c for column in report_columns[1:] for c in (column, f"{column}_change")]]
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("definition")
+    parser.add_argument("--output", help="CSV file to write the report to")
+    parser.add_argument("--baseline", help="report CSV for the previous version of the definition")
+    parser.add_argument("user_args", nargs="*", help="arguments passed to the definition (after --)")
+    args = parser.parse_args()
+
+    roots = query_roots(load_definition(args.definition, args.user_args))
+    report = scan_costs(roots)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        report.to_csv(args.output, index=False)
+    if args.baseline:
+        report = compare_with_baseline(report, pd.read_csv(args.baseline))
+
+    print(f"{args.definition}: {len(roots)} variables/measures")
+    print(report.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
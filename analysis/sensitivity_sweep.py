@@ -0,0 +1,180 @@
+## Script to run sensitivity analyses of the migration status variables offline
+## Rather than a second copy of every categorisation, action and output for each
+## variant (as for the _withdoe measures), the per-patient state is extracted once
+## (dataset_definition_cumulative_coding.py: the first code date in each
+## build_migrant_indicators category) and a grid of variants is evaluated from it:
+##   - with or without the date of UK entry code
+##   - alternative end dates (a flag on an end date is first code date <= end date)
+##   - dropping individual codelists (a dropped component of any_migrant is also
+##     taken out of any_migrant, using the first any_migrant code outside it)
+## The 2-, 3- and 6-category statuses are derived as in migration_status_variables.
+## Variants are evaluated in parallel, each worker reading the cohort through a
+## memory map.
+##
+## Outputs (counts rounded with disclosure.round_counts), one table per variant:
+##   - output/tables/sensitivity/<variant>.csv: categorisation, group, group_value, category, n
+## Author: Yamina Boukari
+####
+
+import itertools
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from codelists import migrant_component_flags, migrant_flag_codelists
+from cohort_reader import read_columns
+from disclosure import round_counts
+from snapshots import days
+
+default_input = "output/cohorts/cumulative_coding/dataset.arrow"
+default_output_dir = "output/tables/sensitivity"
+study_end_date = "2025-12-31"
+
+flags = list(migrant_flag_codelists)
+
+# codelists that can be dropped (without DOE is its own dimension)
+droppable = [name for name in flags if name not in ("any_migrant", "date_of_uk_entry")]
+
+# per-worker base state (loaded once by each worker process)
+state = {}
+
+
+def load_state(path, group_by=()):
+    columns = (
+        [f"first_{name}_date" for name in flags]
+        + [f"first_any_migrant_excl_{name}_date" for name in migrant_component_flags]
+        + list(group_by)
+    )
+    table = read_columns(path, columns)
+    state.clear()
+    state.update({column: table.column(column) for column in columns})
+    state["groups"] = {"all": np.full(table.num_rows, None, dtype=object)}
+    for group in group_by:
+        state["groups"][group] = table.column(group).to_pandas().astype(object).fillna("missing").to_numpy()
+
+
+def variant_name(withdoe, end_date, drop):
+    return "_".join([
+        "withdoe" if withdoe else "nodoe",
+        f"end{end_date}",
+        f"drop-{drop}" if drop else "all",
+    ])
+
+
+def variant_flags(withdoe, end_date, drop):
+    """
+    {flag: boolean array} for a variant, from the first code dates.
+    """
+    end = days(np.array([end_date], dtype="datetime64[D]"))[0]
+    indicators = {name: days(state[f"first_{name}_date"]) <= end for name in flags}
+    if not withdoe:
+        indicators["date_of_uk_entry"] = np.zeros_like(indicators["date_of_uk_entry"])
+    if drop:
+        indicators[drop] = np.zeros_like(indicators[drop])
+        if drop in migrant_component_flags:
+            indicators["any_migrant"] = days(state[f"first_any_migrant_excl_{drop}_date"]) <= end
+    return indicators
+
+
+def mig_status(indicators, withdoe):
+    """
+    2-, 3- and 6-category migrant status (as migration_status_variables'
+    build_mig_status_* functions, the _withdoe versions if withdoe).
+    """
+    migrant = indicators["any_migrant"]
+    date_of_uk_entry = indicators["date_of_uk_entry"] if withdoe else np.zeros_like(migrant)
+    born_in_uk = indicators["born_in_uk"]
+    british_ethnicities = indicators["british_ethnicities"]
+    migrant_cond = migrant | date_of_uk_entry
+
+    status_2_cat = np.where(migrant_cond, "Migrant", "Non-migrant")
+    status_3_cat = np.select(
+        [migrant_cond, born_in_uk | (british_ethnicities & ~migrant_cond)],
+        ["Migrant", "Non-migrant"],
+        default="Unknown",
+    )
+    highly_likely = indicators["immig_status_excl_refugee_asylum"] | indicators["refugee_asylum_status"]
+    likely_migrant = (
+        indicators["english_not_main_language"] | indicators["interpreter_required"]
+        | indicators["trafficking"] | date_of_uk_entry
+    )
+    status_6_cat = np.select(
+        [
+            indicators["not_born_in_uk"],
+            born_in_uk,
+            highly_likely,
+            likely_migrant,
+            british_ethnicities & ~migrant,
+            ~migrant,
+        ],
+        [
+            "Definite migrant",
+            "Definite non-migrant",
+            "Highly likely migrant",
+            "Likely migrant",
+            "Likely non-migrant",
+            "Unknown",
+        ],
+        default="Error",
+    )
+    return {"2cat": status_2_cat, "3cat": status_3_cat, "6cat": status_6_cat}
+
+
+def evaluate(variant, output_dir):
+    """
+    Write the counts per category of each categorisation for one variant.
+    """
+    withdoe, end_date, drop = variant
+    statuses = mig_status(variant_flags(withdoe, end_date, drop), withdoe)
+
+    tables = []
+    for categorisation, status in statuses.items():
+        for group, values in state["groups"].items():
+            counts = (
+                pd.DataFrame({"group_value": values, "category": status})
+                .value_counts(dropna=False, sort=False)
+                .reset_index(name="n")
+            )
+            tables.append(counts.assign(categorisation=categorisation, group=group))
+
+    columns = ["categorisation", "group", "group_value", "category"]
+    table = pd.concat(tables, ignore_index=True)[columns + ["n"]]
+    table = table.sort_values(columns, ignore_index=True)
+    table["n"] = round_counts(table["n"])
+
+    path = Path(output_dir) / f"{variant_name(*variant)}.csv"
+    table.to_csv(path, index=False)
+    return path
+
+
+def variants(end_dates, drops, doe=(False, True)):
+    return list(itertools.product(doe, end_dates, [None] + list(drops)))
+
+
+def run_sweep(path, output_dir, end_dates, drops, group_by=(), jobs=None):
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    grid = variants(end_dates, drops)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=load_state, initargs=(path, group_by)) as executor:
+        return list(executor.map(evaluate, grid, itertools.repeat(output_dir)))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default=default_input)
+    parser.add_argument("--output-dir", default=default_output_dir)
+    parser.add_argument("--end-dates", nargs="+", default=[study_end_date])
+    parser.add_argument("--drop", nargs="*", default=droppable, choices=droppable,
+                        help="codelists to drop, one variant each (as well as dropping none)")
+    parser.add_argument("--group-by", nargs="*", default=["sex", "year_of_birth_band"])
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    paths = run_sweep(args.input, args.output_dir, args.end_dates, args.drop, args.group_by, args.jobs)
+    print(f"{len(paths)} variants written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+# #############################################################################
+# Run a dataset definition in patient_id-range shards, in parallel
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# This is a script to run `ehrql generate-dataset` as several smaller extractions
+# instead of one query over every patient, which fails late when memory runs
+# out. ehrQL can't restrict a dataset definition to a range of patient_ids, so
+# the shards are made from the input tables instead:
+#   1. the patient_ids in the patients table are split into --shards ranges of
+#      (about) equal size
+#   2. every table in the tables directory (CSV or arrow, as used by the local
+#      file engine with --dummy-tables) is split by those ranges, one batch at a
+#      time, into logs/sharded_extract/<output name>/shard_NNN/tables/
+#   3. each shard is extracted in a worker process, with the same definition and
+#      arguments, writing to shard_NNN/output.<ext>
+#   4. the shard outputs are merged in patient_id order into --output (arrow and
+#      parquet outputs batch by batch through cohort_writer.CohortWriter, in
+#      --memory-budget-mb)
+#
+# A shard that fails is retried (--retries times) without re-running the others,
+# and completed shards are recorded, so re-running the same command after a
+# failure only extracts the shards that didn't finish.
+#
+#     python analysis/sharded_extract.py --tables dummy_tables --shards 8 --jobs 4 -- \
+#         generate-dataset analysis/dataset_definition_full_study_cohort.py \
+#         --output output/cohorts/full_study_cohort.arrow
+#
+# Only single-file generate-dataset outputs can be merged by concatenation
+# (measures would need re-aggregating, and event tables are written to a
+# directory), so other commands are rejected.
+
+import csv
+import hashlib
+import json
+import shlex
+import shutil
+import subprocess
+import time
+from argparse import REMAINDER, ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from cohort_writer import CohortWriter, default_memory_budget
+from extraction_cache import option_value
+
+shards_dir = Path("logs/sharded_extract")
+
+
+def table_files(tables_dir):
+    return sorted(
+        path for path in Path(tables_dir).iterdir()
+        if path.suffix in (".csv", ".arrow") and not path.name.startswith(".")
+    )
+
+
+def csv_header(path):
+    with open(path, newline="") as f:
+        return next(csv.reader(f))
+
+
+def iter_table(path):
+    """
+    Yield record batches of a table file. CSV columns other than patient_id are
+    read as strings, so they're written back to the shards unchanged.
+    """
+    if path.suffix == ".arrow":
+        with pa.memory_map(str(path)) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+        return
+    column_types = {name: pa.string() for name in csv_header(path)}
+    column_types["patient_id"] = pa.int64()
+    convert_options = pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=False)
+    yield from pa_csv.open_csv(str(path), convert_options=convert_options)
+
+
+def patient_ranges(tables_dir, n_shards):
+    """
+    Boundaries splitting the patients table's patient_ids into n_shards ranges
+    of about equal size: shard i is boundaries[i] <= patient_id < boundaries[i + 1].
+    """
+    patients = next(path for path in table_files(tables_dir) if path.stem == "patients")
+    ids = np.unique(np.concatenate([
+        batch.column("patient_id").to_numpy(zero_copy_only=False) for batch in iter_table(patients)
+    ]))
+    if not len(ids):
+        raise ValueError(f"no patients in {patients}")
+    n_shards = min(n_shards, len(ids))
+    starts = ids[np.linspace(0, len(ids), n_shards, endpoint=False).astype("int64")]
+    return np.concatenate([starts, [ids[-1] + 1]])
+
+
+def split_tables(tables_dir, boundaries, output_dir):
+    """
+    Write each table's rows for each shard to output_dir/shard_NNN/tables/, in
+    the table's own format. Rows outside every range (patient_ids not in the
+    patients table) are dropped, as ehrQL would never select them.
+    """
+    n_shards = len(boundaries) - 1
+    shard_tables = [output_dir / f"shard_{i:03d}" / "tables" for i in range(n_shards)]
+    for path in shard_tables:
+        path.mkdir(parents=True, exist_ok=True)
+
+    for path in table_files(tables_dir):
+        writers = {}
+        try:
+            for batch in iter_table(path):
+                ids = batch.column("patient_id").to_numpy(zero_copy_only=False)
+                shard = np.searchsorted(boundaries, ids, side="right") - 1
+                for i in np.unique(shard):
+                    if i < 0 or i >= n_shards:
+                        continue
+                    rows = batch.filter(pa.array(shard == i))
+                    if i not in writers:
+                        target = shard_tables[i] / path.name
+                        if path.suffix == ".arrow":
+                            writers[i] = pa.ipc.new_file(str(target), batch.schema)
+                        else:
+                            writers[i] = pa_csv.CSVWriter(
+                                str(target), batch.schema,
+                                write_options=pa_csv.WriteOptions(quoting_style="needed"),
+                            )
+                    writers[i].write_batch(rows)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        # every shard needs every table, even if it has no rows in it
+        for i in range(n_shards):
+            target = shard_tables[i] / path.name
+            if not target.exists():
+                if path.suffix == ".arrow":
+                    schema = pa.ipc.open_file(pa.memory_map(str(path))).schema
+                    pa.ipc.new_file(str(target), schema).close()
+                else:
+                    target.write_text(",".join(csv_header(path)) + "\n")
+    return shard_tables
+
+
+def shard_command(ehrql_command, ehrql_args, tables, output):
+    """
+    The ehrql command for one shard: the same arguments, with the shard's tables
+    and output.
+    """
+    args = list(ehrql_args)
+    extra = []
+    if "--" in args:
+        position = args.index("--")
+        args, extra = args[:position], args[position:]
+    args[args.index("--output") + 1] = str(output)
+    return shlex.split(ehrql_command) + args + ["--dummy-tables", str(tables)] + extra
+
+
+def run_shard(name, command, log_path, retries):
+    """
+    Run one shard in a worker, retrying up to `retries` times. Returns the exit
+    code of the last attempt, the number of attempts and the time taken.
+    """
+    start = time.perf_counter()
+    for attempt in range(1, retries + 2):
+        with open(log_path, "a") as log:
+            log.write(f"# {name}, attempt {attempt}: {shlex.join(command)}\n")
+            log.flush()
+            returncode = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode
+        if returncode == 0:
+            break
+    return returncode, attempt, round(time.perf_counter() - start, 1)
+
+
+def merge_outputs(paths, output, memory_budget=default_memory_budget):
+    """
+    Concatenate the shard outputs in order into `output`, one batch at a time.
+    """
+    output = Path(output)
+    if output.suffix == ".csv":
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp = output.with_name(output.name + ".partial")
+        with open(tmp, "w", newline="") as merged:
+            for i, path in enumerate(paths):
+                with open(path, newline="") as f:
+                    header = f.readline()
+                    if i == 0:
+                        merged.write(header)
+                    shutil.copyfileobj(f, merged)
+        tmp.replace(output)
+        return
+
+    # categorical columns are dictionary-encoded with each shard's own
+    # dictionary, which the writer re-encodes against one dictionary per column
+    schema = pa.ipc.open_file(pa.memory_map(str(paths[0]))).schema
+    with CohortWriter(output, schema, memory_budget=memory_budget) as writer:
+        for path in paths:
+            for batch in iter_table(path):
+                writer.write(batch)
+
+
+def sharded_extract(ehrql_command, ehrql_args, tables_dir, n_shards, jobs, retries,
+                    memory_budget=default_memory_budget):
+    """
+    Split, extract and merge. Returns {shard: "done"/"ran"/"failed"}.
+    """
+    if not ehrql_args or ehrql_args[0] != "generate-dataset":
+        raise ValueError("only generate-dataset can be run in shards")
+    output = Path(option_value(ehrql_args, "--output"))
+    if output.suffix not in (".arrow", ".parquet", ".csv"):
+        raise ValueError(f"can't merge {output} (only single .arrow, .parquet or .csv outputs)")
+
+    output_dir = shards_dir / output.stem
+    output_dir.mkdir(parents=True, exist_ok=True)
+    boundaries = patient_ranges(tables_dir, n_shards)
+
+    # completed shards are only reused for the same command, tables and ranges
+    digest = hashlib.sha256(json.dumps([ehrql_command, ehrql_args, boundaries.tolist()]).encode())
+    for path in table_files(tables_dir):
+        digest.update(f"{path.name}:{path.stat().st_size}:{path.stat().st_mtime_ns}".encode())
+    key = digest.hexdigest()
+    state_path = output_dir / "state.json"
+    state = json.loads(state_path.read_text()) if state_path.exists() else {}
+    if state.get("key") != key:
+        shutil.rmtree(output_dir)
+        output_dir.mkdir(parents=True)
+        state = {"key": key, "done": []}
+        split_tables(tables_dir, boundaries, output_dir)
+
+    # shards extract to arrow for a parquet output, which is written when merging
+    shard_suffix = ".csv" if output.suffix == ".csv" else ".arrow"
+    shard_outputs = [output_dir / f"shard_{i:03d}" / f"output{shard_suffix}" for i in range(len(boundaries) - 1)]
+    status = {i: "done" for i in state["done"] if shard_outputs[i].exists()}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {}
+        for i, shard_output in enumerate(shard_outputs):
+            if i in status:
+                continue
+            name = f"shard {i} (patient_id {boundaries[i]} to {boundaries[i + 1] - 1})"
+            command = shard_command(ehrql_command, ehrql_args, shard_output.parent / "tables", shard_output)
+            log_path = shard_output.parent / "extract.log"
+            futures[pool.submit(run_shard, name, command, log_path, retries)] = (i, name, log_path)
+        for future, (i, name, log_path) in futures.items():
+            returncode, attempts, seconds = future.result()
+            if returncode == 0:
+                status[i] = "ran"
+                state["done"].append(i)
+                state_path.write_text(json.dumps(state))
+                print(f"{name}: ran in {seconds}s ({attempts} attempt{'s' if attempts > 1 else ''})")
+            else:
+                status[i] = "failed"
+                print(f"{name}: FAILED after {attempts} attempts (exit {returncode}), see {log_path}")
+
+    if all(value != "failed" for value in status.values()):
+        merge_outputs(shard_outputs, output, memory_budget)
+        print(f"merged {len(shard_outputs)} shards into {output}")
+    return status
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--tables", required=True, help="directory of tables for the local file engine")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=1, help="times to retry a failed shard")
+    parser.add_argument("--memory-budget-mb", type=int, default=default_memory_budget // 2**20,
+                        help="memory for the batches being merged")
+    parser.add_argument("--ehrql-command", default="python -m ehrql")
+    parser.add_argument("ehrql_args", nargs=REMAINDER, help="generate-dataset and its arguments")
+    args = parser.parse_args()
+
+    ehrql_args = args.ehrql_args
+    if ehrql_args[:1] == ["--"]:
+        ehrql_args = ehrql_args[1:]
+    status = sharded_extract(
+        args.ehrql_command, ehrql_args, args.tables, args.shards, args.jobs, args.retries,
+        args.memory_budget_mb * 2**20,
+    )
+    if "failed" in status.values():
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+## Functions for resolving registration and address histories on many dates at once
+## utilities.build_common_vars and the census cohort look up each patient's
+## practice (for region) and address (for IMD) with for_patient_on(date), which the
+## backend re-evaluates for every date. Offline, with the histories exported as
+## event tables, each history is sorted once into a per-patient timeline of
+## segments (split at every start date and the day after every end date), each
+## holding the row that for_patient_on would pick on any day in it. Lookups for
+## any vector of (patient, date) pairs are then one binary search:
+##     history = address_history(addresses_table)
+##     rows = as_of(history, patient_ids, dates)   # row index, -1 if none
+##
+## Rows are picked as ehrQL does: among the rows active on the date (start on or
+## before it, end on or after it or null), the last by the table's sort order
+## (addresses: has_postcode, start_date, end_date, address_id; registrations:
+## start_date, end_date), with null end dates sorting first. Overlapping spans are
+## resolved by that order, and inverted spans (end before start, which exist in
+## dummy_tables/addresses.csv) are never active, as in ehrQL.
+## Author: Yamina Boukari
+####
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def days(values):
+    """
+    Dates (a pyarrow array/column of dates, or numpy datetime64) as float day
+    numbers, with nulls as NaN.
+    """
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        return pc.cast(pc.cast(values, pa.int32()), pa.float64()).to_numpy(zero_copy_only=False)
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        day_numbers = values.astype("datetime64[D]").astype("int64").astype("float64")
+        return np.where(np.isnat(values), np.nan, day_numbers)
+    return values.astype("float64")
+
+
+def to_numpy(values):
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        return values.to_numpy(zero_copy_only=False)
+    return np.asarray(values)
+
+
+def sort_key(values):
+    """
+    A column as a float sort key, with nulls sorting first (as in ehrQL).
+    """
+    if isinstance(values, (pa.Array, pa.ChunkedArray)) and pa.types.is_date(values.type):
+        values = days(values)
+    elif isinstance(values, (pa.Array, pa.ChunkedArray)):
+        values = pc.cast(values, pa.float64()).to_numpy(zero_copy_only=False)
+    return np.nan_to_num(np.asarray(values, dtype="float64"), nan=-np.inf)
+
+
+def sort_history(patient_id, start_date, end_date, sort_by=None):
+    """
+    Sort a history once into per-patient segments. `sort_by` is the list of sort
+    keys (see sort_key) used to pick between active rows, most significant first,
+    as passed to sort_by() in ehrQL; by default start_date then end_date. Ties
+    are broken by row order.
+
+    Returns a dict of the segment boundaries and the row active in each segment
+    (-1 if none), for use with as_of.
+    """
+    patient_id = to_numpy(patient_id)
+    start = days(start_date)
+    end = days(end_date)
+    if sort_by is None:
+        sort_by = [sort_key(start), sort_key(end)]
+    patients, patient = np.unique(patient_id, return_inverse=True)
+
+    # rows that can ever be active: a start date, and not ending before it
+    valid = ~np.isnan(start) & ~(end < start)
+    rows = np.flatnonzero(valid)
+    patient, start, end = patient[valid], start[valid], end[valid]
+
+    # order rows by patient then by the sort keys (the last active row wins)
+    keys = [np.arange(len(rows))] + [np.asarray(key)[valid] for key in reversed(sort_by)]
+    order = np.lexsort(keys + [patient])
+    rows, patient, start, end = rows[order], patient[order], start[order], end[order]
+    active_until = np.nan_to_num(end, nan=np.inf)
+
+    # segment boundaries: every start and the day after every (non-null) end
+    boundary_patient = np.concatenate([patient, patient[~np.isnan(end)]])
+    boundary_day = np.concatenate([start, end[~np.isnan(end)] + 1])
+    boundaries = np.unique(np.stack([boundary_patient, boundary_day]), axis=1)
+    segment_patient = boundaries[0].astype("int64")
+    segment_start = boundaries[1]
+
+    # pair every segment with every row of the same patient (histories are
+    # short), and keep the last row by priority that's active in it
+    row_offset = np.searchsorted(patient, np.arange(len(patients)))
+    n_rows = np.bincount(patient, minlength=len(patients))
+    pairs_per_segment = n_rows[segment_patient]
+    pair_segment = np.repeat(np.arange(len(segment_start)), pairs_per_segment)
+    within = np.arange(pairs_per_segment.sum()) - np.repeat(np.cumsum(pairs_per_segment) - pairs_per_segment, pairs_per_segment)
+    pair_row = row_offset[segment_patient][pair_segment] + within
+    day = segment_start[pair_segment]
+    active = (start[pair_row] <= day) & (active_until[pair_row] >= day)
+
+    winner = np.full(len(segment_start), -1, dtype="int64")
+    np.maximum.at(winner, pair_segment[active], pair_row[active])
+
+    return {
+        "patients": patients,
+        "segment_patient": segment_patient,
+        "segment_start": segment_start,
+        "segment_row": np.where(winner >= 0, rows[winner], -1),
+    }
+
+
+def as_of(history, patient_id, dates):
+    """
+    For each (patient, date) pair, the index of the history row that's active on
+    the date (as picked by for_patient_on), or -1 if there isn't one.
+    """
+    patient_id = to_numpy(patient_id)
+    on = days(dates)
+    patients = history["patients"]
+    segment_patient, segment_start = history["segment_patient"], history["segment_start"]
+    rows = np.full(len(on), -1, dtype="int64")
+    if not len(segment_start):
+        return rows
+
+    patient = np.minimum(np.searchsorted(patients, patient_id), len(patients) - 1)
+    known = (patients[patient] == patient_id) & ~np.isnan(on)
+    patient, on = patient[known], on[known]
+
+    # one binary search on (patient, day), with days shifted so each patient's
+    # segments sort after the previous patient's (dates before a patient's first
+    # segment land on the previous patient, and are caught below)
+    first_day, last_day = segment_start.min(), segment_start.max()
+    scale = last_day - first_day + 2
+    segment_key = segment_patient * scale + (segment_start - first_day + 1)
+    query_key = patient * scale + (np.clip(on, first_day - 1, last_day) - first_day + 1)
+    segment = np.searchsorted(segment_key, query_key, side="right") - 1
+    in_patient = (segment >= 0) & (segment_patient[np.maximum(segment, 0)] == patient)
+
+    rows[np.flatnonzero(known)[in_patient]] = history["segment_row"][segment[in_patient]]
+    return rows
+
+
+def take(values, rows, missing=None):
+    """
+    values[rows] for a column of the history, with `missing` where rows is -1.
+    """
+    values = np.asarray(to_numpy(values), dtype=object)
+    picked = values[np.maximum(rows, 0)] if len(values) else np.full(len(rows), missing, dtype=object)
+    picked[rows < 0] = missing
+    return picked
+
+
+def registration_history(registrations):
+    """
+    Sort a practice registrations event table (patient_id, start_date, end_date)
+    as practice_registrations.for_patient_on does.
+    """
+    return sort_history(
+        registrations.column("patient_id"),
+        registrations.column("start_date"),
+        registrations.column("end_date"),
+    )
+
+
+def address_history(addresses):
+    """
+    Sort an addresses event table (patient_id, start_date, end_date,
+    has_postcode, address_id) as addresses.for_patient_on does, preferring
+    addresses with a postcode.
+    """
+    has_postcode = pc.fill_null(addresses.column("has_postcode"), False)
+    return sort_history(
+        addresses.column("patient_id"),
+        addresses.column("start_date"),
+        addresses.column("end_date"),
+        sort_by=[
+            sort_key(pc.cast(has_postcode, pa.int8())),
+            sort_key(addresses.column("start_date")),
+            sort_key(addresses.column("end_date")),
+            sort_key(addresses.column("address_id")),
+        ],
+    )
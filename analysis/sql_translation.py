@@ -0,0 +1,341 @@
+# #############################################################################
+# SQL translation of the migration definitions for a local database
+# - Author: Yamina Boukari
+# - Bennett Institute for Applied Data Science, University of Oxford, 2026
+#############################################################################
+
+# This is a script to see the query plan we want the backend to use for the
+# migration variables, by running hand-compiled SQL against a local SQLite or
+# DuckDB copy of the synthetic tables from generate_synthetic_tables.py.
+#
+# Every migrant flag in migration_status_variables is an `is_in(codelist)` over
+# clinical_events, with all_migrant_codes alone ~2,800 codes. Here the codelists
+# are materialised once as an indexed join table (codelist_codes: code ->
+# category_id, from codelist_index.build_codelist_index), so that every flag is
+# one join of clinical_events to it and one group by patient:
+#   - migrant_indicators: build_migrant_indicators
+#   - first_migrant_code_dates: build_first_migrant_code_dates
+#   - first_any_migrant_code_dates_excluding: build_first_any_migrant_code_dates_excluding
+#   - measures_denominators: population.interval_denominator for each year of
+#     the measures intervals (utilities.build_common_vars)
+# Patient-level queries return a row per patient in patients (flags False and
+# dates null without a code), so populations can be joined on.
+#
+# The SQL, its plan and the time taken are written for each query:
+#     python analysis/sql_translation.py --engine sqlite --tier 10k
+#     python analysis/sql_translation.py --engine duckdb --tier 1m --date 2021-03-21
+#
+# DuckDB is optional (pip install duckdb); SQLite is in the standard library.
+# analysis/testing/test_sql_translation.py checks the SQLite results against the
+# pandas reference implementation of the ehrQL definitions.
+
+import sqlite3
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import codelists
+from benchmark_actions import ensure_tables
+from codelist_index import build_codelist_index
+from cohort_reader import iter_batches, open_cohort
+from generate_synthetic_tables import schemas, tiers
+
+default_output_dir = "logs/sql_translation"
+study_end_date = "2025-12-31"
+
+# tables the translated definitions read, and the indexes they're joined on
+tables = ["patients", "ons_deaths", "practice_registrations", "clinical_events"]
+indexes = {
+    "patients": ["patient_id"],
+    "ons_deaths": ["patient_id"],
+    "practice_registrations": ["patient_id", "start_date", "end_date"],
+    # covering index, so flag events are read from the index alone
+    "clinical_events": ["snomedct_code", "patient_id", "date"],
+}
+
+# measures intervals: years(17).starting_on("2009-01-01")
+first_interval_year = 2009
+n_intervals = 17
+
+
+def sqlite_age(date_of_birth, date):
+    # whole years, as patients.age_on()
+    return (
+        f"(CAST(strftime('%Y', {date}) AS INTEGER) - CAST(strftime('%Y', {date_of_birth}) AS INTEGER)"
+        f" - (strftime('%m-%d', {date}) < strftime('%m-%d', {date_of_birth})))"
+    )
+
+
+dialects = {
+    "sqlite": {
+        "date": lambda value: f"'{value}'",
+        "age": sqlite_age,
+        "explain": "EXPLAIN QUERY PLAN ",
+    },
+    "duckdb": {
+        "date": lambda value: f"DATE '{value}'",
+        "age": lambda date_of_birth, date: f"date_sub('year', {date_of_birth}, {date})",
+        "explain": "EXPLAIN ",
+    },
+}
+
+
+# -------------------
+# Database
+# -------------------
+def connect(engine, path):
+    if engine == "duckdb":
+        import duckdb
+
+        return duckdb.connect(str(path))
+    return sqlite3.connect(str(path))
+
+
+def sqlite_type(arrow_type):
+    if pa.types.is_integer(arrow_type):
+        return "INTEGER"
+    return "TEXT"
+
+
+def load_table(connection, engine, name, path):
+    if engine == "duckdb":
+        connection.register("source", open_cohort(path))
+        connection.execute(f"CREATE TABLE {name} AS SELECT * FROM source")
+        connection.unregister("source")
+        return
+
+    # dates are stored as ISO strings, which compare in date order
+    schema = schemas[name]
+    columns = ", ".join(f"{field.name} {sqlite_type(field.type)}" for field in schema)
+    connection.execute(f"CREATE TABLE {name} ({columns})")
+    insert = f"INSERT INTO {name} VALUES ({', '.join('?' * len(schema))})"
+    for batch in iter_batches(path, schema.names):
+        columns = [
+            pc.cast(column, pa.string()) if pa.types.is_date(column.type) else column
+            for column in batch.columns
+        ]
+        connection.executemany(insert, zip(*[column.to_pylist() for column in columns]))
+
+
+def load_codelists(connection, index):
+    """
+    The migrant flag codelists as codelist_categories (category_id, name) and
+    codelist_codes (code, category_id), keyed on code.
+    """
+    connection.execute("CREATE TABLE codelist_categories (category_id INTEGER PRIMARY KEY, name TEXT)")
+    connection.executemany(
+        "INSERT INTO codelist_categories VALUES (?, ?)", list(enumerate(index["categories"]))
+    )
+    connection.execute(
+        "CREATE TABLE codelist_codes (code TEXT, category_id INTEGER, PRIMARY KEY (code, category_id))"
+    )
+    connection.executemany(
+        "INSERT INTO codelist_codes VALUES (?, ?)",
+        list(zip(index["codes"][index["rows"]].tolist(), index["cols"].tolist())),
+    )
+
+
+def build_database(engine, path, tables_dir, index):
+    """
+    Load the tables and codelists into a new database at path (built alongside
+    and moved into place, so an interrupted build is never reused).
+    """
+    tmp = path.with_name(path.name + ".partial")
+    tmp.unlink(missing_ok=True)
+    connection = connect(engine, tmp)
+    for name in tables:
+        load_table(connection, engine, name, Path(tables_dir) / f"{name}.arrow")
+    load_codelists(connection, index)
+    for name, columns in indexes.items():
+        connection.execute(f"CREATE INDEX {name}_{columns[0]} ON {name} ({', '.join(columns)})")
+    if engine == "sqlite":
+        connection.execute("ANALYZE")
+    connection.commit()
+    connection.close()
+    tmp.replace(path)
+
+
+# -------------------
+# Queries
+# -------------------
+def flag_events_sql(dialect, date):
+    """
+    Events with a code in any migrant flag codelist, recorded between birth and
+    date (and not after death), once per codelist the code is in
+    (migration_status_variables.migrant_flag_events).
+    """
+    return f"""flag_events AS (
+    SELECT e.patient_id, e.snomedct_code AS code, c.category_id, e.date
+    FROM clinical_events AS e
+    JOIN codelist_codes AS c ON c.code = e.snomedct_code
+    JOIN patients AS p ON p.patient_id = e.patient_id
+    WHERE e.date BETWEEN p.date_of_birth AND {dialect["date"](date)}
+        AND (e.date <= p.date_of_death OR p.date_of_death IS NULL)
+)"""
+
+
+def per_patient_sql(dialect, date, aggregates, columns):
+    """
+    One group by patient over the flag events, left joined to every patient.
+    """
+    aggregates = ",\n        ".join(f"{expression} AS {name}" for name, expression in aggregates.items())
+    columns = ",\n    ".join(f"{expression} AS {name}" for name, expression in columns.items())
+    return f"""WITH {flag_events_sql(dialect, date)},
+first_dates AS (
+    SELECT patient_id,
+        {aggregates}
+    FROM flag_events
+    GROUP BY patient_id
+)
+SELECT p.patient_id,
+    {columns}
+FROM patients AS p
+LEFT JOIN first_dates AS f ON f.patient_id = p.patient_id
+ORDER BY p.patient_id"""
+
+
+def first_date(category_id, condition=""):
+    return f"MIN(CASE WHEN category_id = {category_id}{condition} THEN date END)"
+
+
+def first_migrant_code_dates_sql(dialect, index, date):
+    aggregates = {
+        f"first_{name}_date": first_date(category_id)
+        for category_id, name in enumerate(index["categories"])
+    }
+    return per_patient_sql(dialect, date, aggregates, {name: f"f.{name}" for name in aggregates})
+
+
+def migrant_indicators_sql(dialect, index, date):
+    # a flag is whether there's a first date
+    aggregates = {
+        f"first_{name}_date": first_date(category_id)
+        for category_id, name in enumerate(index["categories"])
+    }
+    columns = {
+        name: f"f.first_{name}_date IS NOT NULL"
+        for name in index["categories"]
+    }
+    return per_patient_sql(dialect, date, aggregates, columns)
+
+
+def first_any_migrant_code_dates_excluding_sql(dialect, index, date):
+    any_migrant = index["categories"].index("any_migrant")
+    aggregates = {}
+    for name in codelists.migrant_component_flags:
+        # an any_migrant event whose code isn't also in the component's codelist
+        excluded = (
+            " AND NOT EXISTS (SELECT 1 FROM codelist_codes AS x"
+            f" WHERE x.code = flag_events.code AND x.category_id = {index['categories'].index(name)})"
+        )
+        aggregates[f"first_any_migrant_excl_{name}_date"] = first_date(any_migrant, excluded)
+    return per_patient_sql(dialect, date, aggregates, {name: f"f.{name}" for name in aggregates})
+
+
+def intervals():
+    starts = np.arange(first_interval_year, first_interval_year + n_intervals + 1)
+    dates = [np.datetime64(f"{year}-01-01") for year in starts]
+    return [(str(start), str(end - 1)) for start, end in zip(dates[:-1], dates[1:])]
+
+
+def measures_denominators_sql(dialect, index=None, date=None):
+    """
+    population.interval_denominator counted for each measures interval: alive
+    at the start, registered during the interval (was_registered_during, one
+    condition per case), a non-disclosive sex and a plausible age at the start.
+    """
+    literal = dialect["date"]
+    values = ",\n        ".join(f"({literal(start)}, {literal(end)})" for start, end in intervals())
+    age = dialect["age"]("p.date_of_birth", "i.interval_start")
+    return f"""WITH intervals (interval_start, interval_end) AS (
+    VALUES
+        {values}
+)
+SELECT i.interval_start, i.interval_end, COUNT(*) AS denominator
+FROM intervals AS i
+JOIN patients AS p
+    ON (p.date_of_death > i.interval_start OR p.date_of_death IS NULL)
+    AND p.sex IN ('male', 'female')
+    AND {age} < 110
+    AND {age} > 0
+WHERE EXISTS (
+    SELECT 1 FROM practice_registrations AS r
+    WHERE r.patient_id = p.patient_id
+        AND (
+            (r.start_date <= i.interval_start AND r.end_date >= i.interval_end)
+            OR (r.start_date > i.interval_start AND r.end_date >= i.interval_end)
+            OR (r.start_date <= i.interval_start AND r.end_date IS NULL)
+            OR (r.start_date > i.interval_start AND r.end_date IS NULL)
+            OR (r.start_date < i.interval_start
+                AND r.end_date > i.interval_start AND r.end_date < i.interval_end)
+            OR (r.start_date > i.interval_start AND r.start_date < i.interval_end
+                AND r.end_date > i.interval_start AND r.end_date < i.interval_end)
+        )
+)
+GROUP BY i.interval_start, i.interval_end
+ORDER BY i.interval_start"""
+
+
+queries = {
+    "migrant_indicators": migrant_indicators_sql,
+    "first_migrant_code_dates": first_migrant_code_dates_sql,
+    "first_any_migrant_code_dates_excluding": first_any_migrant_code_dates_excluding_sql,
+    "measures_denominators": measures_denominators_sql,
+}
+
+
+def query_plan(connection, engine, sql):
+    rows = connection.execute(dialects[engine]["explain"] + sql).fetchall()
+    if engine == "duckdb":
+        return "\n".join(row[-1] for row in rows)
+    return "\n".join(" " * 3 * (depth_of(rows, row)) + row[-1] for row in rows)
+
+
+def depth_of(rows, row):
+    # sqlite plan rows are (id, parent, notused, detail)
+    parents = {id_: parent for id_, parent, *_ in rows}
+    depth, parent = 0, row[1]
+    while parent in parents:
+        depth, parent = depth + 1, parents[parent]
+    return depth
+
+
+def run_queries(connection, engine, index, date, output_dir, names=queries):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        sql = queries[name](dialects[engine], index, date)
+        (output_dir / f"{name}.sql").write_text(sql + "\n")
+        (output_dir / f"{name}_plan.txt").write_text(query_plan(connection, engine, sql) + "\n")
+        start = time.perf_counter()
+        n_rows = len(connection.execute(sql).fetchall())
+        print(f"{name}: {n_rows} rows in {time.perf_counter() - start:.2f}s")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--engine", choices=dialects, default="sqlite")
+    parser.add_argument("--tier", choices=tiers, default="10k")
+    parser.add_argument("--date", default=study_end_date, help="date the migrant flags are as of")
+    parser.add_argument("--queries", nargs="+", choices=queries, default=list(queries))
+    parser.add_argument("--rebuild", action="store_true", help="reload the tables even if the database exists")
+    parser.add_argument("--output-dir", default=default_output_dir)
+    args = parser.parse_args()
+
+    index = build_codelist_index()
+    tables_dir = ensure_tables(args.tier)
+    path = tables_dir / f"migration.{args.engine}"
+    if args.rebuild or not path.exists():
+        build_database(args.engine, path, tables_dir, index)
+    connection = connect(args.engine, path)
+
+    output_dir = Path(args.output_dir) / args.engine
+    run_queries(connection, args.engine, index, args.date, output_dir, args.queries)
+    print(f"SQL and plans written to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
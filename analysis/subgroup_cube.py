@@ -0,0 +1,154 @@
+## Script to derive annual migrant counts for any combination of subgroups
+## The annual count measures define one measure per subgroup, each re-aggregating
+## the same patients. generate_annual_migrant_counts_cube.py instead counts each
+## categorisation once at the finest grain (status x age band x sex x ethnicity x
+## IMD quintile x region x year). Here that output is loaded into a dense array
+## per categorisation, and each marginal is a sum over the other axes, so
+## combinations we don't otherwise produce (e.g. age x sex) cost nothing extra.
+## The denominator of a marginal cell is its sum over every status.
+##
+## Disclosure control (disclosure.round_counts on numerators and denominators,
+## and ratios from the rounded counts) is applied after summing, as the cube
+## itself is unrounded and highly sensitive.
+##
+## Outputs, in the measures output format (one measure per status x marginal,
+## named as in the annual count measures, e.g. mig_status_6_cat_unknown_age_sex):
+##   - output/tables/annual_counts_cube/<categorisation>.csv
+## Author: Yamina Boukari
+####
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from disclosure import round_counts
+
+default_input = "output/tables/annual_counts_cube.arrow"
+default_output_dir = "output/tables/annual_counts_cube"
+
+subgroup_columns = ["age_band", "sex", "ethnicity", "imd_quintile", "region"]
+dimensions = ["status"] + subgroup_columns + ["interval_start"]
+
+# measure name suffixes for each subgroup (as in utilities.build_common_vars)
+suffixes = {
+    "age_band": "age",
+    "sex": "sex",
+    "ethnicity": "ethnicity",
+    "imd_quintile": "imd",
+    "region": "region",
+}
+
+# the per-subgroup measures we publish, plus age x sex
+default_marginals = [()] + [(column,) for column in subgroup_columns] + [("age_band", "sex")]
+
+
+def read_cube_output(path=default_input):
+    if Path(path).suffix == ".csv":
+        return pd.read_csv(path, dtype={column: "string" for column in subgroup_columns + ["status"]})
+    return feather.read_table(path).to_pandas()
+
+
+def build_cube(rows):
+    """
+    A dense counts array (one axis per dimension) and the labels along each
+    axis. Null group values (e.g. unknown IMD quintile) are kept as a label.
+    """
+    codes, labels = [], {}
+    for dimension in dimensions:
+        values = rows[dimension].astype(object).where(rows[dimension].notna(), None)
+        dimension_codes, dimension_labels = pd.factorize(values, use_na_sentinel=False, sort=True)
+        codes.append(dimension_codes)
+        labels[dimension] = list(dimension_labels)
+
+    shape = tuple(len(labels[dimension]) for dimension in dimensions)
+    cell = np.ravel_multi_index(tuple(codes), shape)
+    counts = np.bincount(cell, weights=rows["numerator"].to_numpy(dtype="float64"), minlength=int(np.prod(shape)))
+
+    interval_end = dict(zip(rows["interval_start"], rows["interval_end"]))
+    return {"counts": counts.reshape(shape), "labels": labels, "interval_end": interval_end}
+
+
+def marginal(cube, keep):
+    """
+    Counts by status x the subgroups in `keep` x year, summed over the others.
+    """
+    drop = tuple(dimensions.index(column) for column in subgroup_columns if column not in keep)
+    return cube["counts"].sum(axis=drop)
+
+
+def measure_name(var_name, status, keep):
+    safe_label = str(status).lower().replace(" ", "_").replace("-", "_")
+    name = f"{var_name}_{safe_label}"
+    if keep:
+        name += "_" + "_".join(suffixes[column] for column in keep)
+    return name
+
+
+def marginal_table(cube, var_name, keep):
+    """
+    A marginal in the measures output format, after disclosure control.
+    """
+    keep = [column for column in subgroup_columns if column in keep]
+    numerators = marginal(cube, keep)
+    denominators = numerators.sum(axis=0, keepdims=True)
+    numerators, denominators = np.broadcast_arrays(numerators, denominators)
+
+    axes = ["status"] + keep + ["interval_start"]
+    index = pd.MultiIndex.from_product([cube["labels"][axis] for axis in axes], names=axes)
+    table = pd.DataFrame({
+        "numerator": numerators.ravel(),
+        "denominator": denominators.ravel(),
+    }, index=index).reset_index()
+    table = table[table["denominator"] > 0]
+
+    table["numerator"] = round_counts(table["numerator"])
+    table["denominator"] = round_counts(table["denominator"])
+    table["ratio"] = table["numerator"] / table["denominator"]
+    table["measure"] = [measure_name(var_name, status, keep) for status in table["status"]]
+    table["interval_end"] = table["interval_start"].map(cube["interval_end"])
+    return table[["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator"] + keep]
+
+
+def cube_tables(rows, marginals=default_marginals):
+    """
+    {categorisation: measures-format table of every marginal} for each cube
+    measure in the output.
+    """
+    tables = {}
+    for measure, measure_rows in rows.groupby("measure", sort=True):
+        var_name = measure.removesuffix("_cube")
+        cube = build_cube(measure_rows)
+        tables[var_name] = pd.concat(
+            [marginal_table(cube, var_name, keep) for keep in marginals], ignore_index=True
+        )
+    return tables
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default=default_input)
+    parser.add_argument("--output-dir", default=default_output_dir)
+    parser.add_argument(
+        "--marginals", nargs="*", default=None,
+        help='subgroup combinations, comma-separated (e.g. "age_band,sex"); "all" for no subgroups',
+    )
+    args = parser.parse_args()
+
+    marginals = default_marginals
+    if args.marginals is not None:
+        marginals = [() if spec == "all" else tuple(spec.split(",")) for spec in args.marginals]
+        unknown = {column for keep in marginals for column in keep} - set(subgroup_columns)
+        if unknown:
+            parser.error(f"unknown subgroups: {', '.join(sorted(unknown))}")
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for var_name, table in cube_tables(read_cube_output(args.input), marginals).items():
+        table.to_csv(output_dir / f"{var_name}.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+## Script to estimate time from first practice registration to first migration code
+## Kaplan-Meier survival (and cumulative incidence, 1 - S) for the cohort from
+## scrapyard/dataset_definition_km_time_to_first_migration_code.py, which has
+##   - baseline_date: day before first practice registration
+##   - censor_date: earliest of death (TPP or ONS), deregistration and study end
+##   - processed_first_migration_code_date: first migration code (moved to first
+##     registration if it was before it)
+##
+## Curves are computed for everyone and for each level of each --strata column at
+## once: follow-up times are whole days, so events and censorings are counted
+## into a stratum x day array with one bincount (a counting sort) and risk sets
+## come from cumulative sums along each row, which takes seconds for tens of
+## millions of patients.
+##
+## For disclosure control, the cumulative event and censoring counts are rounded
+## with disclosure.roundmid_any before the risk sets and survival are derived from
+## them (as in the OpenSAFELY kaplan-meier-function reusable action).
+## Author: Yamina Boukari
+####
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from cohort_reader import read_columns
+from disclosure import roundmid_any
+
+default_input = "output/cohorts/km_time_to_first_migration_code.arrow"
+date_columns = ["baseline_date", "censor_date", "processed_first_migration_code_date"]
+never = np.iinfo("int64").max
+
+
+def days_since_epoch(column):
+    """
+    Dates as int64 day numbers, with nulls as the largest int64 (i.e. never).
+    """
+    days = pc.cast(pc.cast(column, pa.int32()), pa.int64())
+    return pc.fill_null(days, never).to_numpy(zero_copy_only=False)
+
+
+def follow_up(table):
+    """
+    (time in days from baseline, event indicator, valid) for each patient. A
+    patient has an event if their first migration code is on or before their
+    censor date; patients censored before baseline are not valid.
+    """
+    baseline = days_since_epoch(table.column("baseline_date"))
+    censor = days_since_epoch(table.column("censor_date"))
+    event_date = days_since_epoch(table.column("processed_first_migration_code_date"))
+
+    event = event_date <= censor
+    end = np.where(event, event_date, censor)
+    valid = (baseline != never) & (end != never) & (end >= baseline)
+    time = np.where(valid, end - baseline, 0)
+    return time, event, valid
+
+
+def stratified_counts(strata, n_strata, time, event, max_days):
+    """
+    (events, censored) arrays of shape (n_strata, max_days + 1): the number of
+    patients in each stratum with an event / censored on each day of follow-up.
+    Follow-up beyond max_days is censored at max_days.
+    """
+    event = event & (time <= max_days)
+    time = np.minimum(time, max_days)
+    key = strata * (max_days + 1) + time
+    size = n_strata * (max_days + 1)
+    events = np.bincount(key, weights=event, minlength=size).reshape(n_strata, -1)
+    removed = np.bincount(key, minlength=size).reshape(n_strata, -1)
+    return events.astype("int64"), (removed - events).astype("int64")
+
+
+def kaplan_meier(events, censored, rounding_to=6):
+    """
+    Kaplan-Meier estimates for each row (stratum) of the per-day counts, from
+    rounded cumulative counts. Returns a dict of (n_strata, n_days) arrays.
+    """
+    cumulative_events = roundmid_any(np.cumsum(events, axis=1), rounding_to)
+    cumulative_censored = roundmid_any(np.cumsum(censored, axis=1), rounding_to)
+    n_patients = roundmid_any(events.sum(axis=1) + censored.sum(axis=1), rounding_to)[:, None]
+
+    # removed before each day (so the risk set on day t includes those with time t)
+    removed_before = np.zeros_like(cumulative_events)
+    removed_before[:, 1:] = (cumulative_events + cumulative_censored)[:, :-1]
+    n_at_risk = np.maximum(n_patients - removed_before, 0)
+    # the counts are rounded separately, so in small strata the rounded events on
+    # a day can exceed the rounded risk set; cap them so the hazard is at most 1
+    n_events = np.minimum(np.diff(cumulative_events, axis=1, prepend=0), n_at_risk)
+    n_censored = np.diff(cumulative_censored, axis=1, prepend=0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hazard = np.where(n_at_risk > 0, n_events / n_at_risk, 0)
+        survival = np.cumprod(1 - hazard, axis=1)
+        # Greenwood variance of log survival, for a log-scale 95% CI
+        greenwood = np.cumsum(
+            np.where(n_at_risk > n_events, n_events / (n_at_risk * (n_at_risk - n_events)), 0),
+            axis=1,
+        )
+    se = np.sqrt(greenwood)
+
+    return {
+        "n_at_risk": n_at_risk,
+        "n_events": n_events,
+        "n_censored": n_censored,
+        "survival": survival,
+        "survival_lower": survival * np.exp(-1.96 * se),
+        "survival_upper": np.minimum(survival * np.exp(1.96 * se), 1),
+        "cumulative_incidence": 1 - survival,
+    }
+
+
+def curves_table(estimates, labels):
+    """
+    Long table of the estimates: day 0 and every day on which the (rounded)
+    counts change, for each stratum.
+    """
+    n_strata, n_days = estimates["n_at_risk"].shape
+    changes = (estimates["n_events"] > 0) | (estimates["n_censored"] > 0)
+    changes[:, 0] = True
+    stratum, time = np.nonzero(changes)
+    table = pd.DataFrame({
+        "group_value": np.asarray(labels, dtype=object)[stratum],
+        "time_days": time,
+    })
+    for name, values in estimates.items():
+        table[name] = values[stratum, time]
+    return table
+
+
+def survival_curves(path, strata_columns=(), max_days=365 * 20, rounding_to=6):
+    """
+    Curves for everyone (group "all") and by each strata column.
+    """
+    table = read_columns(path, date_columns + list(strata_columns))
+    time, event, valid = follow_up(table)
+    time, event = time[valid], event[valid]
+
+    groups = {"all": (np.zeros(len(time), dtype="int64"), ["all"])}
+    for column in strata_columns:
+        values = table.column(column).to_pandas()[valid]
+        codes, levels = pd.factorize(values, use_na_sentinel=False)
+        labels = ["missing" if pd.isna(level) else str(level) for level in levels]
+        groups[column] = (codes.astype("int64"), labels)
+
+    curves = []
+    for group, (strata, labels) in groups.items():
+        events, censored = stratified_counts(strata, len(labels), time, event, max_days)
+        curves.append(curves_table(kaplan_meier(events, censored, rounding_to), labels).assign(group=group))
+    curves = pd.concat(curves, ignore_index=True)
+    return curves[["group"] + [column for column in curves.columns if column != "group"]], int((~valid).sum())
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default=default_input)
+    parser.add_argument("--output", default="output/tables/time_to_first_migration_code_km.csv")
+    parser.add_argument("--strata", nargs="*", default=["sex", "year_of_birth_band"])
+    parser.add_argument("--max-days", type=int, default=365 * 20)
+    parser.add_argument("--rounding-to", type=int, default=6)
+    args = parser.parse_args()
+
+    curves, n_excluded = survival_curves(args.input, args.strata, args.max_days, args.rounding_to)
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    curves.to_csv(args.output, index=False)
+    print(f"{len(curves)} rows written to {args.output} ({n_excluded} patients with invalid follow-up excluded)")
+
+
+if __name__ == "__main__":
+    main()
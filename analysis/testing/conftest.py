@@ -0,0 +1,23 @@
+## pytest configuration for the tests in analysis/testing
+## The analysis scripts import each other as top-level modules and read codelists
+## and project.yaml relative to the repository root, as they do when run as
+## actions, so tests run from there with analysis/ on the path.
+## Author: Yamina Boukari
+####
+
+import sys
+from pathlib import Path
+
+import pytest
+
+repo_root = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(repo_root / "analysis"))
+
+# an ehrql assure test of the dataset definition, run by `ehrql assure`
+collect_ignore = ["test_full_study_cohort_definition.py"]
+
+
+@pytest.fixture(autouse=True)
+def in_repo_root(monkeypatch):
+    monkeypatch.chdir(repo_root)
+
@@ -0,0 +1,545 @@
+## Column-wise reference implementation of the full study cohort, census cohorts
+## and annual migrant count measures, written from the dataset definitions with
+## pandas/numpy operations over whole tables, so that any rewrite of those
+## definitions (or of migration_status_variables) can be checked against it on
+## thousands of patients in seconds (see test_equivalence.py).
+##
+## Nulls follow ehrql: comparisons with a null are never true, so a row/patient
+## is only selected when its condition is true, and sort_by puts nulls first.
+## Ties in sort_by (where ehrql may pick either row) are assumed not to happen;
+## test_equivalence.py drops patients with tied rows from the generated data.
+## Author: Yamina Boukari
+####
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+import codelists
+
+study_start_date = pd.Timestamp("2009-01-01")
+study_end_date = pd.Timestamp("2025-12-31")
+interval_years = range(2009, 2026)
+
+date_of_uk_entry_code = "860021000000109"
+
+table_names = ["patients", "practice_registrations", "clinical_events", "addresses", "ons_deaths"]
+date_columns = {
+    "patients": ["date_of_birth", "date_of_death"],
+    "practice_registrations": ["start_date", "end_date"],
+    "clinical_events": ["date"],
+    "addresses": ["start_date", "end_date"],
+    "ons_deaths": ["date"],
+}
+
+
+def read_tables(tables_dir):
+    """
+    The TPP-shaped CSV (or arrow) tables as DataFrames, with dates parsed (NaT
+    for null) and codes as strings.
+    """
+    tables = {}
+    for name in table_names:
+        path = tables_dir / f"{name}.csv"
+        if path.exists():
+            frame = pd.read_csv(path, dtype={"snomedct_code": str})
+        else:
+            frame = feather.read_table(tables_dir / f"{name}.arrow").to_pandas()
+            frame = frame.astype({column: object for column in frame.select_dtypes("category")})
+        for column in date_columns[name]:
+            frame[column] = pd.to_datetime(frame[column])
+        tables[name] = frame
+    return tables
+
+
+# date arithmetic (NaN where either date is null)
+
+
+def date_parts(values):
+    if isinstance(values, pd.Timestamp):
+        return values.year, values.month, values.day
+    return values.dt.year, values.dt.month, values.dt.day
+
+
+def years_between(start, end):
+    start_year, start_month, start_day = date_parts(start)
+    end_year, end_month, end_day = date_parts(end)
+    before_anniversary = (end_month * 100 + end_day) < (start_month * 100 + start_day)
+    return (end_year - start_year) - before_anniversary
+
+
+def months_between(start, end):
+    start_year, start_month, start_day = date_parts(start)
+    end_year, end_month, end_day = date_parts(end)
+    return (end_year - start_year) * 12 + (end_month - start_month) - (end_day < start_day)
+
+
+def days_between(start, end):
+    return (end - start).dt.days
+
+
+# categorisations
+
+
+def imd_quintile(imd_rounded):
+    bounds = [int(32844 * quintile / 5) for quintile in range(1, 5)]
+    labels = ["1 (most deprived)", "2", "3", "4", "5 (least deprived)"]
+    return imd_category(imd_rounded, bounds, labels)
+
+
+def imd_decile(imd_rounded):
+    bounds = [int(32844 * decile / 10) for decile in range(1, 10)]
+    labels = ["1 (most deprived)"] + [str(i) for i in range(2, 10)] + ["10 (least deprived)"]
+    return imd_category(imd_rounded, bounds, labels)
+
+
+def imd_category(imd_rounded, bounds, labels):
+    """
+    The label of the band each IMD falls in (below each bound, or up to 32844
+    for the last), None if null and "unknown" if out of range.
+    """
+    imd = imd_rounded.to_numpy(dtype="float64")
+    band = np.searchsorted(bounds, imd, side="right")
+    known = (imd >= 0) & (imd <= 32844)
+    category = np.where(known, np.asarray(labels, dtype=object)[np.minimum(band, len(labels) - 1)], "unknown")
+    return pd.Series(np.where(np.isnan(imd), None, category), index=imd_rounded.index, dtype=object)
+
+
+def band(values, edges, labels, otherwise):
+    """
+    The label of the band (below each edge, or the last band) each value is in,
+    `otherwise` for nulls.
+    """
+    numbers = values.to_numpy(dtype="float64")
+    category = np.asarray(labels, dtype=object)[np.searchsorted(edges, numbers, side="right")]
+    return pd.Series(np.where(np.isnan(numbers), otherwise, category), index=values.index, dtype=object)
+
+
+def age_band(age):
+    return band(age, [16, 25, 35, 50, 65, 75, 85],
+                ["0-15", "16-24", "25-34", "35-49", "50-64", "65-74", "75-84", "85 plus"], "missing")
+
+
+def year_of_birth_band(year):
+    labels = [None, "1898-1925", "1926-1945", "1946-1965", "1966-1985", "1986-2005", "2006-2025", None]
+    return band(year, [1898, 1926, 1946, 1966, 1986, 2006, 2026], labels, None)
+
+
+def as_dates(values):
+    """
+    Datetimes as date objects (None for NaT), as read from ehrql's output.
+    """
+    return pd.Series(
+        np.where(values.isna(), None, values.dt.date.astype(object)), index=values.index, dtype=object
+    )
+
+
+class Reference:
+    """
+    Per-patient columns evaluated over all patients at once. Every method
+    returns a Series indexed by patient_id (in patient order).
+    """
+
+    def __init__(self, tables):
+        self.patients = tables["patients"].set_index("patient_id").sort_index()
+        self.index = self.patients.index
+        self.date_of_birth = self.patients["date_of_birth"]
+        self.date_of_death = self.patients["date_of_death"]
+        self.sex = self.patients["sex"]
+        self.ons_death = (
+            tables["ons_deaths"].drop_duplicates("patient_id", keep="last")
+            .set_index("patient_id")["date"].reindex(self.index)
+        )
+        self.registrations = tables["practice_registrations"]
+        self.addresses = tables["addresses"]
+        # events with each patient's date of birth and death alongside
+        self.events = tables["clinical_events"].merge(
+            self.patients[["date_of_birth", "date_of_death"]], left_on="patient_id", right_index=True
+        )
+        self.codelist_sets = {}
+        self.first_flag_dates = None
+        self.interval_states = {}
+
+    def codes(self, codelist_name):
+        if codelist_name not in self.codelist_sets:
+            self.codelist_sets[codelist_name] = frozenset(getattr(codelists, codelist_name))
+        return self.codelist_sets[codelist_name]
+
+    def per_patient(self, values, fill=None):
+        values = values.reindex(self.index)
+        return values if fill is None else values.fillna(fill)
+
+    def age_on(self, on):
+        return years_between(self.date_of_birth, on)
+
+    def is_alive_on(self, on):
+        # patients.is_alive_on: born by the date and not died on or before it
+        return (self.date_of_birth <= on) & ((self.date_of_death > on) | self.date_of_death.isna())
+
+    # clinical events
+
+    def coded_events(self, codes, up_to=None):
+        """
+        Events with a code in `codes` on or after birth, on or before `up_to`
+        and not after death (as in build_migrant_indicators).
+        """
+        events = self.events[self.events["snomedct_code"].isin(codes)]
+        date = events["date"]
+        keep = (date >= events["date_of_birth"]) & ((date <= events["date_of_death"]) | events["date_of_death"].isna())
+        if up_to is not None:
+            keep &= date <= up_to
+        return events[keep]
+
+    def first_date(self, codes, up_to=None):
+        return self.per_patient(self.coded_events(codes, up_to).groupby("patient_id")["date"].min())
+
+    def count(self, codes, up_to):
+        return self.per_patient(self.coded_events(codes, up_to).groupby("patient_id").size(), fill=0).astype(int)
+
+    def latest_ethnicity_code(self, on_or_before=None):
+        events = self.events[self.events["snomedct_code"].isin(self.codes("ethnicity_codelist"))]
+        if on_or_before is not None:
+            events = events[events["date"] <= on_or_before]
+        return self.per_patient(last_by(events, ["date"])["snomedct_code"])
+
+    def ethnicity_group(self, code, level):
+        groups = {value: categories[level] for value, categories in codelists.ethnicity_codelist.items()}
+        return code.map(groups)
+
+    # registrations and addresses
+
+    def first_registration_start(self):
+        # sort_by(start_date).first_for_patient(): a null start date sorts first
+        starts = self.registrations.groupby("patient_id")["start_date"]
+        first = starts.min().where(~starts.apply(lambda values: values.isna().any()))
+        return self.per_patient(first)
+
+    def latest_registration_end(self):
+        return self.per_patient(self.registrations.groupby("patient_id")["end_date"].max())
+
+    def registration_on(self, on):
+        return self.per_patient(for_patient_on(self.registrations, on, ["start_date", "end_date"]))
+
+    def address_on(self, on):
+        return self.per_patient(for_patient_on(self.addresses, on, ["start_date", "end_date", "address_id"]))
+
+    def registered_during(self, start, end):
+        s, e = self.registrations["start_date"], self.registrations["end_date"]
+        registered = (
+            ((s <= start) & (e >= end))
+            | ((s > start) & (e >= end))
+            | ((s <= start) & e.isna())
+            | ((s > start) & e.isna())
+            | ((s < start) & (e > start) & (e < end))
+            | ((s > start) & (s < end) & (e > start) & (e < end))
+        )
+        return self.index.isin(self.registrations.loc[registered, "patient_id"])
+
+    # migration status
+
+    def migrant_indicators(self, up_to):
+        # a patient has a code up to a date if their first code is on or before it
+        if self.first_flag_dates is None:
+            self.first_flag_dates = pd.DataFrame({
+                name: self.first_date(self.codes(codelist_name))
+                for name, codelist_name in codelists.migrant_flag_codelists.items()
+            }, index=self.index)
+        return self.first_flag_dates <= up_to
+
+
+def last_by(rows, keys):
+    """
+    Each patient's last row after sorting by keys (nulls first), indexed by
+    patient_id.
+    """
+    rows = rows.sort_values(keys, na_position="first", kind="stable")
+    return rows.drop_duplicates("patient_id", keep="last").set_index("patient_id")
+
+
+def for_patient_on(rows, on, keys):
+    """
+    for_patient_on(on): of the rows starting on or before `on` and not ending
+    before it, the last by keys.
+    """
+    spanning = rows[(rows["start_date"] <= on) & ~(rows["end_date"] < on)]
+    return last_by(spanning, keys)
+
+
+def mig_status_2_cat(flags, withdoe=False):
+    migrant = flags["any_migrant"] | (withdoe & flags["date_of_uk_entry"])
+    return pd.Series(np.where(migrant, "Migrant", "Non-migrant"), index=flags.index, dtype=object)
+
+
+def mig_status_3_cat(flags, withdoe=False):
+    migrant = flags["any_migrant"] | (withdoe & flags["date_of_uk_entry"])
+    status = np.select(
+        [migrant, flags["born_in_uk"] | flags["british_ethnicities"]],
+        ["Migrant", "Non-migrant"],
+        default="Unknown",
+    )
+    return pd.Series(status, index=flags.index, dtype=object)
+
+
+def mig_status_6_cat(flags, withdoe=False):
+    status = np.select(
+        [
+            flags["not_born_in_uk"],
+            flags["born_in_uk"],
+            flags["immig_status_excl_refugee_asylum"] | flags["refugee_asylum_status"],
+            flags["english_not_main_language"] | flags["interpreter_required"] | flags["trafficking"]
+            | (withdoe & flags["date_of_uk_entry"]),
+            flags["british_ethnicities"] & ~flags["any_migrant"],
+            ~flags["any_migrant"],
+        ],
+        ["Definite migrant", "Definite non-migrant", "Highly likely migrant", "Likely migrant",
+         "Likely non-migrant", "Unknown"],
+        default="Error",
+    )
+    return pd.Series(status, index=flags.index, dtype=object)
+
+
+def mig_statuses(flags):
+    return {
+        "mig_status_2_cat": mig_status_2_cat(flags),
+        "mig_status_2_cat_withdoe": mig_status_2_cat(flags, withdoe=True),
+        "mig_status_3_cat": mig_status_3_cat(flags),
+        "mig_status_3_cat_withdoe": mig_status_3_cat(flags, withdoe=True),
+        "mig_status_6_cat": mig_status_6_cat(flags),
+        "mig_status_6_cat_withdoe": mig_status_6_cat(flags, withdoe=True),
+    }
+
+
+# full study cohort
+
+
+def in_full_cohort(reference):
+    first_reg = reference.first_registration_start()
+    latest_end = reference.latest_registration_end()
+    dob, dod, ons = reference.date_of_birth, reference.date_of_death, reference.ons_death
+    registered = (
+        ((first_reg >= study_start_date) & (first_reg <= study_end_date))
+        | ((latest_end >= study_start_date) & (latest_end <= study_end_date))
+        | ((first_reg <= study_start_date) & ((latest_end >= study_end_date) | latest_end.isna()))
+    )
+    first_reg_between_birth_and_death = (
+        ((first_reg >= dob) & (first_reg <= dod))
+        | ((first_reg >= dob) & dod.isna())
+    )
+    did_not_die_before_study_start = (
+        ((dod > study_start_date) | dod.isna())
+        & ((ons > study_start_date) | ons.isna())
+    )
+    plausible_age = (reference.age_on(study_start_date) <= 110) & (reference.age_on(study_end_date) >= 0)
+    return (
+        registered & first_reg_between_birth_and_death & reference.sex.isin(["male", "female"])
+        & did_not_die_before_study_start & plausible_age
+    )
+
+
+specific_first_code_columns = {
+    "cob": "cob_migrant_codes",
+    "immig_status_excl_refugee": "immigra_status_excl_ref_and_asylum_codes",
+    "refugee": "asylum_refugee_migrant_codes",
+    "language": "english_not_main_language_excl_interpreter_migrant_codes",
+    "interpreter": "interpreter_migrant_codes",
+    "trafficking": "trafficking_codes",
+    "uk_cob": "uk_cob_codes",
+}
+
+
+def full_cohort(reference):
+    """
+    The full study cohort as a DataFrame (patient_id and one column per variable).
+    """
+    migrant_codes = reference.codes("all_migrant_codes")
+    migrant_codes_withdoe = migrant_codes | {date_of_uk_entry_code}
+    entry_codes = frozenset({date_of_uk_entry_code})
+    dob = reference.date_of_birth
+
+    first_reg = reference.first_registration_start()
+    year_of_birth = dob.dt.year
+    latest_ethnicity = reference.latest_ethnicity_code(study_end_date)
+    last_registration = reference.per_patient(last_by(reference.registrations, ["start_date"])["practice_nuts1_region_name"])
+    imd_rounded = reference.per_patient(last_by(reference.addresses, ["start_date"])["imd_rounded"])
+
+    flags = reference.migrant_indicators(study_end_date)
+    n_migration_codes = reference.count(migrant_codes, study_end_date)
+    n_entry_codes = reference.count(entry_codes, study_end_date)
+    first_entry = reference.first_date(entry_codes, study_end_date)
+    first_migration = reference.first_date(migrant_codes, study_end_date)
+    first_migration_withdoe = reference.first_date(migrant_codes_withdoe, study_end_date)
+
+    temporality = np.select(
+        [first_entry.isna(), first_reg.isna(), first_entry < first_reg],
+        ["No date of entry code", None, "Before first practice registration"],
+        default="On or after first practice registration",
+    )
+
+    columns = {
+        "year_of_birth": year_of_birth,
+        "year_of_birth_band": year_of_birth_band(year_of_birth),
+        "date_of_birth": as_dates(dob),
+        "sex": reference.sex,
+        "latest_ethnicity_code": latest_ethnicity,
+        "latest_ethnicity_16_level_group": reference.ethnicity_group(latest_ethnicity, 1),
+        "latest_ethnicity_6_level_group": reference.ethnicity_group(latest_ethnicity, 0),
+        "region": last_registration,
+        "imd_decile": imd_decile(imd_rounded),
+        "imd_quintile": imd_quintile(imd_rounded),
+        "date_of_first_practice_registration": as_dates(first_reg),
+        "date_of_death": as_dates(reference.date_of_death),
+        **flags,
+        **mig_statuses(flags),
+        "number_of_migration_codes": n_migration_codes,
+        "number_of_migration_codes_withdoe": reference.count(migrant_codes_withdoe, study_end_date),
+        "has_date_of_uk_entry": n_entry_codes > 0,
+        "number_of_date_of_uk_entry_codes": n_entry_codes,
+        "date_of_earliest_date_of_uk_entry_code": as_dates(first_entry),
+        "temporality_of_date_of_uk_entry_code": pd.Series(temporality, index=reference.index, dtype=object),
+        "date_of_entry_and_other_migration_code": ((n_entry_codes > 0) & (n_migration_codes > 0)).map(str),
+        "date_of_first_migration_code": as_dates(first_migration),
+        "date_of_first_migration_code_withdoe": as_dates(first_migration_withdoe),
+    }
+
+    for suffix, first_date in [("", first_migration), ("_withdoe", first_migration_withdoe)]:
+        columns[f"time_from_1st_pracreg_first_migration_code_days{suffix}"] = days_between(first_reg, first_date)
+        columns[f"time_from_1st_pracreg_first_migration_code_months{suffix}"] = months_between(first_reg, first_date)
+        columns[f"time_from_birth_first_migration_code_days{suffix}"] = days_between(dob, first_date)
+        columns[f"time_from_birth_first_migration_code_months{suffix}"] = months_between(dob, first_date)
+
+    for name, codelist_name in specific_first_code_columns.items():
+        first_date = reference.first_date(reference.codes(codelist_name), study_end_date)
+        columns[f"time_from_1st_pracreg_first_{name}_code_days"] = days_between(first_reg, first_date)
+        columns[f"time_from_1st_pracreg_first_{name}_code_months"] = months_between(first_reg, first_date)
+
+    cohort = pd.DataFrame(columns, index=reference.index)
+    return cohort[in_full_cohort(reference)].reset_index()
+
+
+# census cohorts
+
+
+def in_census_cohort(reference, census_date):
+    age = reference.age_on(census_date)
+    return (
+        reference.registration_on(census_date)["start_date"].notna()
+        & reference.sex.isin(["male", "female"])
+        & (age < 110) & (age > 0)
+        & reference.is_alive_on(census_date)
+    )
+
+
+def census_cohort(reference, census_date):
+    census_date = pd.Timestamp(census_date)
+    imd_rounded = reference.address_on(census_date)["imd_rounded"]
+    latest_ethnicity = reference.latest_ethnicity_code()
+    flags = reference.migrant_indicators(census_date)
+    cohort = pd.DataFrame({
+        "age_band": age_band(reference.age_on(census_date)),
+        "sex": reference.sex,
+        "region": reference.registration_on(census_date)["practice_nuts1_region_name"],
+        "imd_decile": imd_decile(imd_rounded),
+        "imd_quintile": imd_quintile(imd_rounded),
+        "latest_ethnicity_code": latest_ethnicity,
+        "latest_ethnicity_16_level_group": reference.ethnicity_group(latest_ethnicity, 1),
+        "latest_ethnicity_6_level_group": reference.ethnicity_group(latest_ethnicity, 0),
+        **flags,
+        **mig_statuses(flags),
+    }, index=reference.index)
+    return cohort[in_census_cohort(reference, census_date)].reset_index()
+
+
+# annual measures (utilities.build_common_vars and the generate_annual_migrant_counts_* scripts)
+
+
+def interval_state(reference, year):
+    """
+    Denominator, subgroups and migrant indicators for one annual interval, for
+    the patients in the denominator.
+    """
+    if year not in reference.interval_states:
+        reference.interval_states[year] = build_interval_state(reference, year)
+    return reference.interval_states[year]
+
+
+def build_interval_state(reference, year):
+    start, end = pd.Timestamp(year, 1, 1), pd.Timestamp(year, 12, 31)
+    age = reference.age_on(start)
+    denominator = (
+        reference.is_alive_on(start)
+        & reference.registered_during(start, end)
+        & reference.sex.isin(["male", "female"])
+        & (age < 110) & (age > 0)
+    )
+    ethnicity = reference.ethnicity_group(reference.latest_ethnicity_code(end), 0)
+    region = reference.registration_on(start)["practice_nuts1_region_name"]
+    groups = pd.DataFrame({
+        "age_band": age_band(age),
+        "sex": reference.sex,
+        "ethnicity": ethnicity.fillna("unknown"),
+        "imd_quintile": imd_quintile(reference.address_on(start)["imd_rounded"]),
+        "region": region.fillna("unknown"),
+    }, index=reference.index)
+    return {
+        "interval_start": start.date(),
+        "groups": groups[denominator],
+        "flags": reference.migrant_indicators(end)[denominator],
+    }
+
+
+status_measures = {
+    "generate_annual_migrant_counts_2cat": ("mig_status_2_cat", mig_status_2_cat, False, ["Migrant", "Non-migrant"]),
+    "generate_annual_migrant_counts_2cat_withdoe": ("mig_status_2_cat", mig_status_2_cat, True, ["Migrant", "Non-migrant"]),
+    "generate_annual_migrant_counts_3cat": ("mig_status_3_cat", mig_status_3_cat, False, ["Migrant", "Non-migrant", "Unknown"]),
+    "generate_annual_migrant_counts_3cat_withdoe": ("mig_status_3_cat", mig_status_3_cat, True, ["Migrant", "Non-migrant", "Unknown"]),
+    "generate_annual_migrant_counts_6cat": ("mig_status_6_cat", mig_status_6_cat, False, [
+        "Definite migrant", "Highly likely migrant", "Likely migrant",
+        "Definite non-migrant", "Likely non-migrant", "Unknown"]),
+    "generate_annual_migrant_counts_6cat_withdoe": ("mig_status_6_cat", mig_status_6_cat, True, [
+        "Definite migrant", "Highly likely migrant", "Likely migrant",
+        "Definite non-migrant", "Likely non-migrant", "Unknown"]),
+}
+
+# measure name suffix and group column of each subgroup (utilities.build_common_vars)
+subgroups = {
+    "": None,
+    "age": "age_band",
+    "sex": "sex",
+    "ethnicity": "ethnicity",
+    "imd": "imd_quintile",
+    "region": "region",
+}
+
+
+def measure_numerators(action, flags):
+    """
+    {measure name stem: boolean numerator Series} for one interval.
+    """
+    if action == "generate_annual_migrant_counts_migration_status_types":
+        return {f"migration_status_types_{name}": flags[name] for name in flags.columns}
+    var_name, build, withdoe, labels = status_measures[action]
+    status = build(flags, withdoe=withdoe)
+    return {
+        f"{var_name}_{label.lower().replace(' ', '_').replace('-', '_')}": status == label
+        for label in labels
+    }
+
+
+def annual_measures(reference, action):
+    """
+    {(measure, interval_start, group column, group value): [numerator, denominator]}
+    """
+    totals = {}
+    for year in interval_years:
+        state = interval_state(reference, year)
+        for stem, numerator in measure_numerators(action, state["flags"]).items():
+            for suffix, column in subgroups.items():
+                name = f"{stem}_{suffix}" if suffix else stem
+                if column is None:
+                    totals[(name, state["interval_start"], None, None)] = [int(numerator.sum()), len(numerator)]
+                    continue
+                counts = numerator.astype(int).groupby(state["groups"][column], dropna=False).agg(["sum", "size"])
+                for value, (numerator_total, denominator_total) in counts.iterrows():
+                    value = None if pd.isna(value) else value
+                    totals[(name, state["interval_start"], column, value)] = [int(numerator_total), int(denominator_total)]
+    return totals
@@ -0,0 +1,21 @@
+import numpy as np
+
+import age_bands
+
+
+def test_lookup_matches_age_on():
+    lookup = age_bands.age_band_lookup(["2010-01-01", "2020-06-15"])
+    # 16 in June 2020 if born in June 2004 (on the 1st of the month), 15 if born in July
+    date_of_birth = np.array(["2004-06-01", "2004-07-01", "1935-06-01", "NaT"], dtype="datetime64[D]")
+    bands = age_bands.age_bands(lookup, date_of_birth, np.array([1, 1, 1, 0]))
+    assert list(bands) == ["16-24", "0-15", "85 plus", age_bands.missing_label]
+
+
+def test_dates_of_birth_outside_the_lookup_get_the_edge_bands():
+    # as band_expression: a negative age is below the first edge, and anyone
+    # born before the lookup's first birth month is past the last
+    lookup = age_bands.age_band_lookup(["2010-01-01", "2020-01-01"])
+    date_of_birth = np.array(["2025-03-01", "2030-01-01", "1885-01-01", "1700-12-01"], dtype="datetime64[D]")
+    for date_index in (0, 1):
+        bands = age_bands.age_bands(lookup, date_of_birth, np.full(len(date_of_birth), date_index))
+        assert list(bands) == ["0-15", "0-15", "85 plus", "85 plus"]
@@ -0,0 +1,25 @@
+import pyarrow as pa
+
+import benchmark_actions
+
+
+def write_arrow(path, num_rows):
+    table = pa.table({"patient_id": list(range(num_rows))})
+    with pa.ipc.new_file(str(path), table.schema) as writer:
+        writer.write_table(table)
+
+
+def test_actions_keep_their_output_shape():
+    actions = benchmark_actions.ehrql_actions()
+    # event-level datasets need a directory output
+    output = actions["generate_cumulative_coding_cohort"][3]
+    assert benchmark_actions.scratch_output("cohort", output) == benchmark_actions.scratch_dir / "cohort" / ":arrow"
+    output = actions["generate_full_study_cohort"][3]
+    assert benchmark_actions.scratch_output("cohort", output) == benchmark_actions.scratch_dir / "cohort.arrow"
+
+
+def test_directory_output_rows_are_summed(tmp_path):
+    write_arrow(tmp_path / "dataset.arrow", 3)
+    write_arrow(tmp_path / "events.arrow", 5)
+    (tmp_path / "notes.txt").write_text("not a table\n")
+    assert benchmark_actions.count_output_rows(tmp_path / ":arrow") == 8
@@ -0,0 +1,11 @@
+from datetime import date
+
+import pyarrow as pa
+
+from calendar_years import max_year, min_year, year_index, year_labels
+
+
+def test_year_index_buckets():
+    values = pa.array([date(2009, 6, 1), date(1850, 1, 1), date(2031, 1, 1), None])
+    index = year_index(values)
+    assert [year_labels[i] for i in index] == ["2009", str(min_year), str(max_year), "Unknown"]
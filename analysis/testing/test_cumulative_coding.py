@@ -0,0 +1,35 @@
+import numpy as np
+
+from cumulative_coding import merge_spells, month_counts
+
+
+def covered_months(start, stop):
+    return set().union(*[range(s, e) for s, e in zip(start, stop)])
+
+
+def test_merge_spells_keeps_the_covered_months():
+    rng = np.random.default_rng(42)
+    n = 3000
+    patient = rng.integers(0, 300, n)
+    start = rng.integers(0, 200, n)
+    stop = start + rng.integers(-3, 40, n)
+
+    merged_patient, merged_start, merged_stop = merge_spells(patient, start, stop)
+    for p in np.unique(patient):
+        mine = merged_patient == p
+        assert covered_months(merged_start[mine], merged_stop[mine]) == covered_months(start[patient == p], stop[patient == p])
+        # merged spells are sorted, and neither overlap nor touch
+        assert np.all(merged_start[mine][1:] > merged_stop[mine][:-1])
+
+    # so counting spells per month counts registered patients
+    n_months = 250
+    expected = np.zeros(n_months, dtype="int64")
+    for p in np.unique(patient):
+        for month in covered_months(start[patient == p], stop[patient == p]):
+            expected[month] += 1
+    assert np.array_equal(month_counts(merged_start, merged_stop, n_months), expected)
+
+
+def test_merge_spells_without_spells():
+    patient, start, stop = merge_spells(np.array([1]), np.array([5]), np.array([5]))
+    assert len(patient) == len(start) == len(stop) == 0
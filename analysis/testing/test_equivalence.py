@@ -0,0 +1,179 @@
+## Equivalence test of the dataset and measures definitions against the column-wise
+## reference implementation (reference_implementation.py), on thousands of randomised
+## patient histories from generate_synthetic_tables.py.
+##
+## Run this before deploying any rewrite of migration_status_variables, the cohort
+## definitions or the annual count measures, e.g.
+##     python -m pytest analysis/testing/test_equivalence.py
+## Every output column (and measure) must match. It needs ehrql installed.
+## Author: Yamina Boukari
+####
+
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pytest
+
+import codelists
+import reference_implementation as reference
+from benchmark_actions import ehrql_actions
+from generate_synthetic_tables import generate_tables
+
+pytest.importorskip("ehrql")
+
+n_patients = 2000
+seed = 2026
+
+dataset_actions = {
+    "generate_full_study_cohort": None,
+    "generate_dataset_for_census_2011": "2011-03-27",
+    "generate_dataset_for_census_2021": "2021-03-21",
+}
+measures_actions = [
+    "generate_annual_migrant_counts_2cat",
+    "generate_annual_migrant_counts_3cat",
+    "generate_annual_migrant_counts_6cat",
+    "generate_annual_migrant_counts_2cat_withdoe",
+    "generate_annual_migrant_counts_3cat_withdoe",
+    "generate_annual_migrant_counts_6cat_withdoe",
+    "generate_annual_migrant_counts_migration_status_types",
+]
+group_columns = ["age_band", "sex", "ethnicity", "imd_quintile", "region"]
+
+
+def read_table(path):
+    return pa_csv.read_csv(path).to_pandas(date_as_object=True)
+
+
+def drop_tied_patients(tables_dir):
+    """
+    Remove patients for whom ehrql's choice of "latest" row is ambiguous (two
+    addresses, registrations or ethnicity codes on the same date).
+    """
+    tables = {name: read_table(tables_dir / f"{name}.csv") for name in reference.table_names + ["appointments"]}
+    ethnicity = tables["clinical_events"][
+        tables["clinical_events"]["snomedct_code"].astype(str).isin(set(codelists.ethnicity_codelist))
+    ]
+    tied = set()
+    for frame, columns in [
+        (tables["addresses"], ["patient_id", "start_date"]),
+        (tables["practice_registrations"], ["patient_id", "start_date"]),
+        (ethnicity, ["patient_id", "date"]),
+    ]:
+        tied |= set(frame.loc[frame.duplicated(columns, keep=False), "patient_id"])
+
+    for name, frame in tables.items():
+        frame = frame[~frame["patient_id"].isin(tied)]
+        frame.to_csv(tables_dir / f"{name}.csv", index=False)
+    return len(tied)
+
+
+@pytest.fixture(scope="module")
+def tables_dir(tmp_path_factory):
+    tables_dir = tmp_path_factory.mktemp("synthetic") / "tables"
+    generate_tables(tables_dir, n_patients, file_format="csv", seed=seed, other_events_per_patient=2)
+    drop_tied_patients(tables_dir)
+    return tables_dir
+
+
+@pytest.fixture(scope="module")
+def patients(tables_dir):
+    return reference.Reference(reference.read_tables(tables_dir))
+
+
+def run_ehrql(action, tables_dir, output_dir):
+    command, definition, extra, action_output = ehrql_actions()[action]
+    output = output_dir / f"{action}{Path(action_output).suffix}"
+    args = [sys.executable, "-m", "ehrql", command, definition, "--dummy-tables", str(tables_dir), "--output", str(output)]
+    if extra:
+        args += ["--"] + extra
+    subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+    return output
+
+
+def compare_columns(actual, expected):
+    """
+    {column: number of patients that differ} plus example patient ids, comparing
+    nulls as equal.
+    """
+    actual = actual.set_index("patient_id").sort_index()
+    expected = expected.set_index("patient_id").sort_index()
+    mismatches = {}
+
+    missing_patients = expected.index.symmetric_difference(actual.index)
+    if len(missing_patients):
+        mismatches["<population>"] = (len(missing_patients), list(missing_patients[:5]))
+
+    common = expected.index.intersection(actual.index)
+    for column in expected.columns:
+        if column not in actual.columns:
+            mismatches[column] = (len(common), ["column missing from ehrql output"])
+            continue
+        a = actual.loc[common, column].astype(object)
+        e = expected.loc[common, column].astype(object)
+        same = (a == e) | (a.isna() & e.isna())
+        if not same.all():
+            mismatches[column] = (int((~same).sum()), list(common[~same.to_numpy()][:5]))
+    return mismatches
+
+
+def compare_measures(actual, expected):
+    """
+    Compare numerators and denominators. Disclosure control is enabled in the
+    measures definitions, so counts of 7 or less may be suppressed and others
+    are rounded; differences within that rounding are allowed.
+    """
+    # each measure has a single group column; its value can itself be null
+    measure_groups = {measure: column for measure, _, column, _ in expected}
+    actual_keys = {}
+    for row in actual.to_dict("records"):
+        column = measure_groups.get(row["measure"])
+        value = row[column] if column and pd.notna(row[column]) else None
+        key = (row["measure"], pd.Timestamp(row["interval_start"]).date(), column, value)
+        actual_keys[key] = (row["numerator"], row["denominator"])
+
+    def within_rounding(actual_count, expected_count):
+        if pd.isna(actual_count):
+            return expected_count <= 7
+        if expected_count <= 7:
+            return actual_count in (0, expected_count)
+        return abs(actual_count - expected_count) <= 5
+
+    mismatches = defaultdict(lambda: [0, []])
+    for key, (numerator, denominator) in expected.items():
+        numerator_actual, denominator_actual = actual_keys.get(key, (float("nan"), float("nan")))
+        for name, a, e in [("numerator", numerator_actual, numerator), ("denominator", denominator_actual, denominator)]:
+            if not within_rounding(a, e):
+                mismatches[f"{key[0]}:{name}"][0] += 1
+                mismatches[f"{key[0]}:{name}"][1].append(key[1:])
+
+    for key, (numerator, denominator) in actual_keys.items():
+        if key not in expected and (numerator or denominator):
+            mismatches[f"{key[0]}:unexpected rows"][0] += 1
+            mismatches[f"{key[0]}:unexpected rows"][1].append(key[1:])
+
+    return {name: (count, examples[:5]) for name, (count, examples) in mismatches.items()}
+
+
+@pytest.mark.parametrize("action", list(dataset_actions))
+def test_dataset_matches_reference(action, tables_dir, patients, tmp_path):
+    output = run_ehrql(action, tables_dir, tmp_path)
+    actual = pa.ipc.open_file(pa.memory_map(str(output))).read_all().to_pandas(date_as_object=True)
+    census_date = dataset_actions[action]
+    if census_date is None:
+        expected = reference.full_cohort(patients)
+    else:
+        expected = reference.census_cohort(patients, census_date)
+    assert compare_columns(actual, expected) == {}
+
+
+@pytest.mark.parametrize("action", measures_actions)
+def test_measures_match_reference(action, tables_dir, patients, tmp_path):
+    output = run_ehrql(action, tables_dir, tmp_path)
+    actual = pd.read_csv(output, dtype={column: str for column in group_columns})
+    assert compare_measures(actual, reference.annual_measures(patients, action)) == {}
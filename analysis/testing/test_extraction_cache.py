@@ -0,0 +1,85 @@
+import sys
+
+import pyarrow as pa
+
+import extraction_cache
+
+# stands in for ehrql: writes one arrow file per measure into a directory output,
+# or a single file, and counts how often it was run
+fake_ehrql = """
+import sys
+from pathlib import Path
+
+import pyarrow as pa
+
+args = sys.argv[1:]
+output = args[args.index("--output") + 1]
+runs = Path(args[1]).with_suffix(".runs")
+runs.write_text(str(int(runs.read_text()) + 1 if runs.exists() else 1))
+table = pa.table({"patient_id": [1, 2, 3]})
+if output.endswith("/:arrow"):
+    directory = Path(output).parent
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in ["measure_a", "measure_b"]:
+        with pa.ipc.new_file(str(directory / f"{name}.arrow"), table.schema) as writer:
+            writer.write_table(table)
+else:
+    Path(output).write_text("patient_id\\n1\\n2\\n3\\n")
+"""
+
+
+def setup(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction_cache, "cache_dir", tmp_path / "cache")
+    script = tmp_path / "fake_ehrql.py"
+    script.write_text(fake_ehrql)
+    definition = tmp_path / "definition.py"
+    definition.write_text("dataset = None\n")
+    return f"{sys.executable} {script}", definition
+
+
+def read_arrow(path):
+    return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+
+def test_directory_outputs_are_stored_and_served(tmp_path, monkeypatch):
+    ehrql_command, definition = setup(tmp_path, monkeypatch)
+    args = ["generate-dataset", str(definition), "--output", f"{tmp_path}/first/:arrow"]
+    assert extraction_cache.cached_extract(ehrql_command, args)[1] is False
+
+    args[-1] = f"{tmp_path}/second/:arrow"
+    assert extraction_cache.cached_extract(ehrql_command, args)[1] is True
+    assert definition.with_suffix(".runs").read_text() == "1"
+    served = sorted(path.name for path in (tmp_path / "second").iterdir())
+    assert served == ["measure_a.arrow", "measure_b.arrow"]
+    assert read_arrow(tmp_path / "second" / "measure_b.arrow").equals(
+        read_arrow(tmp_path / "first" / "measure_b.arrow")
+    )
+
+
+def test_output_format_is_part_of_the_key(tmp_path, monkeypatch):
+    ehrql_command, definition = setup(tmp_path, monkeypatch)
+    for output in [f"{tmp_path}/counts.csv", f"{tmp_path}/counts/:arrow"]:
+        assert extraction_cache.cached_extract(ehrql_command, ["generate-dataset", str(definition), "--output", output])[1] is False
+    assert (tmp_path / "counts.csv").read_text() == "patient_id\n1\n2\n3\n"
+
+
+def test_ehrql_version_is_part_of_the_key(tmp_path, monkeypatch):
+    ehrql_command, definition = setup(tmp_path, monkeypatch)
+    args = ["generate-dataset", str(definition), "--output", f"{tmp_path}/counts.csv"]
+    monkeypatch.setattr(extraction_cache, "ehrql_version", lambda: "1.0")
+    assert extraction_cache.cached_extract(ehrql_command, args)[1] is False
+    assert extraction_cache.cached_extract(ehrql_command, args, image="ehrql:v2")[1] is False
+    monkeypatch.setattr(extraction_cache, "ehrql_version", lambda: "1.1")
+    assert extraction_cache.cached_extract(ehrql_command, args)[1] is False
+    assert definition.with_suffix(".runs").read_text() == "3"
+
+
+def test_storing_an_entry_twice_keeps_the_first(tmp_path, monkeypatch):
+    ehrql_command, definition = setup(tmp_path, monkeypatch)
+    args = ["generate-dataset", str(definition), "--output", f"{tmp_path}/first/:arrow"]
+    key, _ = extraction_cache.cached_extract(ehrql_command, args)
+
+    # as if a second run finished the same extraction after the first stored it
+    extraction_cache.store(key, tmp_path / "first", ":arrow")
+    assert [path.name for path in (extraction_cache.cache_dir / key).iterdir()] == ["output"]
+    assert extraction_cache.cached_extract(ehrql_command, args)[1] is True
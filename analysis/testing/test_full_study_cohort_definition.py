@@ -42,17 +42,16 @@ test_data = {
             "date_of_first_migration_code": date(2010, 1, 1),
             "number_of_migration_codes": 1,
             "sex": "male",
-            "has_cob_migrant_code": False,
-            "has_asylum_or_refugee_migrant_code": False,
-            "has_interpreter_migrant_code": False,
+            "not_born_in_uk": False,
+            "refugee_asylum_status": False,
+            "english_not_main_language": True,
+            "interpreter_required": False,
             "date_of_first_practice_registration": date(2003, 1, 1),
-            "time_to_first_migration_code": 2557,
+            "time_from_1st_pracreg_first_migration_code_days": 2557,
             "latest_ethnicity_code": "10292001",
-            "latest_ethnicity_group": "Chinese or Other Ethnic Groups",
+            "latest_ethnicity_6_level_group": "Chinese or Other Ethnic Groups",
             "year_of_birth": 1999,
-            "msoa_code": "E02000864",
-            "TPP_death_date": None,
-            "ons_death_date": None
+            "date_of_death": None
         }  
     },
     # Not expected in population (disclosive sex)
@@ -94,19 +93,18 @@ test_data = {
             "date_of_first_migration_code": date(2010, 1, 1),
             "number_of_migration_codes": 1,
             "sex": "intersex",
-            "has_cob_migrant_code": False,
-            "has_asylum_or_refugee_migrant_code": False,
-            "has_interpreter_migrant_code": False,
+            "not_born_in_uk": False,
+            "refugee_asylum_status": False,
+            "english_not_main_language": True,
+            "interpreter_required": False,
             "date_of_first_practice_registration": date(2003, 1, 1),
-            "time_to_first_migration_code": 2557,
+            "time_from_1st_pracreg_first_migration_code_days": 2557,
             "latest_ethnicity_code": "10292001",
-            "latest_ethnicity_group": "Chinese or Other Ethnic Groups",
+            "latest_ethnicity_6_level_group": "Chinese or Other Ethnic Groups",
             "year_of_birth": 1999,
-            "msoa_code": "E02000864",
             "imd_decile": "3",
             "imd_quintile": "2",
-            "TPP_death_date": None,
-            "ons_death_date": None
+            "date_of_death": None
             }
     }
 }
\ No newline at end of file
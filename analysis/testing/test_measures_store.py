@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+import measures_store
+
+
+def measures_csv(rows):
+    columns = measures_store.measure_columns + ["age_band", "imd_quintile"]
+    return pd.DataFrame(rows, columns=columns).astype(str).replace("None", pd.NA)
+
+
+# an ungrouped measure alongside grouped ones used to make pandas warn that
+# all-NA columns will change the dtypes of the concatenated frame
+@pytest.mark.filterwarnings("error::FutureWarning")
+def test_subgroup_is_the_declared_group_by():
+    frame = measures_csv([
+        ["mig_status_2_cat_migrant", "2009-01-01", "2009-12-31", 0.1, 10, 100, None, None],
+        ["mig_status_2_cat_migrant_age", "2009-01-01", "2009-12-31", 0.1, 10, 100, "16-24", None],
+        # no patient has an IMD quintile, so every value of the group column is null
+        ["mig_status_2_cat_migrant_imd", "2009-01-01", "2009-12-31", 0.1, 10, 100, None, None],
+    ])
+    long = measures_store.to_long(frame).set_index("measure")
+    assert long.loc["mig_status_2_cat_migrant", "subgroup"] == "all"
+    assert long.loc["mig_status_2_cat_migrant_age", "subgroup"] == "age_band"
+    assert long.loc["mig_status_2_cat_migrant_age", "subgroup_value"] == "16-24"
+    assert long.loc["mig_status_2_cat_migrant_imd", "subgroup"] == "imd_quintile"
+    assert pd.isna(long.loc["mig_status_2_cat_migrant_imd", "subgroup_value"])
+
+
+def test_store_round_trip(tmp_path):
+    input_dir = tmp_path / "annual_counts"
+    (input_dir / "2cat").mkdir(parents=True)
+    measures_csv([
+        ["mig_status_2_cat_migrant_age", f"{year}-01-01", f"{year}-12-31", 0.5, 5, 10, band, None]
+        for year in (2009, 2010) for band in ("16-24", "25-34")
+    ]).to_csv(input_dir / "2cat" / "measure_mig_status_2_cat_migrant_age.csv", index=False)
+    # a measure with no rows is skipped
+    measures_csv([]).to_csv(input_dir / "2cat" / "measure_mig_status_2_cat_migrant_sex.csv", index=False)
+
+    store = tmp_path / "store"
+    assert measures_store.consolidate(input_dir, store) == {"2cat": 4}
+    rows = measures_store.read_measures(
+        categorisation="2cat", subgroup="age_band", interval_start="2010-01-01", store=store
+    )
+    assert sorted(rows["subgroup_value"]) == ["16-24", "25-34"]
@@ -0,0 +1,44 @@
+import numpy as np
+
+from person_time import non_overlapping, split_by_year, year_starts
+
+
+def random_spells(seed, n=2000, n_patients=200):
+    rng = np.random.default_rng(seed)
+    patient = rng.integers(0, n_patients, n)
+    start = rng.integers(14000, 16000, n)
+    end = start + rng.integers(-10, 400, n)
+    return patient, start, end
+
+
+def test_non_overlapping_counts_each_day_once():
+    patient, start, end = random_spells(43)
+    order, new_start = non_overlapping(patient, start.astype("float64"), end.astype("float64"))
+
+    assert np.all(new_start <= end[order])
+    for p in np.unique(patient):
+        mine = patient == p
+        registered = set()
+        for s, e in zip(start[mine], end[mine]):
+            registered.update(range(s, e + 1))
+        trimmed = [range(int(s), int(e) + 1) for s, e in zip(new_start[patient[order] == p], end[order][patient[order] == p])]
+        assert sum(len(days) for days in trimmed) == len(registered)
+        assert set().union(*trimmed) == registered
+
+
+def test_split_by_year_matches_daily_counts():
+    boundaries = year_starts(2009, 2012)
+    rng = np.random.default_rng(430)
+    start = rng.integers(boundaries[0], boundaries[-1], 500)
+    end = np.minimum(start + rng.integers(0, 900, 500), boundaries[-1] - 1)
+
+    spell, year, n_days = split_by_year(start, end, boundaries)
+    expected = np.zeros((len(start), len(boundaries) - 1), dtype="int64")
+    for i, (s, e) in enumerate(zip(start, end)):
+        for day in range(s, e + 1):
+            expected[i, np.searchsorted(boundaries, day, side="right") - 1] += 1
+
+    actual = np.zeros_like(expected)
+    np.add.at(actual, (spell, year), n_days)
+    assert np.array_equal(actual, expected)
+    assert np.all(n_days > 0)
@@ -0,0 +1,31 @@
+import run_project
+
+
+def test_output_globs_need_a_matching_file(tmp_path):
+    action = {"name": "counts", "outputs": [str(tmp_path / "counts" / "*.csv")]}
+    state = {"counts": "key"}
+    assert not run_project.is_up_to_date(action, "key", state)
+
+    (tmp_path / "counts").mkdir()
+    (tmp_path / "counts" / "measure_1.csv").write_text("")
+    assert run_project.is_up_to_date(action, "key", state)
+    assert not run_project.is_up_to_date(action, "other key", state)
+
+
+def test_r_scripts_depend_on_sourced_files():
+    files = run_project.input_files(["r:v2", "analysis/date_variable_checks.R"])
+    assert run_project.Path("analysis/lib/cohort_reader.R") in files
+
+
+def test_sourced_files_are_followed_recursively(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib" / "utility.R").write_text("f <- function() 1\n")
+    (tmp_path / "lib" / "reader.R").write_text('source(here::here("lib", "utility.R"))\n')
+    (tmp_path / "script.R").write_text(
+        '# source("lib/commented_out.R")\nsource("lib/reader.R")\n'
+    )
+    assert run_project.sourced_files("script.R") == [
+        run_project.Path("lib/reader.R"),
+        run_project.Path("lib/utility.R"),
+    ]
@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from snapshots import address_history, as_of, registration_history
+
+
+def read_dummy_table(name):
+    convert_options = pa_csv.ConvertOptions(true_values=["T"], false_values=["F"])
+    return pa_csv.read_csv(f"dummy_tables/{name}.csv", convert_options=convert_options)
+
+
+def for_patient_on(rows, patient_id, on, sort_by):
+    """
+    ehrQL's for_patient_on, one row at a time: of the patient's rows starting on
+    or before `on` and not ending before it, the last by sort_by (nulls first).
+    Returns the row's index, or -1.
+    """
+    def key(row):
+        return tuple((value is not None, value or 0) for value in sort_by(row))
+
+    active = [
+        (key(row), i) for i, row in enumerate(rows)
+        if row["patient_id"] == patient_id and row["start_date"] is not None and on is not None
+        and row["start_date"] <= on and not (row["end_date"] is not None and row["end_date"] < on)
+    ]
+    return max(active)[1] if active else -1
+
+
+def address_key(row):
+    return [int(bool(row["has_postcode"])), row["start_date"], row["end_date"], row["address_id"]]
+
+
+def registration_key(row):
+    return [row["start_date"], row["end_date"]]
+
+
+def queries(table, n, seed):
+    """
+    Random (patient, date) pairs, including every start date, the days either
+    side of every end date, an unknown patient and null dates.
+    """
+    rng = np.random.default_rng(seed)
+    patient_ids = table.column("patient_id").to_pylist()
+    boundaries = [
+        day + timedelta(days=shift)
+        for column in ("start_date", "end_date")
+        for day in table.column(column).to_pylist() if day is not None
+        for shift in (-1, 0, 1)
+    ]
+    patients = list(rng.choice(patient_ids + [max(patient_ids) + 1], n))
+    dates = [date(1900, 1, 1) + timedelta(days=int(day)) for day in rng.integers(0, 365 * 130, n)]
+    dates = [boundaries[i % len(boundaries)] if i % 3 == 0 else day for i, day in enumerate(dates)]
+    dates = [None if i % 50 == 0 else day for i, day in enumerate(dates)]
+    return patients, dates
+
+
+def check_history(table, history, sort_by, n=5000, seed=44):
+    patients, dates = queries(table, n, seed)
+    rows = table.to_pylist()
+    expected = [for_patient_on(rows, patient_id, on, sort_by) for patient_id, on in zip(patients, dates)]
+    actual = as_of(history, np.array(patients), np.array(dates, dtype="datetime64[D]"))
+    assert sum(row >= 0 for row in expected) > n // 4
+    assert actual.tolist() == expected
+
+
+def test_addresses_match_for_patient_on():
+    addresses = read_dummy_table("addresses")
+    check_history(addresses, address_history(addresses), address_key)
+
+
+def test_registrations_match_for_patient_on():
+    registrations = read_dummy_table("practice_registrations")
+    check_history(registrations, registration_history(registrations), registration_key)
+
+
+def test_overlapping_inverted_and_null_spans():
+    # short, dense histories, so most dates have several active rows
+    rng = np.random.default_rng(2044)
+    n = 600
+    start = [date(2000, 1, 1) + timedelta(days=int(day)) for day in rng.integers(0, 400, n)]
+    end = [day + timedelta(days=int(length)) for day, length in zip(start, rng.integers(-30, 200, n))]
+    addresses = pa.table({
+        "patient_id": rng.integers(1, 40, n),
+        "start_date": pa.array([None if i % 17 == 0 else day for i, day in enumerate(start)], pa.date32()),
+        "end_date": pa.array([None if i % 5 == 0 else day for i, day in enumerate(end)], pa.date32()),
+        "has_postcode": pa.array([None if i % 7 == 0 else bool(v) for i, v in enumerate(rng.random(n) < 0.7)]),
+        "address_id": np.arange(n)[::-1],
+    })
+    check_history(addresses, address_history(addresses), address_key, n=3000)
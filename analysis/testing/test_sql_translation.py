@@ -0,0 +1,135 @@
+## The SQL translation of the migrant flags and measures denominators, run on
+## SQLite over synthetic tables, against the pandas reference implementation of
+## the ehrQL definitions (reference_implementation.py).
+## Author: Yamina Boukari
+####
+
+import sqlite3
+from datetime import date as Date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pytest
+
+import codelists
+import reference_implementation as reference
+import sql_translation
+from codelist_index import build_codelist_index
+from generate_synthetic_tables import generate_tables
+
+dialect = sql_translation.dialects["sqlite"]
+dates = ["2021-03-21", sql_translation.study_end_date]
+
+
+def rewrite_table(tables_dir, name, edit):
+    path = tables_dir / f"{name}.arrow"
+    table = feather.read_table(path)
+    frame = edit(table.to_pandas())
+    with pa.ipc.new_file(str(path), table.schema) as writer:
+        writer.write_table(pa.Table.from_pandas(frame, schema=table.schema, preserve_index=False))
+
+
+def with_edge_cases(tables_dir):
+    """
+    Move some dates onto the boundaries the SQL has to get right, which random
+    dates rarely hit: deaths on an interval start or census date, events on
+    the day of birth, death or the date the flags are as of, and registrations
+    starting or ending on interval boundaries.
+    """
+    def patients(frame):
+        died = frame.index[frame["date_of_death"].notna()]
+        frame.loc[died[::3], "date_of_death"] = Date(2015, 1, 1)
+        frame.loc[died[1::3], "date_of_death"] = Date(2021, 3, 21)
+        return frame
+
+    def clinical_events(frame):
+        people = feather.read_table(tables_dir / "patients.arrow").to_pandas().set_index("patient_id")
+        for i, column in enumerate(["date_of_death", "date_of_birth"]):
+            rows = frame.index[i::7]
+            on = frame.loc[rows, "patient_id"].map(people[column])
+            frame.loc[rows, "date"] = on.where(on.notna(), frame.loc[rows, "date"])
+        frame.loc[frame.index[2::7], "date"] = Date(2021, 3, 21)
+        return frame
+
+    def practice_registrations(frame):
+        frame.loc[frame.index[::5], "start_date"] = Date(2012, 1, 1)
+        frame.loc[frame.index[1::5], "end_date"] = Date(2014, 12, 31)
+        frame.loc[frame.index[2::5], "end_date"] = Date(2016, 1, 1)
+        return frame
+
+    rewrite_table(tables_dir, "clinical_events", clinical_events)
+    rewrite_table(tables_dir, "patients", patients)
+    rewrite_table(tables_dir, "practice_registrations", practice_registrations)
+
+
+@pytest.fixture(scope="module")
+def tables_dir(tmp_path_factory):
+    tables_dir = tmp_path_factory.mktemp("synthetic") / "tables"
+    generate_tables(tables_dir, 2000, seed=50, other_events_per_patient=2)
+    with_edge_cases(tables_dir)
+    return tables_dir
+
+
+@pytest.fixture(scope="module")
+def index():
+    return build_codelist_index()
+
+
+@pytest.fixture(scope="module")
+def connection(tables_dir, index):
+    path = tables_dir / "migration.sqlite"
+    sql_translation.build_database("sqlite", path, tables_dir, index)
+    connection = sqlite3.connect(path)
+    yield connection
+    connection.close()
+
+
+@pytest.fixture(scope="module")
+def patients(tables_dir):
+    return reference.Reference(reference.read_tables(tables_dir))
+
+
+def query(connection, sql):
+    result = pd.read_sql(sql, connection).set_index("patient_id")
+    return result.apply(
+        lambda values: pd.to_datetime(values) if values.name.endswith("_date") else values
+    )
+
+
+def same_dates(actual, expected):
+    expected = expected.reindex(actual.index)
+    return ((actual == expected) | (actual.isna() & expected.isna())).all()
+
+
+@pytest.mark.parametrize("date", dates)
+def test_first_code_dates_and_indicators(connection, index, patients, date):
+    up_to = pd.Timestamp(date)
+    first_dates = query(connection, sql_translation.first_migrant_code_dates_sql(dialect, index, date))
+    indicators = query(connection, sql_translation.migrant_indicators_sql(dialect, index, date))
+    expected_indicators = patients.migrant_indicators(up_to)
+
+    for name, codelist_name in codelists.migrant_flag_codelists.items():
+        expected = patients.first_date(patients.codes(codelist_name), up_to)
+        # every patient with a code is in the results
+        assert set(expected.dropna().index) <= set(first_dates.index)
+        assert same_dates(first_dates[f"first_{name}_date"], expected), name
+        assert (indicators[name].astype(bool) == expected_indicators[name].reindex(indicators.index)).all(), name
+    assert indicators["any_migrant"].sum() > 0
+
+
+@pytest.mark.parametrize("date", dates)
+def test_first_code_dates_excluding_each_flag(connection, index, patients, date):
+    up_to = pd.Timestamp(date)
+    first_dates = query(connection, sql_translation.first_any_migrant_code_dates_excluding_sql(dialect, index, date))
+    any_migrant = patients.codes("all_migrant_codes")
+    for name in codelists.migrant_component_flags:
+        codes = any_migrant - patients.codes(codelists.migrant_flag_codelists[name])
+        assert same_dates(first_dates[f"first_any_migrant_excl_{name}_date"], patients.first_date(codes, up_to)), name
+
+
+def test_measures_denominators(connection, patients):
+    actual = pd.read_sql(sql_translation.measures_denominators_sql(dialect), connection)
+    expected = [len(reference.interval_state(patients, year)["groups"]) for year in reference.interval_years]
+    assert [start for start, _ in sql_translation.intervals()] == [f"{year}-01-01" for year in reference.interval_years]
+    assert actual["denominator"].tolist() == expected
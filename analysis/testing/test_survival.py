@@ -0,0 +1,82 @@
+from datetime import date
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+import survival
+
+
+def product_limit(time, event, max_days):
+    """
+    Unrounded Kaplan-Meier survival on each day 0..max_days, one patient at a time.
+    """
+    curve = []
+    s = 1.0
+    for day in range(max_days + 1):
+        at_risk = np.sum(time >= day)
+        events = np.sum((time == day) & event)
+        if at_risk:
+            s *= 1 - events / at_risk
+        curve.append(s)
+    return np.array(curve)
+
+
+def test_unrounded_matches_product_limit():
+    rng = np.random.default_rng(41)
+    n, max_days = 2000, 60
+    time = rng.integers(0, max_days + 1, n)
+    event = rng.random(n) < 0.4
+    strata = rng.integers(0, 3, n)
+
+    events, censored = survival.stratified_counts(strata, 3, time, event, max_days)
+    estimates = survival.kaplan_meier(events, censored, rounding_to=1)
+    for stratum in range(3):
+        in_stratum = strata == stratum
+        expected = product_limit(time[in_stratum], event[in_stratum], max_days)
+        np.testing.assert_allclose(estimates["survival"][stratum], expected)
+        assert estimates["n_at_risk"][stratum, 0] == in_stratum.sum()
+
+
+def test_rounded_small_strata_stay_in_range():
+    # 12 patients, one censored on day 0 and 11 events on day 1: rounded to 6,
+    # that's 9 events against a risk set of 6
+    events = np.array([[0, 11]])
+    censored = np.array([[1, 0]])
+    estimates = survival.kaplan_meier(events, censored)
+    assert estimates["n_events"][0, 1] <= estimates["n_at_risk"][0, 1]
+    assert estimates["survival"][0, 1] == 0
+    assert estimates["cumulative_incidence"][0, 1] == 1
+
+    rng = np.random.default_rng(6)
+    n_strata, n_days = 200, 30
+    events = rng.poisson(0.4, (n_strata, n_days))
+    censored = rng.poisson(0.2, (n_strata, n_days))
+    estimates = survival.kaplan_meier(events, censored)
+    assert np.all(estimates["n_events"] <= estimates["n_at_risk"])
+    assert np.all((estimates["survival"] >= 0) & (estimates["survival"] <= 1))
+    assert np.all(np.diff(estimates["survival"], axis=1) <= 0)
+    assert np.all((estimates["survival_lower"] >= 0) & (estimates["survival_upper"] <= 1))
+
+
+def test_survival_curves_from_cohort(tmp_path):
+    cohort = pa.table({
+        "baseline_date": [date(2010, 1, 1)] * 4 + [None],
+        "censor_date": [date(2010, 1, 11), date(2010, 1, 11), date(2010, 1, 6), date(2009, 1, 1), date(2010, 1, 11)],
+        "processed_first_migration_code_date": [date(2010, 1, 3), None, date(2010, 1, 9), None, date(2010, 1, 3)],
+        "sex": ["female", "male", "female", "male", "male"],
+    })
+    path = tmp_path / "km.arrow"
+    with pa.ipc.new_file(str(path), cohort.schema) as writer:
+        writer.write_table(cohort)
+
+    curves, n_excluded = survival.survival_curves(path, ["sex"], max_days=30, rounding_to=1)
+    # censored before baseline, and no baseline
+    assert n_excluded == 2
+    everyone = curves[curves["group"] == "all"].set_index("time_days")
+    # an event on day 2 (of 3 at risk), a censoring on day 5 and on day 10; the
+    # code after the day 5 censoring isn't an event
+    assert list(everyone.index) == [0, 2, 5, 10]
+    assert everyone.loc[2, "survival"] == pytest.approx(2 / 3)
+    female = curves[(curves["group"] == "sex") & (curves["group_value"] == "female")]
+    assert female["survival"].iloc[-1] == 0.5
@@ -6,77 +6,52 @@
 
 from ehrql import case, when, years
 from ehrql.tables.tpp import addresses, practice_registrations, clinical_events, patients
+import age_bands
 import codelists
+import population
+
+def build_ethnicity_vars(on_or_before=None):
+    """
+    Latest ethnicity code (optionally on or before a date) and its 6- and
+    16-level groups, all mapped from the same code column.
+    """
+    ethnicity_events = clinical_events.where(
+        clinical_events.snomedct_code.is_in(codelists.ethnicity_6_level_codelist)
+    )
+    if on_or_before is not None:
+        ethnicity_events = ethnicity_events.where(
+            clinical_events.date.is_on_or_before(on_or_before)
+        )
+
+    latest_ethnicity_code = (
+        ethnicity_events
+        .sort_by(clinical_events.date)
+        .last_for_patient()
+        .snomedct_code
+    )
+
+    return {
+        "latest_ethnicity_code": latest_ethnicity_code,
+        "latest_ethnicity_16_level_group": latest_ethnicity_code.to_category(
+            codelists.ethnicity_16_level_codelist),
+        "latest_ethnicity_6_level_group": latest_ethnicity_code.to_category(
+            codelists.ethnicity_6_level_codelist),
+    }
 
 def build_common_vars(INTERVAL):
     # -------------------
     # Denominator 
     # -------------------
-    was_alive_on_1Jan = patients.is_alive_on(INTERVAL.start_date)
-
-    was_registered_at_any_point_during_interval = practice_registrations.where(
-        # registered for the entire interval
-        ((practice_registrations.start_date.is_on_or_before(INTERVAL.start_date)) 
-        & (practice_registrations.end_date.is_on_or_after(INTERVAL.end_date))) |
-        
-        # registered during the interval and end date is after the interval end date
-        ((practice_registrations.start_date.is_after(INTERVAL.start_date))
-         & (practice_registrations.end_date.is_on_or_after(INTERVAL.end_date))) |
-         
-         # registered before the interval and registration is ongoing
-         ((practice_registrations.start_date.is_on_or_before(INTERVAL.start_date)) &
-          (practice_registrations.end_date.is_null())) |
-          
-          # registered after interval start date and registration is ongoing
-          ((practice_registrations.start_date.is_after(INTERVAL.start_date)) &
-           (practice_registrations.end_date.is_null())) |
-           
-           # registered before the interval start date and end date is before the end date, but after the start date 
-           ((practice_registrations.start_date.is_before(INTERVAL.start_date)) &
-           (practice_registrations.end_date.is_between_but_not_on(INTERVAL.start_date, INTERVAL.end_date))) |
-           
-           # registered for part of the interval only
-           ((practice_registrations.start_date.is_between_but_not_on(INTERVAL.start_date, INTERVAL.end_date)) &
-            (practice_registrations.end_date.is_between_but_not_on(INTERVAL.start_date, INTERVAL.end_date)))
-    ).exists_for_patient()
-
-    has_recorded_sex = patients.sex.is_in(["male", "female"])
-
-    has_possible_age = (
-        (patients.age_on(INTERVAL.start_date) < 110)
-        & (patients.age_on(INTERVAL.start_date) > 0)
-    )
-
-    denominator = (
-        was_alive_on_1Jan
-        & was_registered_at_any_point_during_interval
-        & has_recorded_sex
-        & has_possible_age
-    )
+    denominator = population.interval_denominator(INTERVAL)
 
     # -------------------
     # Subgroup variables
     # -------------------
     age = patients.age_on(INTERVAL.start_date)
-    age_band = case(
-        when(age < 16).then("0-15"),
-        when((age >= 16) & (age < 25)).then("16-24"),
-        when((age >= 25) & (age < 35)).then("25-34"),
-        when((age >= 35) & (age < 50)).then("35-49"),
-        when((age >= 50) & (age < 65)).then("50-64"),
-        when((age >= 65) & (age < 75)).then("65-74"),
-        when((age >= 75) & (age < 85)).then("75-84"),
-        when(age >= 85).then("85 plus"),
-        otherwise="missing",
-    )
+    age_band = age_bands.band_expression(age, age_bands.age_band_edges, otherwise=age_bands.missing_label)
 
     ethnicity = (
-        clinical_events
-        .where(clinical_events.snomedct_code.is_in(codelists.ethnicity_6_level_codelist))
-        .where(clinical_events.date.is_on_or_before(INTERVAL.end_date))
-        .sort_by(clinical_events.date)
-        .last_for_patient()
-        .snomedct_code.to_category(codelists.ethnicity_6_level_codelist)
+        build_ethnicity_vars(INTERVAL.end_date)["latest_ethnicity_6_level_group"]
         .when_null_then("unknown")
     )
 